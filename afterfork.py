@@ -0,0 +1,25 @@
+'''Resetting per-process state in child processes after fork
+
+Locks (which another thread may have been holding when the process forked)
+and file handles with a file position (which is shared with the parent) must
+not be used by a child process as they are. Objects that hold them call
+`register(self)` and define an `after_fork()` method, which is called in the
+child process after fork.
+'''
+import os
+import weakref
+
+_objects = weakref.WeakSet()
+
+
+def register(obj):
+    '''Calls `obj.after_fork()` in child processes after fork (as long as
+    `obj` is alive)'''
+    _objects.add(obj)
+
+
+def _after_fork_in_child():
+    for obj in list(_objects):
+        obj.after_fork()
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
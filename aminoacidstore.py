@@ -0,0 +1,58 @@
+'''Precomputed translations of the nucleotide sequences
+
+The amino acid sequences are stored back-to-back in a single raw file:
+
+- `<name>.bin`: the amino acid sequences (ASCII, no separators)
+- `<name>.offsets.npy` & `<name>.lengths.npy`: position of each sequence, as
+  a compact table of lengths (see recordoffsets.py; older stores have
+  `<name>.starts.npy` instead)
+
+Sequences that cannot be translated are stored empty (the server translates
+them, and fails, on demand).
+'''
+import numpy as np
+
+from fna2faa_gmsc import translate_batch
+from recordoffsets import RecordOffsets, RecordStarts, write_record_lengths
+from indexmanifest import check_index_file
+
+
+class AminoAcidStoreWriter:
+    def __init__(self, oname):
+        self.oname = oname
+        self.out = open(oname + '.bin', 'wb')
+        self.lengths = []
+
+    def add(self, seqs):
+        '''Translates and adds a batch of nucleotide sequences (list of bytes)'''
+        if not seqs:
+            return
+        aas = translate_batch([s.decode('ascii') for s in seqs], skip_invalid=True)
+        lens = np.array([len(aa) for aa in aas], np.uint64)
+        # Kept with the narrowest type for the batch, as there is one per sequence
+        self.lengths.append(lens.astype(np.min_scalar_type(int(lens.max()))))
+        self.out.write(''.join(aas).encode('ascii'))
+
+    def close(self):
+        self.out.close()
+        write_record_lengths(np.concatenate(self.lengths) if self.lengths else np.zeros(0, np.uint8),
+                             self.oname)
+
+
+class AminoAcidStore:
+    def __init__(self, prefix):
+        check_index_file(prefix + '.bin')
+        self.data = np.memmap(prefix + '.bin', dtype=np.uint8, mode='r')
+        self.offsets = RecordOffsets(prefix)
+        # The offset of every sequence plus the total size (computed on access)
+        self.starts = RecordStarts(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, ix):
+        start, end = self.offsets.span(ix)
+        return self.data[start:end].tobytes()
+
+    def get_many(self, ixs):
+        return [self.get(ix) for ix in ixs]
@@ -0,0 +1,202 @@
+'''Single-pass, parallel encoding of the annotation tables
+
+The `.tsv.xz` annotation tables have one line per sequence. Each column is
+encoded as integer codes (in `<basename>.npy`, uint16 unless there are more
+than 65536 labels) into a sorted table of labels (in `<basename>.index.tsv`),
+with an empty value encoded as 0 and, if any is present, the label `Unknown`
+added to the table.
+
+All the columns are encoded in a single pass over the file: groups of xz
+blocks are decompressed and parsed in worker processes, which encode each
+column with codes into a per-group table of labels. The lines that straddle
+two groups are put back together in the main process. Once all labels are
+known, the per-group codes (kept in temporary files) are translated into the
+final ones.
+'''
+import os
+import io
+import csv
+import lzma
+from functools import partial
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from xzblocks import read_block_layout, decompress_block
+
+# Uncompressed size of the data parsed by a worker at a time
+GROUP_SIZE = 64 * 1024 * 1024
+
+UNKNOWN_LABEL = 'Unknown'
+
+
+def sort_labels(labels, tag):
+    if tag == 'taxonomy':
+        # Sorting by rank makes all the lineages in any clade contiguous
+        return sorted(labels, key=lambda t: t.split(';'))
+    return sorted(labels)
+
+
+def encode_lines(data, columns):
+    '''Encodes the given columns of complete TSV lines
+
+    Returns `(nr_lines, [(labels, codes)])`, with one entry per column
+    (`codes` indexes into `labels`)
+    '''
+    import pandas as pd
+    if not data:
+        return 0, [([], np.zeros(0, np.int32)) for _ in columns]
+    df = pd.read_csv(io.BytesIO(data),
+                     sep='\t',
+                     header=None,
+                     usecols=columns,
+                     dtype=str,
+                     quoting=csv.QUOTE_NONE,
+                     keep_default_na=False,
+                     na_filter=False)
+    encoded = []
+    for c in columns:
+        codes, labels = pd.factorize(df[c])
+        encoded.append((labels.tolist(), codes.astype(np.int32)))
+    return len(df), encoded
+
+
+def _parse_group(infile, columns, group):
+    '''Parses a group of blocks (or of raw data)
+
+    Returns `(head, tail, nr_lines, encoded)`, where `head` and `tail` are the
+    partial lines at the start and end of the group. If the group contains
+    no line break, `tail` is None and `head` has all the data.
+    '''
+    if isinstance(group, bytes):
+        data = group
+    else:
+        fd = os.open(infile, os.O_RDONLY)
+        try:
+            data = b''.join(decompress_block(fd, block) for block in group)
+        finally:
+            os.close(fd)
+    first = data.find(b'\n')
+    if first == -1:
+        return data, None, 0, None
+    last = data.rfind(b'\n')
+    nr_lines, encoded = encode_lines(data[first + 1:last + 1], columns)
+    return data[:first + 1], data[last + 1:], nr_lines, encoded
+
+
+def _iter_groups(infile):
+    '''Yields groups of xz blocks, each up to GROUP_SIZE uncompressed bytes
+
+    If the file has a single block (so blocks cannot be decompressed in
+    parallel), chunks of data are read here and yielded instead
+    '''
+    blocks = read_block_layout(infile)
+    if len(blocks) <= 1:
+        with lzma.open(infile, 'rb') as ifile:
+            while data := ifile.read(GROUP_SIZE):
+                yield data
+        return
+    group = []
+    size = 0
+    for block in blocks:
+        group.append(block)
+        size += int(block[3])
+        if size >= GROUP_SIZE:
+            yield group
+            group = []
+            size = 0
+    if group:
+        yield group
+
+
+def _iter_parsed(infile, columns, nr_workers):
+    '''Yields `(nr_lines, encoded)` (see `encode_lines`) for consecutive
+    pieces of the file, in order'''
+    parse = partial(_parse_group, infile, columns)
+    pending = b''
+    with ProcessPoolExecutor(nr_workers) as executor:
+        running = deque()
+        groups = _iter_groups(infile)
+        while True:
+            # Keep a bounded number of groups in flight
+            for group in groups:
+                running.append(executor.submit(parse, group))
+                if len(running) >= 2 * nr_workers:
+                    break
+            if not running:
+                break
+            head, tail, nr_lines, encoded = running.popleft().result()
+            if tail is None:
+                pending += head
+                continue
+            yield encode_lines(pending + head, columns)
+            yield nr_lines, encoded
+            pending = tail
+    if pending:
+        yield encode_lines(pending, columns)
+
+
+def build_annotation_indices(infile, outputs, nr_workers=None):
+    '''Encodes several columns of an annotation table
+
+    `outputs` is a list of `(col_ix, tag, basename)`: column `col_ix` is
+    written to `<basename>.index.tsv` and `<basename>.npy`, with labels
+    sorted according to `tag` (see `sort_labels`)
+    '''
+    if nr_workers is None:
+        nr_workers = os.cpu_count()
+    columns = [c for c, _, _ in outputs]
+    labels = [set() for _ in outputs]
+    # Codes into the labels of each piece, which are only translated into the
+    # final codes once all labels are known
+    tmp_codes = [open(f'{basename}.codes.tmp', 'wb') for _, _, basename in outputs]
+    pieces = []
+    nr_lines = 0
+    try:
+        for n, encoded in _iter_parsed(infile, columns, nr_workers):
+            if not n:
+                continue
+            for i, (piece_labels, codes) in enumerate(encoded):
+                labels[i].update(piece_labels)
+                tmp_codes[i].write(codes.tobytes())
+            pieces.append((n, [piece_labels for piece_labels, _ in encoded]))
+            if nr_lines // 10_000_000 != (nr_lines + n) // 10_000_000:
+                print(f'Processed {(nr_lines + n)//1_000_000}m')
+            nr_lines += n
+        for out in tmp_codes:
+            out.close()
+
+        for i, (_, tag, basename) in enumerate(outputs):
+            label_set = labels[i]
+            if '' in label_set:
+                label_set.remove('')
+                label_set.add(UNKNOWN_LABEL)
+            order = sort_labels(label_set, tag)
+            print(f'{basename}: {len(order)} labels')
+            with open(f'{basename}.index.tsv', 'wt') as out:
+                for n, item in enumerate(order):
+                    out.write(f'{n}\t{item}\n')
+            final = {item: n for n, item in enumerate(order)}
+            final[''] = 0
+
+            tmp = np.memmap(f'{basename}.codes.tmp', dtype=np.int32, mode='r', shape=(nr_lines,)) \
+                    if nr_lines else np.zeros(0, np.int32)
+            code_dtype = (np.uint16 if len(order) <= 2**16 else np.uint32)
+            odata = np.lib.format.open_memmap(f'{basename}.npy',
+                                              mode='w+',
+                                              dtype=code_dtype,
+                                              shape=(nr_lines,))
+            start = 0
+            for n, piece_labels in pieces:
+                translate = np.array([final[label] for label in piece_labels[i]], code_dtype)
+                odata[start:start + n] = translate[tmp[start:start + n]]
+                start += n
+            odata.flush()
+            del odata, tmp
+    finally:
+        for out in tmp_codes:
+            out.close()
+        for _, _, basename in outputs:
+            if os.path.exists(f'{basename}.codes.tmp'):
+                os.unlink(f'{basename}.codes.tmp')
@@ -1,14 +1,23 @@
-from flask import Flask, request, jsonify
-from datetime import datetime
+from time import perf_counter, time, sleep
+STARTUP_START = perf_counter()
+
+from flask import Flask, Response, request, jsonify, stream_with_context
+import os
 from os import path, environ
+import sys
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from collections import namedtuple
 
-from seqinfo import SeqInfo, ClusterIx, with_digits
-from search import do_search, load_search_results
+from lrucache import LRUCache
+from seqinfo import SeqInfo, ClusterIx, preload_resources, with_digits, MAX_TOTAL_RESULTS, MAX_THICK_RESULTS, NR_PROCESSES
+from search import do_search, do_search_batch, parse_fasta, save_search_result, open_search_result, search_result_path, delete_search_result, list_saved_searches
+from searchregistry import SearchRegistry, QueueFullError, RUNNING, DONE, FAILED, EXPIRED
 
 NR_THREADS_GMSC_MAPPER = 2
+MAX_SEQ_INFO_MULTI = 10_000
+MAX_CLUSTER_INFO_MULTI = 100
+MAX_SEQ_EXACT = 10_000
+MAX_KMER_SEARCH_QUERIES = 100
+MAX_KMER_SEARCH_HITS = 100
 
 DB_DIR = 'gmsc-db'
 if path.exists(DB_DIR):
@@ -17,11 +26,20 @@ if path.exists(DB_DIR):
     clusterinfo = ClusterIx()
     IS_DEMO = False
 else:
-    import sys
     sys.stderr.write(f'WARNING: Database directory {DB_DIR} not found\n')
     sys.stderr.write(f'WARNING: Using demo database\n')
     IS_DEMO = True
 
+def preload_indices():
+    '''Loads all indices now rather than on first use
+
+    When called before forking worker processes (see gunicorn.conf.py), the
+    indices are shared by all the workers.
+    '''
+    if not IS_DEMO:
+        for obj in (seqinfo90, seqinfo100, clusterinfo):
+            preload_resources(obj)
+
 app = Flask('GMSC')
 
 
@@ -46,22 +64,26 @@ def get_seq_info_multi():
     entries = request.json.get('seq_ids')
     if entries is None:
         return {"error": "Missing seq_ids parameter"}, 400
-    if len(entries) > 100:
+    if len(entries) > MAX_SEQ_INFO_MULTI:
         return {"error": "Too many seq_ids"}, 400
-    rs = []
-    for seq_id in entries:
+    by_db = {'90AA': [], '100AA': []}
+    for i, seq_id in enumerate(entries):
         tokens = seq_id.split(".")
         if len(tokens) != 3:
             return {"error": "Invalid sequence ID (only 'GMSC10' database supported)"}, 400
         (db, cluster_level, seq_ix) = tokens
         if db != 'GMSC10':
             return {"error": "Invalid sequence ID"}, 400
-        if cluster_level == '90AA':
-            rs.append(seqinfo90.get_seqinfo(seq_id))
-        elif cluster_level == '100AA':
-            rs.append(seqinfo100.get_seqinfo(seq_id))
-        else:
+        if cluster_level not in by_db:
             return {"error": "Invalid sequence ID: does not match GMSC10 ID format"}, 400
+        by_db[cluster_level].append(i)
+    rs = [None] * len(entries)
+    for cluster_level, positions in by_db.items():
+        if not positions:
+            continue
+        seqinfo = (seqinfo90 if cluster_level == '90AA' else seqinfo100)
+        for i, r in zip(positions, seqinfo.get_seqinfo_multi([entries[i] for i in positions])):
+            rs[i] = r
     return rs
 
 
@@ -90,10 +112,9 @@ def parse_bool(s : str, None_is_false : bool = False) -> bool:
         return False
     return None
 
-@app.post('/v1/seq-filter/')
-def get_seq_filter():
-    hq_only = request.form.get('hq_only', False)
-    habitat = request.form.get('habitat')
+def parse_seq_filter_args(form):
+    hq_only = form.get('hq_only', False)
+    habitat = form.get('habitat')
     if habitat is None:
         habitat = []
     else:
@@ -101,91 +122,396 @@ def get_seq_filter():
         # Remove empty strings (also deals with the case where query is empty
         # string by transforming it to the empty list, rather than [''])
         habitat = [h for h in habitat if h]
-    taxonomy = request.form.get('taxonomy')
+    taxonomy = form.get('taxonomy')
     if taxonomy is None:
         taxonomy = ""
-    results = seqinfo90.seq_filter(
-                            parse_bool(hq_only, None_is_false=True),
-                            habitat,
-                            taxonomy,
-                            quality_antifam=parse_bool(request.form.get('quality_antifam')),
-                            quality_terminal=parse_bool(request.form.get('quality_terminal')),
-                            quality_rnacode=float_or_None(request.form.get('quality_rnacode')),
-                            quality_metap=float_or_None(request.form.get('quality_metap')),
-                            quality_metat=int_or_None(request.form.get('quality_metat')),
-                            quality_riboseq=float_or_None(request.form.get('quality_riboseq')),
-                            )
+    return {
+            'hq_only': parse_bool(hq_only, None_is_false=True),
+            'habitat_q': habitat,
+            'taxonomy_q': taxonomy,
+            'quality_antifam': parse_bool(form.get('quality_antifam')),
+            'quality_terminal': parse_bool(form.get('quality_terminal')),
+            'quality_rnacode': float_or_None(form.get('quality_rnacode')),
+            'quality_metap': float_or_None(form.get('quality_metap')),
+            'quality_metat': int_or_None(form.get('quality_metat')),
+            'quality_riboseq': float_or_None(form.get('quality_riboseq')),
+            }
+
+@app.post('/v1/seq-filter/')
+def get_seq_filter():
+    before_ix = None
+    cursor = request.form.get('cursor')
+    if cursor:
+        tokens = cursor.split(".")
+        if len(tokens) != 3 or tokens[0] != 'GMSC10' or tokens[1] != '90AA':
+            return {"error": "Invalid cursor (must be a GMSC10.90AA identifier)"}, 400
+        try:
+            before_ix = int(tokens[2])
+        except ValueError:
+            return {"error": "Invalid cursor (must be a GMSC10.90AA identifier)"}, 400
+    results = seqinfo90.seq_filter(**parse_seq_filter_args(request.form), before_ix=before_ix)
+    next_cursor = None
+    if len(results) == MAX_TOTAL_RESULTS:
+        next_cursor = results[-1]['seq_id']
     return jsonify({
         "status": "Ok",
         "results": results,
+        "next_cursor": next_cursor,
         })
 
+@app.post('/v1/seq-filter-export/')
+def get_seq_filter_export():
+    import json
+    import zlib
+    filter_args = parse_seq_filter_args(request.form)
+    oformat = request.form.get('format', 'tsv')
+    if oformat not in ('tsv', 'ndjson'):
+        return {"error": "Invalid format (must be 'tsv' or 'ndjson')"}, 400
+    use_gzip = parse_bool(request.form.get('gzip'), None_is_false=True)
+    # Evaluated here so that invalid queries fail before streaming starts
+    hits = seqinfo90.iter_filter_hits(**filter_args)
+
+    def generate_lines():
+        if oformat == 'tsv':
+            yield 'seq_id\thabitat\ttaxonomy\n'
+        for ixs in hits:
+            habitats, taxonomies = seqinfo90.get_annotations(ixs)
+            if oformat == 'tsv':
+                yield ''.join([
+                    f'{with_digits("GMSC10.90AA", ix)}\t{h}\t{t}\n'
+                    for ix, h, t in zip(ixs.tolist(), habitats, taxonomies)])
+            else:
+                yield ''.join([
+                    json.dumps({'seq_id': with_digits('GMSC10.90AA', ix),
+                                'habitat': h,
+                                'taxonomy': t}) + '\n'
+                    for ix, h, t in zip(ixs.tolist(), habitats, taxonomies)])
+
+    def generate_gzip():
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        for chunk in generate_lines():
+            yield compressor.compress(chunk.encode('utf-8'))
+        yield compressor.flush()
+
+    fname = f'seq-filter.{oformat}'
+    mimetype = ('text/tab-separated-values' if oformat == 'tsv' else 'application/x-ndjson')
+    if use_gzip:
+        fname += '.gz'
+        mimetype = 'application/gzip'
+    return Response(
+            stream_with_context(generate_gzip() if use_gzip else generate_lines()),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={fname}'})
+
+@app.get('/internal/seq-filter-cache/')
+def seq_filter_cache_stats():
+    return {
+            "status": "Ok",
+            "cache": seqinfo90.filter_cache.stats(),
+            }
+
+def prewarm_seq_filter_cache(fname):
+    '''Runs the seq-filter queries in `fname` (a JSON list of objects with
+    the same fields as the seq-filter form) to fill the cache'''
+    import json
+    with open(fname) as f:
+        queries = json.load(f)
+    for q in queries:
+        try:
+            seqinfo90.filter_hits(**parse_seq_filter_args(q))
+        except Exception as e:
+            sys.stderr.write(f'WARNING: Pre-warming seq-filter query {q} failed: {e}\n')
+
+def start_seq_filter_prewarm():
+    '''Pre-warms the seq-filter cache in the background (if configured)
+
+    When pre-forking, gunicorn.conf.py runs `prewarm_seq_filter_cache` in
+    the master process instead, before the workers are forked
+    '''
+    if not IS_DEMO and environ.get('GMSC_API_SEQ_FILTER_PREWARM'):
+        threading.Thread(
+                target=prewarm_seq_filter_cache,
+                args=(environ['GMSC_API_SEQ_FILTER_PREWARM'],),
+                daemon=True).start()
+
+if not environ.get('GMSC_API_PREFORK'):
+    start_seq_filter_prewarm()
+
+
+@app.post('/v1/seq-exact/')
+def get_seq_exact():
+    entries = request.json.get('sequences')
+    if entries is None:
+        return {"error": "Missing sequences parameter"}, 400
+    if len(entries) > MAX_SEQ_EXACT:
+        return {"error": "Too many sequences"}, 400
+    seqtype = request.json.get('type', 'aminoacid')
+    if seqtype not in ('aminoacid', 'nucleotide'):
+        return {"error": "Invalid type (must be 'aminoacid' or 'nucleotide')"}, 400
+    rs = [{'sequence': seq} for seq in entries]
+    for seqinfo in (seqinfo90, seqinfo100):
+        for r, ix in zip(rs, seqinfo.find_exact(entries, seqtype)):
+            r[seqinfo.database] = (with_digits(f'GMSC10.{seqinfo.database}', ix)
+                                    if ix is not None else None)
+    return {
+            "status": "Ok",
+            "results": rs,
+            }
+
+
+def parse_cluster_id(cluster_id):
+    '''Returns (index, None) or (None, error response)'''
+    tokens = cluster_id.split(".")
+    if len(tokens) != 3:
+        return None, ({"error": "Invalid sequence ID (only 'GMSC10' database supported)"}, 400)
+    (db, cluster_level, seq_ix) = tokens
+    if db != 'GMSC10':
+        return None, ({"error": "Invalid sequence ID"}, 400)
+    if cluster_level != '90AA':
+        return None, ({"error": "Invalid sequence ID: only 90AA identifiers can be used for cluster-info"}, 400)
+    return int(seq_ix), None
+
+
+def get_clusters_members(cluster_ixs):
+    '''Returns the members of each cluster (the first MAX_THICK_RESULTS of
+    each cluster with full information)'''
+    members = [
+            [with_digits('GMSC10.100AA', m) for m in clusterinfo.get_cluster_members(ix)]
+            for ix in cluster_ixs]
+    # All thick entries are looked up together, so reads are grouped by offset
+    thick = seqinfo100.get_seqinfo_multi(
+            [m for ms in members for m in ms[:MAX_THICK_RESULTS]])
+    thick = iter(thick)
+    return [
+            [(next(thick) if i < MAX_THICK_RESULTS else {'seq_id': m})
+                for i, m in enumerate(ms)]
+            for ms in members]
+
 
 @app.get('/v1/cluster-info/<cluster_id>')
 def get_cluster_info(cluster_id):
-    tokens = cluster_id.split(".")
+    ix, err = parse_cluster_id(cluster_id)
+    if err is not None:
+        return err
+    [rs] = get_clusters_members([ix])
+    return {
+            'status': 'Ok',
+            'cluster': rs,
+            }
+
+
+@app.post('/v1/cluster-info-multi/')
+def get_cluster_info_multi():
+    entries = request.json.get('cluster_ids')
+    if entries is None:
+        return {"error": "Missing cluster_ids parameter"}, 400
+    if len(entries) > MAX_CLUSTER_INFO_MULTI:
+        return {"error": "Too many cluster_ids"}, 400
+    ixs = []
+    for cluster_id in entries:
+        ix, err = parse_cluster_id(cluster_id)
+        if err is not None:
+            return err
+        ixs.append(ix)
+    return {
+            'status': 'Ok',
+            'clusters': [
+                {'cluster_id': cluster_id,
+                 'cluster': rs,
+                } for cluster_id, rs in zip(entries, get_clusters_members(ixs))],
+            }
+
+
+@app.get('/v1/seq-cluster/<seq_id>')
+def get_seq_cluster(seq_id):
+    tokens = seq_id.split(".")
     if len(tokens) != 3:
         return {"error": "Invalid sequence ID (only 'GMSC10' database supported)"}, 400
     (db, cluster_level, seq_ix) = tokens
     if db != 'GMSC10':
         return {"error": "Invalid sequence ID"}, 400
-    if cluster_level != '90AA':
-        return {"error": "Invalid sequence ID: only 90AA identifiers can be used for cluster-info"}, 400
-    members = clusterinfo.get_cluster_members(int(seq_ix))
-    rs = []
-    for m in members:
-        m = with_digits('GMSC10.100AA', m)
-        if len(rs) < 20:
-            rs.append(seqinfo100.get_seqinfo(m))
-        else:
-            rs.append({'seq_id': m})
+    if cluster_level != '100AA':
+        return {"error": "Invalid sequence ID: only 100AA identifiers can be used for seq-cluster"}, 400
+    cluster = clusterinfo.get_cluster(int(seq_ix))
+    if cluster is None:
+        return {"error": "Sequence not found in any cluster"}, 404
     return {
             'status': 'Ok',
-            'cluster': rs,
+            'seq_id': seq_id,
+            'cluster': with_digits('GMSC10.90AA', cluster),
             }
 
 
 
-class SearchIDGenerator:
-    def __init__(self, start):
-        self.next_id = start
-    def get_next_id(self):
-        import random
-        from string import ascii_lowercase
-        randstr = ''.join(random.choice(ascii_lowercase) for i in range(4))
-        self.next_id += 1
-        return f"{self.next_id}-{randstr}"
+SEARCH_REGISTRY = 'search-results/searches.sqlite3'
+
+# Number of threads (per process) running searches (the total number of
+# concurrent searches is limited by the registry)
+NR_SEARCH_WORKERS = 2
+
+# How often (in seconds) idle search workers check for new searches and
+# expired results
+SEARCH_POLL_INTERVAL = 1
+SEARCH_EXPIRE_INTERVAL = 600
+
+# Search results (as JSON bytes) are kept in memory up to this total size;
+# results larger than MAX_CACHED_SEARCH_RESULT are always streamed from disk
+# (the cache is per process, see NR_PROCESSES in seqinfo.py)
+SEARCH_RESULT_CACHE_SIZE = 256 * 1024 * 1024 // NR_PROCESSES
+MAX_CACHED_SEARCH_RESULT = 16 * 1024 * 1024
+SEARCH_RESULT_CHUNK_SIZE = 1024 * 1024
+
+os.makedirs('search-results', exist_ok=True)
+search_result_cache = LRUCache(SEARCH_RESULT_CACHE_SIZE)
+registry = SearchRegistry(SEARCH_REGISTRY)
+registry.import_saved([
+        (sid, path.getmtime(search_result_path(sid)))
+        for sid in list_saved_searches()])
 
-    @classmethod
-    def get_index(cls, search_id : str) -> int:
-        ix, _ = search_id.split("-")
-        return int(ix)
+def finish_search(sid, r):
+    '''Saves the result of a search and marks it as done (or as failed, if
+    it cannot be saved)'''
+    try:
+        save_search_result(r, sid)
+    except Exception as e:
+        sys.stderr.write(f'ERROR: Could not save the result of search {sid}: {e}\n')
+        registry.finish(sid, FAILED)
+        return
+    registry.finish(sid, DONE)
 
-    def get_cur_index(self) -> int:
-        return self.next_id
+def run_search(sid, seqdata, is_contigs):
+    try:
+        r = do_search(seqdata, is_contigs, NR_THREADS_GMSC_MAPPER)
+    except Exception as e:
+        sys.stderr.write(f'ERROR: Search {sid} failed: {e}\n')
+        registry.finish(sid, FAILED)
+        return
+    finish_search(sid, r)
+
+def run_searches(jobs):
+    '''Runs a batch of searches claimed from the registry
+
+    Amino acid searches are combined into a single run; if that fails, they
+    are run one by one (so that a bad input only fails its own search)
+    '''
+    combined = [(sid, seqdata) for sid, seqdata, is_contigs in jobs
+                    if not is_contigs and seqdata.lstrip().startswith('>')]
+    if len(combined) > 1:
+        try:
+            rs = do_search_batch(combined, NR_THREADS_GMSC_MAPPER)
+        except Exception as e:
+            sys.stderr.write(f'WARNING: Combined search of {len(combined)} searches failed ({e}), running them individually\n')
+        else:
+            for sid, r in rs.items():
+                finish_search(sid, r)
+            jobs = [job for job in jobs if job[0] not in rs]
+    for job in jobs:
+        run_search(*job)
+
+def exact_search(seqdata):
+    '''Answers a search directly from the exact-match index
+
+    Returns None unless every query is exactly a 90AA sequence (in which
+    case that is the only hit reported for each query)
+    '''
+    if IS_DEMO or seqinfo90.aa_hash_index is None:
+        return None
+    try:
+        queries = parse_fasta(seqdata)
+    except ValueError:
+        return None
+    if not queries or len(queries) > MAX_SEQ_EXACT:
+        return None
+    ixs = seqinfo90.find_exact([seq for _, seq in queries])
+    if any(ix is None for ix in ixs):
+        return None
+    habitats, taxonomies = seqinfo90.get_annotations(ixs)
+    is_hq = seqinfo90.is_high_quality(ixs)
+    return {
+            query_id: {
+                'habitat': habitat,
+                'quality': ('high quality' if hq else 'low quality'),
+                'taxonomy': taxonomy,
+                'aminoacid': seq,
+                'hits': [{
+                    'id': with_digits('GMSC10.90AA', ix),
+                    'evalue': None,
+                    'identity': 100.0,
+                    }],
+                }
+            for (query_id, seq), ix, habitat, taxonomy, hq
+                in zip(queries, ixs, habitats, taxonomies, is_hq.tolist())
+            }
 
-def identity(x):
-    return x
+def expire_searches():
+    for sid in registry.expire():
+        delete_search_result(sid)
 
-search_lock = threading.Lock()
-searcher = ThreadPoolExecutor(2)
-SearchObject = namedtuple("SearchObject", ["start_time", "future"])
-searches = {
-        k:SearchObject(datetime.now(), searcher.submit(identity, v)) for k,v in load_search_results().items()
-        }
+def fail_unfinished(jobs):
+    '''Marks the searches of a batch that are still running as failed'''
+    for sid, _, _ in jobs:
+        try:
+            if registry.get_status(sid) == RUNNING:
+                registry.finish(sid, FAILED)
+        except Exception as e:
+            sys.stderr.write(f'ERROR: Could not mark search {sid} as failed: {e}\n')
 
-next_search_id = SearchIDGenerator(len(searches))
+def search_worker():
+    last_expire = 0
+    while True:
+        jobs = []
+        try:
+            if time() - last_expire > SEARCH_EXPIRE_INTERVAL:
+                last_expire = time()
+                expire_searches()
+            jobs = registry.claim()
+            if jobs:
+                run_searches(jobs)
+                continue
+        except Exception as e:
+            # A failure must not end the thread (nor leave the batch running)
+            sys.stderr.write(f'ERROR: Search worker: {e}\n')
+            fail_unfinished(jobs)
+        sleep(SEARCH_POLL_INTERVAL)
+
+def start_search_workers():
+    '''Starts the search worker threads
+
+    When pre-forking, this must be called in each worker process (see
+    gunicorn.conf.py), as threads do not survive fork
+    '''
+    for _ in range(NR_SEARCH_WORKERS):
+        threading.Thread(target=search_worker, daemon=True).start()
+
+if not environ.get('GMSC_API_PREFORK'):
+    start_search_workers()
 
 @app.post('/internal/seq-search/')
 def seq_search():
-    now = datetime.now()
     seqdata = request.form.get('sequence_faa')
     is_contigs = parse_bool(request.form.get('is_contigs'), None_is_false=True)
     if seqdata is None:
         return {"error": "Missing sequence_faa parameter"}, 400
-    with search_lock:
-        sid = next_search_id.get_next_id()
-        searches[sid] = SearchObject(now, searcher.submit(do_search, seqdata, sid, is_contigs, NR_THREADS_GMSC_MAPPER))
+    r = (exact_search(seqdata) if not is_contigs else None)
+    if r is not None:
+        sid = registry.submit(seqdata, is_contigs, running=True)
+        try:
+            save_search_result(r, sid)
+        except Exception as e:
+            # Otherwise, the search would be left as running forever (it is
+            # not re-run, as it was never queued)
+            sys.stderr.write(f'ERROR: Saving search {sid} failed: {e}\n')
+            registry.finish(sid, FAILED)
+        else:
+            registry.finish(sid, DONE)
+        return jsonify({
+            "search_id": sid,
+            "status": "Ok",
+            })
+    try:
+        sid = registry.submit(seqdata, is_contigs)
+    except QueueFullError:
+        return {"error": "Too many searches queued, please try again later"}, 503
     return jsonify({
         "search_id": sid,
         "status": "Ok",
@@ -193,22 +519,95 @@ def seq_search():
 
 @app.get('/internal/seq-search/<search_id>')
 def seq_search_results(search_id):
-    with search_lock:
-        sobj = searches.get(search_id)
-    if sobj is None:
+    status = registry.get_status(search_id)
+    if status is None:
         return {"error": "Invalid search ID"}, 400
-    sdata = sobj.future
-    if not sdata.done():
-        status = 'Running' if sdata.running() else 'Queued'
-        return {
-                "search_id": search_id,
-                "status": status,
+    if status == DONE:
+        try:
+            return Response(
+                    stream_search_result(search_id),
+                    mimetype='application/json')
+        except FileNotFoundError:
+            # The results were deleted (e.g., by another worker expiring them)
+            status = EXPIRED
+    return {
+            "search_id": search_id,
+            "status": status,
+            }
+
+def stream_search_result(search_id):
+    '''Yields the (JSON) response for a finished search
+
+    The saved results are sent as they are stored, without parsing them
+    '''
+    import json
+    raw = search_result_cache.lookup(search_id)
+    # Opened here (and not in the generator) so that errors happen before
+    # the response starts
+    ifile = (open_search_result(search_id) if raw is None else None)
+    def generate():
+        yield b'{"results":'
+        if raw is not None:
+            yield raw
+        else:
+            chunks = []
+            size = 0
+            with ifile:
+                while chunk := ifile.read(SEARCH_RESULT_CHUNK_SIZE):
+                    yield chunk
+                    if chunks is not None:
+                        chunks.append(chunk)
+                        size += len(chunk)
+                        if size > MAX_CACHED_SEARCH_RESULT:
+                            chunks = None
+            if chunks is not None:
+                search_result_cache.put(search_id, b''.join(chunks))
+        yield f',"search_id":{json.dumps(search_id)},"status":"Done"}}\n'.encode('ascii')
+    return generate()
+
+@app.post('/internal/seq-search-kmer/')
+def seq_search_kmer():
+    '''Synchronous near-exact search against 90AA (using the k-mer index)
+
+    Results have the same structure as those of seq-search, with the
+    annotations of the best hit and no e-values
+    '''
+    if IS_DEMO or seqinfo90.kmer_index is None:
+        return {"error": "K-mer index not available"}, 503
+    seqdata = request.form.get('sequence_faa')
+    if seqdata is None:
+        return {"error": "Missing sequence_faa parameter"}, 400
+    min_identity = float_or_None(request.form.get('min_identity'))
+    if min_identity is None:
+        min_identity = 90.0
+    try:
+        queries = parse_fasta(seqdata)
+    except ValueError:
+        return {"error": "Invalid sequence_faa parameter (must be in FASTA format)"}, 400
+    if len(queries) > MAX_KMER_SEARCH_QUERIES:
+        return {"error": "Too many sequences"}, 400
+    results = {}
+    for query_id, seq in queries:
+        hits = seqinfo90.kmer_search(seq, min_identity)[:MAX_KMER_SEARCH_HITS]
+        if not hits:
+            continue
+        best = hits[0][0]
+        [habitat], [taxonomy] = seqinfo90.get_annotations([best])
+        [hq] = seqinfo90.is_high_quality([best])
+        results[query_id] = {
+                'habitat': habitat,
+                'quality': ('high quality' if hq else 'low quality'),
+                'taxonomy': taxonomy,
+                'aminoacid': seq,
+                'hits': [{
+                    'id': with_digits('GMSC10.90AA', ix),
+                    'evalue': None,
+                    'identity': round(identity, 1),
+                    } for ix, identity in hits],
                 }
-    r = sdata.result()
     return jsonify({
-        "search_id": search_id,
         "status": "Done",
-        "results": r
+        "results": results,
         })
 
 @app.post('/internal/seq-search-list/')
@@ -219,19 +618,29 @@ def seq_search_list():
         return {"error": "No secret set"}, 500
     if pwd != secret:
         return {"error": "Wrong password"}, 403
-    def status_for(f):
-        if f.done():
-            return "Done"
-        if f.running():
-            return "Running"
-        return "Queued"
-    with search_lock:
-        items = list(searches.items())
     return {
             "status": "Ok",
             "searches": [
                 {"search_id": k,
-                "status": status_for(v.future),
-                } for k,v in items],
+                "status": status,
+                } for k, status in registry.list()],
             }
 
+@app.get('/internal/load-times/')
+def load_times():
+    '''Startup time and time taken to load each index (indices are only
+    loaded when first used, so this changes as requests are served)'''
+    rs = {
+            "status": "Ok",
+            "startup": STARTUP_TIME,
+            }
+    if not IS_DEMO:
+        rs["indices"] = {
+                "90AA": seqinfo90.load_times,
+                "100AA": seqinfo100.load_times,
+                "cluster": clusterinfo.load_times,
+                }
+    return rs
+
+STARTUP_TIME = perf_counter() - STARTUP_START
+sys.stderr.write(f'Startup took {STARTUP_TIME:.3f}s (indices are loaded on first use)\n')
@@ -0,0 +1,331 @@
+'''Micro-benchmarks on synthetic data
+
+Usage:
+
+    python benchmark.py fasta-reader [--nr-seqs N] [--nr-lookups N]
+    python benchmark.py translate [--nr-seqs N]
+    python benchmark.py search-parse [--nr-queries N] [--nr-reference-queries N]
+    python benchmark.py kmer-search [--nr-seqs N] [--nr-queries N]
+
+Synthetic files are created in a temporary directory, so no database is
+needed to run these.
+'''
+import argparse
+import threading
+import tempfile
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def random_nucleotides(rng, n):
+    return bytes(rng.choice(np.frombuffer(b'ACGT', np.uint8), size=n))
+
+
+def write_synthetic_fasta(oname, nr_seqs, seed=123):
+    from recordoffsets import write_record_offsets
+    rng = np.random.default_rng(seed)
+    starts = [0]
+    with open(oname, 'wb') as out:
+        for i in range(nr_seqs):
+            n = f'{i:09}'
+            header = f'>GMSC10.100AA.{n[:3]}_{n[3:6]}_{n[6:9]}\n'.encode('ascii')
+            seq = random_nucleotides(rng, 3 * rng.integers(10, 100))
+            out.write(header)
+            out.write(seq)
+            out.write(b'\n')
+            starts.append(starts[-1] + len(header) + len(seq) + 1)
+    np.save(oname + '.starts.npy', np.array(starts, dtype=np.uint64))
+    write_record_offsets(starts, oname)
+
+
+SYNTHETIC_HABITATS = ['marine', 'soil', 'human gut', 'pig gut', 'freshwater', 'plant associated']
+SYNTHETIC_TAXONOMY = [
+    'd__Bacteria',
+    'd__Bacteria;p__Proteobacteria',
+    'd__Bacteria;p__Proteobacteria;c__Alphaproteobacteria;o__Pelagibacterales',
+    'd__Bacteria;p__Proteobacteria;c__Alphaproteobacteria;o__Pelagibacterales;f__Pelagibacteraceae',
+    'd__Bacteria;p__Proteobacteria2',
+    'd__Bacteria;p__Firmicutes;c__Bacilli;o__Lactobacillales;f__Lactobacillaceae;g__Lactobacillus;s__Lactobacillus casei',
+    'd__Bacteria;p__Proteobacteria;c__Gammaproteobacteria;o__Enterobacterales;f__Enterobacteriaceae;g__Escherichia;s__Escherichia coli',
+    'd__Archaea;p__Thermoproteota',
+    '',
+]
+
+
+def write_synthetic_database(odir, nr_seqs, seed=0):
+    '''Writes a small GMSC-like database (the inputs of make-indices.py) to
+    `<odir>/gmsc-db`
+
+    Returns the number of 90AA sequences (clusters of 1 to 5 sequences)
+    '''
+    import os
+    import lzma
+    rng = np.random.default_rng(seed)
+    os.makedirs(f'{odir}/gmsc-db', exist_ok=True)
+    def with_digits(prefix, n):
+        n = f'{n:09}'
+        return f'{prefix}.{n[:3]}_{n[3:6]}_{n[6:9]}'
+    def write_xz(fname, lines):
+        with lzma.open(f'{odir}/gmsc-db/{fname}', 'wt') as out:
+            out.writelines(lines)
+
+    codons = [a+b+c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT'
+                if a+b+c not in ('TAA', 'TAG', 'TGA')]
+    seqs = []
+    for i in range(nr_seqs):
+        seq = 'ATG' + ''.join(rng.choice(codons, size=rng.integers(8, 40))) + 'TAA'
+        if i % 13 == 0:
+            p = rng.integers(3, len(seq) - 3)
+            seq = seq[:p] + 'N' + seq[p+1:]
+        seqs.append(seq)
+    order = rng.permutation(nr_seqs).tolist()
+    clusters = []
+    while order:
+        k = int(rng.integers(1, 6))
+        clusters.append(sorted(order[:k]))
+        order = order[k:]
+    reps = [members[0] for members in clusters]
+
+    write_xz('GMSC10.100AA.fna.xz',
+             [f'>{with_digits("GMSC10.100AA", i)}\n{seq}\n' for i, seq in enumerate(seqs)])
+    write_xz('GMSC10.90AA.fna.xz',
+             [f'>{with_digits("GMSC10.90AA", c)}\n{seqs[r]}\n' for c, r in enumerate(reps)])
+    write_xz('GMSC10.90AA.txt.xz',
+             [f'{with_digits("GMSC10.100AA", r)}\n' for r in reps])
+    write_xz('GMSC10.cluster.sorted2.tsv.xz',
+             [f'{with_digits("GMSC10.100AA", m)}\t{with_digits("GMSC10.90AA", c)}\n'
+                for c, members in enumerate(clusters) for m in members])
+    def annotation(n):
+        for _ in range(n):
+            habitat = ','.join(sorted(rng.choice(SYNTHETIC_HABITATS,
+                                                 size=rng.integers(1, 4),
+                                                 replace=False)))
+            yield f'{habitat}\t{rng.choice(SYNTHETIC_TAXONOMY)}\n'
+    write_xz('GMSC10.100AA.annotation.tsv.xz', annotation(nr_seqs))
+    write_xz('GMSC10.90AA.annotation.tsv.xz', annotation(len(clusters)))
+    def quality(n):
+        for _ in range(n):
+            metat = str(rng.integers(0, 4)) if rng.random() > .05 else 'NA'
+            yield '\t'.join([rng.choice(['T', 'F']),
+                             rng.choice(['T', 'F']),
+                             f'{rng.random()**3:.3f}',
+                             metat,
+                             str(rng.integers(0, 4)),
+                             f'{rng.random():.2f}']) + '\n'
+    write_xz('GMSC10.90AA.quality_test.tsv.xz', quality(len(clusters)))
+    return len(clusters)
+
+
+class LockedFastaReader:
+    '''Reference: single file object protected by a lock (previous design)'''
+    def __init__(self, ifile):
+        self.seqfile = open(ifile, 'rb')
+        self.sindex = np.load(ifile + '.starts.npy', mmap_mode='r')
+        self._lock = threading.Lock()
+
+    def get(self, ix):
+        with self._lock:
+            self.seqfile.seek(int(self.sindex[ix]))
+            data = self.seqfile.read(int(self.sindex[ix+1] - self.sindex[ix]))
+        _h, seq, _empty = data.split(b'\n')
+        return seq
+
+
+def run_lookups(reader, ixs, nr_threads):
+    chunks = np.array_split(ixs, nr_threads)
+    def work(ch):
+        for ix in ch:
+            reader.get(ix)
+    start = perf_counter()
+    with ThreadPoolExecutor(nr_threads) as ex:
+        list(ex.map(work, chunks))
+    return perf_counter() - start
+
+
+def bench_fasta_reader(args):
+    from seqinfo import IndexedFastaReader
+    from packedseq import PackedSeqWriter, PackedNucleotideReader
+    with tempfile.TemporaryDirectory() as tdir:
+        fname = f'{tdir}/synthetic.fna'
+        write_synthetic_fasta(fname, args.nr_seqs)
+        writer = PackedSeqWriter(fname + '.2bit')
+        with open(fname, 'rb') as ifile:
+            writer.add([line.rstrip(b'\n') for line in ifile if not line.startswith(b'>')])
+        writer.close()
+        ixs = np.random.default_rng(1).integers(0, args.nr_seqs, size=args.nr_lookups)
+        readers = [
+                ('locked', LockedFastaReader(fname)),
+                ('pread', IndexedFastaReader(fname)),
+                ('2bit', PackedNucleotideReader(fname + '.2bit')),
+                ]
+        print(f'{"reader":>8} {"threads":>8} {"lookups/s":>12}')
+        for nr_threads in [1, 2, 4, 8, 16]:
+            for name, reader in readers:
+                elapsed = run_lookups(reader, ixs, nr_threads)
+                print(f'{name:>8} {nr_threads:>8} {len(ixs)/elapsed:>12,.0f}')
+
+
+def bench_translate(args):
+    from fna2faa_gmsc import translate, translate_batch
+    rng = np.random.default_rng(7)
+    codons = [a+b+c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT'
+                if a+b+c not in ('TAA', 'TAG', 'TGA')]
+    seqs = ['ATG' + ''.join(rng.choice(codons, size=rng.integers(10, 100))) + 'TAA'
+                for _ in range(args.nr_seqs)]
+
+    start = perf_counter()
+    expected = [translate(s) for s in seqs]
+    elapsed = perf_counter() - start
+    print(f'translate:       {len(seqs)/elapsed:>12,.0f} seqs/s')
+
+    start = perf_counter()
+    rs = translate_batch(seqs)
+    elapsed = perf_counter() - start
+    print(f'translate_batch: {len(seqs)/elapsed:>12,.0f} seqs/s')
+    assert rs == expected
+
+
+def write_synthetic_mapper_output(odir, nr_queries, seed=42):
+    '''Writes files with the same format as the output of gmsc-mapper'''
+    rng = np.random.default_rng(seed)
+    habitats = ['soil', 'marine', 'human gut', 'freshwater,soil']
+    taxonomies = ['d__Bacteria', 'd__Bacteria;p__Bacillota', 'd__Archaea']
+    with open(f'{odir}/alignment.out.smorfs.tsv', 'wt') as out:
+        for q in range(nr_queries):
+            qseq = 'M' + ''.join(rng.choice(list('ACDEFGHIKLMNPQRSTVWY'), size=rng.integers(20, 90)))
+            for _ in range(rng.integers(1, 10)):
+                s = rng.integers(0, 287_926_875)
+                out.write('\t'.join([
+                    f'smORF_{q}',
+                    f'GMSC10.90AA.{s // 1000_000:03}_{s // 1000 % 1000:03}_{s % 1000:03}',
+                    qseq + '*',
+                    qseq,
+                    str(len(qseq) + 1),
+                    str(len(qseq)),
+                    str(len(qseq)),
+                    '1', str(len(qseq)), '1', str(len(qseq)),
+                    f'{rng.uniform(30, 140):.1f}',
+                    f'{rng.uniform(30, 100):.1f}',
+                    f'{rng.uniform(1e-30, 1e-5):.2e}',
+                    '100', '100',
+                    ]) + '\n')
+    for name, header, values in [
+            ('habitat', 'qseqid\thabitat', habitats),
+            ('quality', 'qseqid\tquality', ['high quality', 'low quality']),
+            ('taxonomy', 'q_seqid\ttaxonomy', taxonomies),
+            ]:
+        with open(f'{odir}/{name}.out.smorfs.tsv', 'wt') as out:
+            out.write(header + '\n')
+            for q in range(nr_queries):
+                out.write(f'smORF_{q}\t{values[rng.integers(len(values))]}\n')
+
+
+def parse_gmsc_mapper_results_reference(basedir):
+    '''Reference: one scan of the alignment table per query (previous design)'''
+    import pandas as pd
+    try:
+        alignment = pd.read_table(f'{basedir}/alignment.out.smorfs.tsv', header=None)
+        habitat = pd.read_table(f'{basedir}/habitat.out.smorfs.tsv', index_col=0)
+        quality = pd.read_table(f'{basedir}/quality.out.smorfs.tsv', index_col=0)
+        taxonomy = pd.read_table(f'{basedir}/taxonomy.out.smorfs.tsv', index_col=0)
+    except pd.errors.EmptyDataError:
+        return {}
+    meta = pd.concat([habitat, quality, taxonomy], axis=1)
+    alignment.columns = 'qseqid,sseqid,full_qseq,full_sseq,qlen,slen,length,qstart,qend,sstart,send,bitscore,pident,evalue,qcovhsp,scovhsp'.split(',')
+
+    result = meta.to_dict('index')
+
+    for k in result.keys():
+        loc = alignment.query('qseqid == @k')
+        result[k]['aminoacid'] = loc.head(1).full_qseq.values[0]
+        result[k]['hits'] = \
+                loc[['sseqid', 'evalue', 'pident']].rename(columns=
+                    {'sseqid': 'id',
+                    'pident': 'identity'},).to_dict('records')
+    return result
+
+
+def bench_search_parse(args):
+    from search import parse_gmsc_mapper_results
+    with tempfile.TemporaryDirectory() as tdir:
+        write_synthetic_mapper_output(tdir, args.nr_queries)
+        start = perf_counter()
+        r = parse_gmsc_mapper_results(tdir)
+        elapsed = perf_counter() - start
+        print(f'parse_gmsc_mapper_results: {len(r):>9,} queries in {elapsed:8.2f}s')
+
+    with tempfile.TemporaryDirectory() as tdir:
+        write_synthetic_mapper_output(tdir, args.nr_reference_queries)
+        start = perf_counter()
+        r = parse_gmsc_mapper_results_reference(tdir)
+        elapsed = perf_counter() - start
+        print(f'reference:                 {len(r):>9,} queries in {elapsed:8.2f}s')
+
+
+def bench_kmer_search(args):
+    from kmerindex import build_kmer_index, KmerIndex, semiglobal_distances, AMINO_ACIDS
+    rng = np.random.default_rng(7)
+    lens = rng.integers(20, 200, size=args.nr_seqs)
+    starts = np.concatenate([[0], np.cumsum(lens)])
+    data = rng.choice(np.frombuffer(AMINO_ACIDS, np.uint8), size=starts[-1])
+    with tempfile.TemporaryDirectory() as tdir:
+        start = perf_counter()
+        build_kmer_index(data, starts, f'{tdir}/seqs')
+        elapsed = perf_counter() - start
+        print(f'build_kmer_index: {args.nr_seqs:>9,} sequences in {elapsed:8.2f}s')
+
+        index = KmerIndex(f'{tdir}/seqs')
+        ixs = rng.choice(args.nr_seqs, size=args.nr_queries, replace=False)
+        found = 0
+        start = perf_counter()
+        for ix in ixs.tolist():
+            q = data[starts[ix]:starts[ix+1]].copy()
+            # ~95% identity
+            for p in rng.choice(len(q), size=len(q) // 20, replace=False):
+                q[p] = AMINO_ACIDS[(AMINO_ACIDS.index(q[p]) + 1) % len(AMINO_ACIDS)]
+            q = q.tobytes()
+            cands = index.candidates(q, 1000, 1_000_000)
+            subjects = [data[starts[c]:starts[c+1]].tobytes() for c in cands.tolist()]
+            distances = semiglobal_distances(q, subjects, len(q) // 10)
+            found += (len(cands) > 0 and cands[np.argmin(distances)] == ix)
+        elapsed = perf_counter() - start
+        print(f'search:           {args.nr_queries:>9,} queries   in {elapsed:8.2f}s '
+                f'({1000 * elapsed / args.nr_queries:.1f}ms per query, {found} found)')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = subparsers.add_parser('fasta-reader',
+            help='Concurrent random-access lookups in IndexedFastaReader')
+    p.add_argument('--nr-seqs', type=int, default=1_000_000)
+    p.add_argument('--nr-lookups', type=int, default=200_000)
+    p.set_defaults(func=bench_fasta_reader)
+
+    p = subparsers.add_parser('translate',
+            help='Nucleotide to amino acid translation (single vs. batch)')
+    p.add_argument('--nr-seqs', type=int, default=200_000)
+    p.set_defaults(func=bench_translate)
+
+    p = subparsers.add_parser('search-parse',
+            help='Parsing gmsc-mapper output (grouped vs. one scan per query)')
+    p.add_argument('--nr-queries', type=int, default=100_000)
+    p.add_argument('--nr-reference-queries', type=int, default=2_000,
+            help='The reference is quadratic, so it is run on fewer queries')
+    p.set_defaults(func=bench_search_parse)
+
+    p = subparsers.add_parser('kmer-search',
+            help='Building the k-mer index and near-exact search with it')
+    p.add_argument('--nr-seqs', type=int, default=1_000_000)
+    p.add_argument('--nr-queries', type=int, default=1_000)
+    p.set_defaults(func=bench_kmer_search)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
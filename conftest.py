@@ -0,0 +1,47 @@
+import os
+import sys
+import subprocess
+from os import path
+
+import pytest
+
+REPO_DIR = path.dirname(path.abspath(__file__))
+
+# Number of (100AA) sequences in the synthetic database
+SYNTHETIC_NR_SEQS = 600
+
+
+@pytest.fixture(scope='session')
+def synthetic_index_dir(tmp_path_factory):
+    '''Directory with a synthetic database (in `gmsc-db`) and its indices
+    (in `gmsc-db-index`), built by running make-indices.py'''
+    from benchmark import write_synthetic_database
+    basedir = tmp_path_factory.mktemp('synthetic')
+    write_synthetic_database(basedir, SYNTHETIC_NR_SEQS)
+    os.makedirs(basedir / 'gmsc-db-index')
+    subprocess.check_call(
+            [sys.executable, '-c', 'from jug.jug import main; main()',
+                'execute',
+                '--jugdir', str(basedir / 'make-indices.jugdata'),
+                path.join(REPO_DIR, 'make-indices.py')],
+            cwd=basedir,
+            env=dict(os.environ, PYTHONPATH=REPO_DIR),
+            stdout=subprocess.DEVNULL)
+    return basedir
+
+
+@pytest.fixture
+def synthetic_index(synthetic_index_dir, monkeypatch):
+    '''Runs the test in the synthetic index directory (where the relative
+    paths in seqinfo.py resolve)'''
+    monkeypatch.chdir(synthetic_index_dir)
+    return synthetic_index_dir
+
+
+@pytest.fixture
+def app_client(synthetic_index, monkeypatch):
+    '''Flask test client of app.py, serving the synthetic index'''
+    # Searches are not run in the background (see start_search_workers)
+    monkeypatch.setenv('GMSC_API_PREFORK', '1')
+    import app
+    return app.app.test_client()
@@ -0,0 +1,241 @@
+'''Parallel, resumable HTTP downloads with hash verification
+
+Files are downloaded in segments of SEGMENT_SIZE bytes (using HTTP Range
+requests), several at a time, each written at its position in
+`<target>.part`. The segments that are complete are listed in
+`<target>.part.state`, so that an interrupted download continues where it
+stopped. The MD5 hash is computed while the download is running, over the
+(in order) prefix of the file that is complete. Once all segments are done
+and the hash matches, `<target>.part` is renamed to `<target>`.
+
+Servers that do not support Range requests are downloaded in a single
+stream (which cannot be resumed).
+
+Failed requests are retried after a delay that doubles every time, or after
+the delay the server asks for (with `Retry-After`, e.g., when it rate limits
+requests with HTTP 429).
+'''
+import os
+import json
+import hashlib
+import threading
+from os import path
+from time import time, sleep
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+NR_CONNECTIONS = 2
+
+# Times a request is retried before giving up, waiting RETRY_DELAY seconds
+# before the first retry (doubled for every following one) and at most
+# MAX_RETRY_DELAY (including when the server asks for longer)
+MAX_RETRIES = 5
+RETRY_DELAY = 2.0
+MAX_RETRY_DELAY = 300.0
+
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 60
+
+
+def md5_file(fname):
+    h = hashlib.md5()
+    with open(fname, 'rb') as ifile:
+        while ch := ifile.read(CHUNK_SIZE):
+            h.update(ch)
+    return h.hexdigest()
+
+
+def _retry_delay(r, attempt):
+    '''Returns how long to wait before retrying after response `r`'''
+    delay = RETRY_DELAY * 2**attempt
+    retry_after = r.headers.get('Retry-After') if r is not None else None
+    if retry_after is not None:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time()
+            except (TypeError, ValueError):
+                pass
+    return min(max(delay, 0.), MAX_RETRY_DELAY)
+
+
+def _probe(url):
+    '''Returns `(size, supports_ranges)`'''
+    for attempt in range(MAX_RETRIES + 1):
+        with requests.get(url,
+                          headers={'Range': 'bytes=0-0'},
+                          allow_redirects=True,
+                          stream=True,
+                          timeout=TIMEOUT) as r:
+            # Rate limited (or temporarily unavailable)
+            if r.status_code in (429, 503) and attempt < MAX_RETRIES:
+                sleep(_retry_delay(r, attempt))
+                continue
+            r.raise_for_status()
+            content_range = r.headers.get('Content-Range', '')
+            if r.status_code == 206 and '/' in content_range:
+                size = content_range.split('/')[1]
+                if size != '*':
+                    return int(size), True
+            return None, False
+
+
+class _InOrderHasher:
+    '''Hashes the file as segments complete, in file order
+
+    Completed segments are read back from the partial file (normally from
+    the page cache)
+    '''
+    def __init__(self, fd, size, segment_size):
+        self.fd = fd
+        self.size = size
+        self.segment_size = segment_size
+        self.md5 = hashlib.md5()
+        self.next_segment = 0
+        self.done = set()
+        self.lock = threading.Lock()
+
+    def segment_done(self, seg):
+        with self.lock:
+            self.done.add(seg)
+            while self.next_segment in self.done:
+                start = self.next_segment * self.segment_size
+                end = min(start + self.segment_size, self.size)
+                while start < end:
+                    data = os.pread(self.fd, min(CHUNK_SIZE, end - start), start)
+                    self.md5.update(data)
+                    start += len(data)
+                self.next_segment += 1
+
+
+class _State:
+    '''The list of completed segments of a partial download'''
+    def __init__(self, fname, url, size, segment_size, resume):
+        self.fname = fname
+        self.info = {'url': url, 'size': size, 'segment_size': segment_size, 'done': []}
+        self.lock = threading.Lock()
+        if resume and path.exists(fname):
+            with open(fname) as f:
+                saved = json.load(f)
+            if all(saved.get(k) == self.info[k] for k in ['size', 'segment_size']):
+                self.info['done'] = saved['done']
+
+    def completed(self):
+        return set(self.info['done'])
+
+    def mark_done(self, seg):
+        with self.lock:
+            self.info['done'].append(seg)
+            with open(self.fname + '.tmp', 'wt') as out:
+                json.dump(self.info, out)
+            os.rename(self.fname + '.tmp', self.fname)
+
+
+_sessions = threading.local()
+
+def _session():
+    if not hasattr(_sessions, 'session'):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+def _download_segment(url, fd, start, end):
+    '''Downloads bytes `start` to `end` (exclusive) into `fd`'''
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt:
+            sleep(delay)
+        pos = start
+        r = None
+        try:
+            with _session().get(url,
+                                headers={'Range': f'bytes={pos}-{end - 1}'},
+                                stream=True,
+                                timeout=TIMEOUT) as r:
+                if r.status_code != 206:
+                    raise IOError(f'Unexpected status {r.status_code} for a range request to {url}')
+                for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                    os.pwrite(fd, chunk[:end - pos], pos)
+                    pos += len(chunk)
+            if pos >= end:
+                return
+            error = IOError(f'Segment {start}-{end} of {url} is incomplete')
+        except (requests.RequestException, IOError) as e:
+            error = e
+        delay = _retry_delay(r, attempt)
+    raise error
+
+
+def _download_stream(url, part):
+    '''Downloads `url` in a single request, returning its MD5'''
+    h = hashlib.md5()
+    with requests.get(url, stream=True, timeout=TIMEOUT) as r:
+        r.raise_for_status()
+        with open(part, 'wb') as out:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                h.update(chunk)
+                out.write(chunk)
+    return h.hexdigest()
+
+
+def download(url, target, md5,
+             nr_connections=NR_CONNECTIONS,
+             segment_size=SEGMENT_SIZE):
+    '''Downloads `url` to `target`, checking that it has the given MD5
+
+    If `target` already exists, it is only checked. Raises IOError if the
+    hash does not match (the partial download is then removed, so that the
+    next attempt starts over).
+    '''
+    if path.exists(target):
+        print(f'File exists. Checking hash...')
+        if md5_file(target) != md5:
+            raise IOError(f'Unexpected hash for {target}')
+        print('Hash ok')
+        return target
+    part = target + '.part'
+    state_file = part + '.state'
+    # The URL (rather than where it redirects to, which may be a temporary
+    # link) is requested for every segment
+    size, supports_ranges = _probe(url)
+    if not supports_ranges:
+        digest = _download_stream(url, part)
+    else:
+        state = _State(state_file, url, size, segment_size, resume=path.exists(part))
+        completed = state.completed()
+        fd = os.open(part, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            hasher = _InOrderHasher(fd, size, segment_size)
+            nr_segments = (size + segment_size - 1) // segment_size
+
+            def run(seg):
+                if seg not in completed:
+                    _download_segment(url, fd, seg * segment_size, min((seg + 1) * segment_size, size))
+                    state.mark_done(seg)
+                hasher.segment_done(seg)
+
+            with ThreadPoolExecutor(nr_connections) as executor:
+                futures = [executor.submit(run, seg) for seg in range(nr_segments)]
+                try:
+                    for f in futures:
+                        f.result()
+                except:
+                    # Completed segments are kept (see the state file)
+                    executor.shutdown(cancel_futures=True)
+                    raise
+            digest = hasher.md5.hexdigest()
+        finally:
+            os.close(fd)
+    if digest != md5:
+        for f in (part, state_file):
+            if path.exists(f):
+                os.unlink(f)
+        raise IOError(f'Unexpected hash for {target} (downloaded from {url})')
+    os.rename(part, target)
+    if path.exists(state_file):
+        os.unlink(state_file)
+    return target
@@ -0,0 +1,127 @@
+'''Extraction of the 90AA sequences from the 100AA FASTA file
+
+Every 90AA sequence is a 100AA sequence (the cluster representative, listed
+in `GMSC10.90AA.txt.xz`, one per line in 90AA order). As the output is in 90AA
+order, which differs from the order of the input, it is written in two passes
+over the input:
+
+1. the length of each 90AA record is collected, so that the position of every
+   record in the output is known, and the output file is preallocated
+2. each record is written directly at its position (with `os.pwrite`)
+
+The large arrays (the 100AA -> 90AA map and the output offsets) are
+memory-mapped temporary files, so that memory use (other than the page
+cache) is bounded by `max_memory`.
+'''
+import os
+import lzma
+
+import numpy as np
+
+# 100AA indices must be below this (there are fewer than 10^9 in GMSC 1.0)
+MAX_100AA = 1_000_000_000
+
+# Length of `>GMSC10.90AA.000_000_000\n`
+HEADER_90AA_LENGTH = 25
+
+
+def with_digits_90aa(n):
+    n = f'{n:09}'
+    return f'GMSC10.90AA.{n[:3]}_{n[3:6]}_{n[6:9]}'
+
+
+def read_90aa_map(sel90, to90):
+    '''Fills in `to90` (100AA index -> 90AA index + 1, 0 if not selected)
+
+    Returns the number of 90AA sequences
+    '''
+    import pandas as pd
+    n90 = 0
+    for ch in pd.read_table(sel90, chunksize=1_000_000, header=None):
+        ix100 = ch[0].str.split('.').str[2].str.replace('_', '').astype(np.int64).values
+        to90[ix100] = np.arange(n90 + 1, n90 + len(ix100) + 1, dtype=np.uint32)
+        n90 += len(ix100)
+    return n90
+
+
+def iter_fasta_batches(fna_file, batch_bytes):
+    '''Yields `(ix100, seqs)` for batches of (2-line) FASTA records
+
+    `ix100` is an array with the 100AA index of each record and `seqs` a list
+    of the sequence lines (including the final newline)
+    '''
+    leftover = []
+    with lzma.open(fna_file, 'rb') as ifile:
+        while lines := ifile.readlines(batch_bytes):
+            lines = leftover + lines
+            leftover = lines[len(lines) - len(lines) % 2:]
+            headers = lines[0:len(lines) - len(leftover):2]
+            seqs = lines[1::2]
+            yield np.array([int(h[14:-1]) for h in headers], dtype=np.int64), seqs
+    if leftover:
+        raise ValueError(f'{fna_file} ends with an incomplete record')
+
+
+def _write_runs(fd, records):
+    '''Writes `(offset, data)` records, merging those that are adjacent'''
+    records.sort(key=lambda r: r[0])
+    i = 0
+    while i < len(records):
+        start = records[i][0]
+        end = start + len(records[i][1])
+        j = i + 1
+        while j < len(records) and records[j][0] == end:
+            end += len(records[j][1])
+            j += 1
+        os.pwrite(fd, b''.join(data for _, data in records[i:j]), start)
+        i = j
+
+
+def extract_90aa(fna_file, sel90, oname, max_memory):
+    '''Writes the 90AA sequences (in order) to `oname`'''
+    batch_bytes = max(1, max_memory // 4)
+    tmp_to90 = oname + '.to90.tmp'
+    tmp_offsets = oname + '.offsets.tmp'
+    try:
+        # A sparse file: only the pages that are written take up space
+        to90 = np.memmap(tmp_to90, dtype=np.uint32, mode='w+', shape=(MAX_100AA,))
+        n90 = read_90aa_map(sel90, to90)
+        offsets = np.memmap(tmp_offsets, dtype=np.uint64, mode='w+', shape=(n90 + 1,))
+
+        nr_found = 0
+        for ix100, seqs in iter_fasta_batches(fna_file, batch_bytes):
+            ix90 = to90[ix100].astype(np.int64) - 1
+            [selected] = np.where(ix90 >= 0)
+            lengths = np.array([len(seqs[i]) for i in selected.tolist()], dtype=np.uint64)
+            offsets[ix90[selected] + 1] = HEADER_90AA_LENGTH + lengths
+            nr_found += len(selected)
+        if nr_found != n90:
+            raise ValueError(f'Found {nr_found} of the {n90} 90AA sequences in {fna_file}')
+
+        # Cumulative sum, one chunk at a time
+        total = 0
+        chunk = max(1, batch_bytes // 8)
+        for start in range(0, n90 + 1, chunk):
+            cur = np.cumsum(offsets[start:start + chunk]) + np.uint64(total)
+            offsets[start:start + chunk] = cur
+            total = int(cur[-1])
+
+        fd = os.open(oname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if total:
+                os.posix_fallocate(fd, 0, total)
+            for ix100, seqs in iter_fasta_batches(fna_file, batch_bytes):
+                ix90 = to90[ix100].astype(np.int64) - 1
+                [selected] = np.where(ix90 >= 0)
+                starts = offsets[ix90[selected]].tolist()
+                _write_runs(fd, [
+                        (start, f'>{with_digits_90aa(p)}\n'.encode('ascii') + seqs[i])
+                        for start, p, i in zip(starts, ix90[selected].tolist(), selected.tolist())])
+        finally:
+            os.close(fd)
+        del to90, offsets
+    finally:
+        for tmp in (tmp_to90, tmp_offsets):
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+    return oname
@@ -1,4 +1,5 @@
 import sys
+import numpy as np
 
 def is_start_codon(codon):
     return codon in ('ATG', 'GTG', 'TTG')
@@ -70,3 +71,154 @@ def translate(nucleotides):
         rs[0] = 'M'
     return ''.join(rs[:-1])
 
+
+
+# Lookup tables for translate_batch (all indexed by ASCII code)
+_NUC_CODE = np.full(256, 4, np.uint8)
+for _i, _n in enumerate('ACGT'):
+    _NUC_CODE[ord(_n)] = _i
+_RC = np.zeros(256, np.uint8)
+for _n, _c in rc_n2n.items():
+    _RC[ord(_n)] = ord(_c)
+# Codons are encoded as 25*n0 + 5*n1 + n2 with n=4 for any non-ACGT base
+_CODON_AA = np.full(125, ord('X'), np.uint8)
+for _codon, _aa in codon2aa.items():
+    if 'U' not in _codon:
+        _n0, _n1, _n2 = (_NUC_CODE[ord(_n)] for _n in _codon)
+        _CODON_AA[25*_n0 + 5*_n1 + _n2] = ord(_aa)
+_IS_START = np.zeros(125, bool)
+for _codon in ('ATG', 'GTG', 'TTG'):
+    _n0, _n1, _n2 = (_NUC_CODE[ord(_n)] for _n in _codon)
+    _IS_START[25*_n0 + 5*_n1 + _n2] = True
+
+
+def _translate_or_empty(nucleotides, skip_invalid):
+    if not skip_invalid:
+        return translate(nucleotides)
+    try:
+        return translate(nucleotides)
+    except (ValueError, KeyError):
+        return ''
+
+
+def translate_batch(seqs, skip_invalid=False):
+    """Translate a list of nucleotide sequences (same results as `translate`)
+
+    Sequences are processed together with NumPy lookup tables. Anything
+    unusual (the special case, non-ASCII characters, RNA codons with `U`,
+    invalid sequences) is passed on to `translate`, so errors are the same as for `translate`.
+    If `skip_invalid`, untranslatable sequences are returned as empty strings.
+    """
+    lens = np.array([len(s) for s in seqs], dtype=np.int64)
+    fast = (lens % 3 == 0) & (lens >= 6)
+    # The lookup tables only have the codons without U (as `codon2aa` mixes
+    # DNA and RNA codons, these are left to `translate`)
+    fast &= np.array([s != SPECIAL_CASE_NUCLEOTIDES and 'U' not in s for s in seqs], dtype=bool)
+    [fast_ix] = np.where(fast)
+    try:
+        data = ''.join([seqs[i] for i in fast_ix]).encode('ascii')
+    except UnicodeEncodeError:
+        return [_translate_or_empty(s, skip_invalid) for s in seqs]
+    data = np.frombuffer(data, np.uint8)
+    lens = lens[fast_ix]
+    ends = np.cumsum(lens)
+    starts = ends - lens
+
+    codes = _NUC_CODE[data]
+    first = 25*codes[starts] + 5*codes[starts+1] + codes[starts+2]
+    needs_rc = ~_IS_START[first]
+    if needs_rc.any():
+        seq_of = np.repeat(np.arange(len(lens)), lens)
+        [pos] = np.where(needs_rc[seq_of])
+        s = seq_of[pos]
+        # position i of a reversed sequence comes from position (len - 1 - i)
+        src = starts[s] + ends[s] - 1 - pos
+        oriented = data.copy()
+        oriented[pos] = _RC[data[src]]
+        codes = _NUC_CODE[oriented]
+        # Characters without a complement would raise KeyError in `rc`
+        bad_rc = np.zeros(len(lens), bool)
+        bad_rc[s[oriented[pos] == 0]] = True
+        first = 25*codes[starts] + 5*codes[starts+1] + codes[starts+2]
+        ok = _IS_START[first] & ~bad_rc
+    else:
+        ok = np.ones(len(lens), bool)
+
+    codons = codes.reshape((-1, 3)).astype(np.int16)
+    aas = _CODON_AA[25*codons[:, 0] + 5*codons[:, 1] + codons[:, 2]]
+    cstarts = starts // 3
+    cends = ends // 3
+    last = aas[cends - 1]
+    ok &= (last == ord('*')) | (last == ord('W'))
+    aas[cstarts] = ord('M')
+    aas = aas.tobytes().decode('ascii')
+
+    rs = [None] * len(seqs)
+    for i, cs, ce, valid in zip(fast_ix.tolist(), cstarts.tolist(), cends.tolist(), ok.tolist()):
+        if valid:
+            rs[i] = aas[cs:ce-1]
+    return [(r if r is not None else _translate_or_empty(s, skip_invalid))
+                for r, s in zip(rs, seqs)]
+
+
+def iter_fasta_chunks(ifile, chunk_size):
+    """Reads FASTA records from `ifile` in chunks of `chunk_size` records
+
+    Yields (headers, sequences) pairs
+    """
+    headers = []
+    seqs = []
+    cur = []
+    for line in ifile:
+        line = line.rstrip('\n')
+        if line.startswith('>'):
+            if headers:
+                seqs.append(''.join(cur))
+                cur = []
+                if len(headers) == chunk_size:
+                    yield headers, seqs
+                    headers = []
+                    seqs = []
+            headers.append(line)
+        else:
+            cur.append(line)
+    if headers:
+        seqs.append(''.join(cur))
+        yield headers, seqs
+
+
+def translate_fasta_chunk(chunk):
+    headers, seqs = chunk
+    aas = translate_batch(seqs)
+    return ''.join([f'{h}\n{aa}\n' for h, aa in zip(headers, aas)])
+
+
+def main(args):
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor
+    from collections import deque
+    parser = argparse.ArgumentParser(
+            description='Translate GMSC nucleotide FASTA (stdin) to amino acids (stdout)')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=100_000,
+            help='Number of sequences translated per batch')
+    args = parser.parse_args(args)
+
+    chunks = iter_fasta_chunks(sys.stdin, args.chunk_size)
+    if args.processes <= 1:
+        for ch in chunks:
+            sys.stdout.write(translate_fasta_chunk(ch))
+        return
+    with ProcessPoolExecutor(args.processes) as pool:
+        # Keep a bounded number of chunks in flight, writing them out in order
+        pending = deque()
+        for ch in chunks:
+            pending.append(pool.submit(translate_fasta_chunk, ch))
+            if len(pending) >= 2 * args.processes:
+                sys.stdout.write(pending.popleft().result())
+        while pending:
+            sys.stdout.write(pending.popleft().result())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,39 @@
+# Pre-fork multi-process serving:
+#
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# The app (and, with GMSC_API_PRELOAD set, all the indices) is loaded once in
+# the master process before forking, so workers share it. Large indices are
+# memory-mapped read-only, while file handles and locks are reopened in each
+# worker (see afterfork.py). Searches are tracked in a SQLite database shared
+# by all workers (see searchregistry.py), which also run the queued searches.
+import os
+
+bind = os.environ.get('GMSC_API_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('GMSC_API_WORKERS', os.cpu_count()))
+threads = int(os.environ.get('GMSC_API_THREADS', 4))
+preload_app = True
+
+# Search worker threads are started in each worker (see post_fork below)
+# rather than when the app is loaded in the master process
+os.environ['GMSC_API_PREFORK'] = '1'
+
+# In-memory caches are per worker, so their sizes are divided by this (see
+# NR_PROCESSES in seqinfo.py)
+os.environ['GMSC_API_NR_PROCESSES'] = str(workers)
+
+
+def when_ready(server):
+    # Called in the master process, before the workers are forked
+    import app
+    if os.environ.get('GMSC_API_PRELOAD'):
+        app.preload_indices()
+    if not app.IS_DEMO and os.environ.get('GMSC_API_SEQ_FILTER_PREWARM'):
+        # Run to completion (rather than in a thread, which would not survive
+        # fork), so that every worker starts with the cache filled
+        app.prewarm_seq_filter_cache(os.environ['GMSC_API_SEQ_FILTER_PREWARM'])
+
+
+def post_fork(server, worker):
+    import app
+    app.start_search_workers()
@@ -0,0 +1,130 @@
+'''Manifest of the files in the index directory
+
+`make-indices.py` finishes by writing `MANIFEST.json` to the index directory:
+
+    {
+        "format_version": 3,
+        "sources": {"gmsc-db/<file>": {"size": ..., "sha256": "..."}, ...},
+        "files": {"<file>.npy": {"dtype": "<u2", "shape": [...]},
+                  "<other file>": {"size": ...}, ...}
+    }
+
+When an index array is loaded with `load_index`, its dtype and shape are
+checked against the manifest of its directory (if there is one), as is the
+size of other index files opened after `check_index_file`. Indices
+built with a different format version, or from source files with a different
+size, are rejected.
+'''
+import os
+import json
+import hashlib
+from os import path
+
+import numpy as np
+
+MANIFEST_NAME = 'MANIFEST.json'
+
+# Version 2: narrow annotation codes, compact FASTA offsets (see
+# recordoffsets.py), and 32-bit cluster arrays
+# Version 3: compact offsets in the 2-bit and amino acid stores
+FORMAT_VERSION = 3
+
+# Manifests already read, by index directory (without a lock: two threads
+# may both read a manifest, but the results are the same)
+_manifests = {}
+
+
+class IndexFormatError(Exception):
+    pass
+
+
+def hash_file(fname):
+    '''Returns `(size, sha256)` of a file'''
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        while ch := f.read(16 * 1024 * 1024):
+            h.update(ch)
+    return path.getsize(fname), h.hexdigest()
+
+
+def write_manifest(index_dir, sources):
+    '''Writes the manifest of all the files currently in `index_dir`
+
+    `sources` is a list of `(fname, size, sha256)` for the input files
+    '''
+    files = {}
+    for fname in sorted(os.listdir(index_dir)):
+        full = path.join(index_dir, fname)
+        if fname == MANIFEST_NAME or not path.isfile(full):
+            continue
+        if fname.endswith('.npy'):
+            arr = np.load(full, mmap_mode='r')
+            files[fname] = {'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+        else:
+            files[fname] = {'size': path.getsize(full)}
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'sources': {fname: {'size': size, 'sha256': sha256}
+                        for fname, size, sha256 in sources},
+        'files': files,
+    }
+    tmp = path.join(index_dir, MANIFEST_NAME + '.tmp')
+    with open(tmp, 'wt') as out:
+        json.dump(manifest, out, indent=2)
+    os.rename(tmp, path.join(index_dir, MANIFEST_NAME))
+
+
+def read_manifest(index_dir):
+    '''Returns the manifest of `index_dir` (None if there is none)
+
+    Raises IndexFormatError if the indices are not usable
+    '''
+    index_dir = path.normpath(index_dir)
+    if index_dir not in _manifests:
+        _manifests[index_dir] = _read_manifest(index_dir)
+    return _manifests[index_dir]
+
+
+def _read_manifest(index_dir):
+    fname = path.join(index_dir, MANIFEST_NAME)
+    if not path.exists(fname):
+        return None
+    with open(fname) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise IndexFormatError(
+                f'Indices in {index_dir} have format version {manifest.get("format_version")} '
+                f'(expected {FORMAT_VERSION}): please rebuild them')
+    for source, info in manifest['sources'].items():
+        if path.exists(source) and path.getsize(source) != info['size']:
+            raise IndexFormatError(
+                    f'Indices in {index_dir} were built from a different {source}: please rebuild them')
+    return manifest
+
+
+def load_index(fname, mmap_mode='r'):
+    '''Loads an index array, checking it against the manifest'''
+    arr = np.load(fname, mmap_mode=mmap_mode)
+    manifest = read_manifest(path.dirname(fname))
+    if manifest is None:
+        return arr
+    expected = manifest['files'].get(path.basename(fname))
+    if expected is not None and \
+            (arr.dtype.str != expected['dtype'] or list(arr.shape) != expected['shape']):
+        raise IndexFormatError(
+                f'{fname} has dtype {arr.dtype.str} and shape {list(arr.shape)} '
+                f'(expected {expected["dtype"]} and {expected["shape"]}): please rebuild the indices')
+    return arr
+
+
+def check_index_file(fname):
+    '''Checks the size of an index file (other than an array) against the
+    manifest'''
+    manifest = read_manifest(path.dirname(fname))
+    if manifest is None:
+        return
+    expected = manifest['files'].get(path.basename(fname))
+    if expected is not None and 'size' in expected and path.getsize(fname) != expected['size']:
+        raise IndexFormatError(
+                f'{fname} has size {path.getsize(fname)} (expected {expected["size"]}): '
+                'please rebuild the indices')
@@ -0,0 +1,172 @@
+'''Inverted k-mer index over amino acid sequences, for near-exact search
+
+For every k-mer (of the 20 standard amino acids), the index lists the
+sequences containing it:
+
+- `<name>.kmers.offsets.npy`: start of the postings of each k-mer (k-mers are
+  numbered in base 20), plus a final entry with the total
+- `<name>.kmers.postings.npy`: sequence indices (sorted, for each k-mer)
+
+To keep the index small, only k-mers starting at every KMER_STRIDE-th
+position of each sequence are indexed, while all the k-mers of the query are
+looked up. A query therefore finds every sequence with which it shares an
+identical stretch of KMER_SIZE + KMER_STRIDE - 1 amino acids. With the
+defaults (7 amino acids), this includes every sequence with at least 90%
+identity to a query of 30 or more amino acids.
+
+Candidates are verified by aligning them to the query.
+'''
+import numpy as np
+
+from indexmanifest import load_index
+
+AMINO_ACIDS = b'ACDEFGHIKLMNPQRSTVWY'
+KMER_SIZE = 5
+KMER_STRIDE = 3
+NR_KMERS = len(AMINO_ACIDS) ** KMER_SIZE
+
+_CODE = np.full(256, 255, np.uint8)
+for _i, _a in enumerate(AMINO_ACIDS):
+    _CODE[_a] = _i
+
+
+def kmers_of(data, starts, stride):
+    '''Computes the k-mers of several sequences stored back-to-back
+
+    `data` is a uint8 array with the sequences and `starts` the offset of
+    each sequence (plus a final entry with the total length). Only k-mers
+    starting at multiples of `stride` (within each sequence) are returned.
+    K-mers containing non-standard amino acids are skipped.
+
+    Returns `(kmers, seq_ixs)`: the k-mers and the sequence each comes from
+    '''
+    codes = _CODE[data]
+    starts = np.asarray(starts, dtype=np.int64)
+    nr_windows = len(data) - KMER_SIZE + 1
+    if nr_windows <= 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    invalid = np.concatenate([[0], np.cumsum(codes == 255)])
+    lens = np.diff(starts)
+    seq_ixs = np.repeat(np.arange(len(lens)), lens)[:nr_windows]
+    pos = np.arange(nr_windows)
+    keep = (invalid[pos + KMER_SIZE] == invalid[pos]) \
+            & (pos + KMER_SIZE <= starts[seq_ixs + 1]) \
+            & ((pos - starts[seq_ixs]) % stride == 0)
+    pos = pos[keep]
+    kmers = np.zeros(len(pos), np.int64)
+    for j in range(KMER_SIZE):
+        kmers *= len(AMINO_ACIDS)
+        kmers += codes[pos + j]
+    return kmers, seq_ixs[keep]
+
+
+def _iter_batches(data, starts, batch_size):
+    '''Yields `(first_ix, kmers, seq_ixs)` with the distinct k-mers of each
+    sequence in a batch, sorted by k-mer (and then by sequence)'''
+    n = len(starts) - 1
+    for b in range(0, n, batch_size):
+        e = min(b + batch_size, n)
+        kmers, seq_ixs = kmers_of(
+                np.asarray(data[starts[b]:starts[e]]),
+                np.asarray(starts[b:e+1], dtype=np.int64) - int(starts[b]),
+                KMER_STRIDE)
+        keys = kmers * (e - b) + seq_ixs
+        keys.sort()
+        if len(keys):
+            keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        yield b, keys // (e - b), keys % (e - b)
+
+
+def build_kmer_index(data, starts, oname, batch_size=1_000_000):
+    '''Builds the index of sequences stored back-to-back in `data` (see
+    `kmers_of`), in two passes: counting and then filling in the postings'''
+    counts = np.zeros(NR_KMERS, np.int64)
+    for _, kmers, _ in _iter_batches(data, starts, batch_size):
+        counts += np.bincount(kmers, minlength=NR_KMERS)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.uint64)
+    np.save(oname + '.kmers.offsets.npy', offsets)
+
+    postings = np.lib.format.open_memmap(oname + '.kmers.postings.npy',
+                                        mode='w+',
+                                        dtype=np.uint32,
+                                        shape=(int(offsets[-1]),))
+    fill = offsets[:-1].astype(np.int64)
+    for first, kmers, seq_ixs in _iter_batches(data, starts, batch_size):
+        if not len(kmers):
+            continue
+        [group_starts] = np.where(np.concatenate([[True], kmers[1:] != kmers[:-1]]))
+        group_sizes = np.diff(np.append(group_starts, len(kmers)))
+        rank = np.arange(len(kmers)) - np.repeat(group_starts, group_sizes)
+        postings[fill[kmers] + rank] = seq_ixs + first
+        fill[kmers[group_starts]] += group_sizes
+    postings.flush()
+
+
+def semiglobal_distances(query, subjects, max_distance=None):
+    '''Edit distance between `query` and its best match within each subject
+
+    The whole query must be aligned, but the subject may be longer (leading
+    and trailing subject residues are free). Returns an array with one
+    distance per subject.
+
+    If `max_distance` is given, subjects are dropped as soon as they cannot
+    be within it (and their distance is reported as `max_distance + 1`).
+    '''
+    q = np.frombuffer(query, np.uint8)
+    if max_distance is None:
+        max_distance = len(q)
+    width = max((len(s) for s in subjects), default=0)
+    # Padding never matches (and, as it is at the end, cannot help)
+    S = np.full((len(subjects), width), 0, np.uint8)
+    lens = np.array([len(s) for s in subjects], np.int64)
+    for i, s in enumerate(subjects):
+        S[i, :len(s)] = np.frombuffer(s, np.uint8)
+    cols = np.arange(width + 1)
+    # Past the end of the subject is not a valid alignment end
+    past_end = cols[None, :] > lens[:, None]
+    distances = np.full(len(subjects), max_distance + 1, np.int64)
+    active = np.arange(len(subjects))
+    prev = np.zeros((len(subjects), width + 1), np.int64)
+    for i in range(len(q)):
+        cur = np.empty_like(prev)
+        cur[:, 0] = i + 1
+        cur[:, 1:] = np.minimum(prev[:, :-1] + (S != q[i]), prev[:, 1:] + 1)
+        # Insertions in the query: cur[j] = min_k (cur[k] + (j - k))
+        cur = np.minimum.accumulate(cur - cols, axis=1) + cols
+        prev = cur
+        # The minimum of a row never decreases in the following rows
+        alive = np.where(past_end, max_distance + 1, cur).min(axis=1) <= max_distance
+        if not alive.all():
+            S = S[alive]
+            prev = prev[alive]
+            past_end = past_end[alive]
+            active = active[alive]
+    prev[past_end] = max_distance + 1
+    distances[active] = prev.min(axis=1, initial=max_distance + 1)
+    return distances
+
+
+class KmerIndex:
+    def __init__(self, name):
+        self.offsets = load_index(name + '.kmers.offsets.npy')
+        self.postings = load_index(name + '.kmers.postings.npy')
+
+    def candidates(self, seq, max_candidates, max_postings):
+        '''Returns the indices of the sequences sharing most k-mers with
+        `seq` (at most `max_candidates`)
+
+        K-mers occurring in more than `max_postings` sequences (typically,
+        low-complexity ones) are ignored
+        '''
+        kmers, _ = kmers_of(np.frombuffer(seq, np.uint8), [0, len(seq)], 1)
+        hits = []
+        for km in np.unique(kmers).tolist():
+            start = int(self.offsets[km])
+            end = int(self.offsets[km + 1])
+            if end - start <= max_postings:
+                hits.append(self.postings[start:end])
+        if not hits:
+            return np.zeros(0, np.int64)
+        ixs, counts = np.unique(np.concatenate(hits), return_counts=True)
+        best = np.argsort(-counts, kind='stable')[:max_candidates]
+        return ixs[best].astype(np.int64)
@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+import afterfork
+
+# Approximate memory used by each entry other than its value and key (the
+# dict slot, the key and value objects...)
+ENTRY_OVERHEAD = 64
+
+
+class LRUCache:
+    '''Thread-safe LRU cache, bounded by the total size of its values
+
+    `sizeof` computes the size of a value (default: `len`, appropriate for
+    bytes). Each entry is also charged ENTRY_OVERHEAD plus the length of the
+    key's repr, so that many small (even empty) values are evicted too.
+    '''
+    def __init__(self, max_size, sizeof=len):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.cur_size = 0
+        self.nr_hits = 0
+        self.nr_misses = 0
+        self.values = OrderedDict()
+        self._lock = threading.Lock()
+        afterfork.register(self)
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        '''Returns the cached value for `key`, calling `load()` on a miss'''
+        value = self.lookup(key)
+        if value is None:
+            value = load()
+            self.put(key, value)
+        return value
+
+    def lookup(self, key):
+        '''Returns the cached value for `key` (None if it is not cached)'''
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                self.nr_misses += 1
+                return None
+            self.values.move_to_end(key)
+            self.nr_hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self.values:
+                return
+            # The size is kept with the value, so that it is only computed once
+            size = self.sizeof(value) + ENTRY_OVERHEAD + len(repr(key))
+            self.values[key] = (value, size)
+            self.cur_size += size
+            while self.cur_size > self.max_size and len(self.values) > 1:
+                _, (_, evicted_size) = self.values.popitem(last=False)
+                self.cur_size -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self.values),
+                'size': self.cur_size,
+                'max_size': self.max_size,
+                'hits': self.nr_hits,
+                'misses': self.nr_misses,
+                }
@@ -33,11 +33,144 @@ def make_start_index(ifname, index_dir):
     starts.append([start])
     starts = np.concatenate(starts)
 
-    ofname = f'{index_dir}/{path.basename(ifname)}.starts.npy'
-    np.save(ofname, starts)
+    from recordoffsets import write_record_offsets
+    oname = f'{index_dir}/{path.basename(ifname)}'
+    write_record_offsets(starts, oname)
+    return oname + '.offsets.npy'
+
+
+@TaskGenerator
+def make_xz_block_index(ifname, index_dir):
+    import numpy as np
+    from xzblocks import read_block_layout
+    blocks = read_block_layout(ifname)
+    print(f'{ifname}: {len(blocks)} xz blocks')
+    ofname = f'{index_dir}/{path.basename(ifname)}.blocks.npy'
+    np.save(ofname, blocks)
+    return ofname
+
+
+def iter_fasta_seqs(ifname):
+    '''Yields the sequences (as bytes) of a FASTA file (possibly xz-compressed)'''
+    import lzma
+    op = (lzma.open if ifname.endswith('.xz') else open)
+    with op(ifname, 'rb') as ifile:
+        for line in ifile:
+            if not line.startswith(b'>'):
+                yield line.rstrip(b'\n')
+
+
+def index_basename(ifname):
+    if ifname.endswith('.xz'):
+        ifname = ifname[:-len('.xz')]
+    return path.basename(ifname)
+
+
+@TaskGenerator
+def make_2bit_store(ifname, index_dir):
+    from packedseq import PackedSeqWriter
+    BATCH_SIZE = 1_000_000
+
+    ofname = f'{index_dir}/{index_basename(ifname)}.2bit'
+    writer = PackedSeqWriter(ofname)
+    batch = []
+    for seq in iter_fasta_seqs(ifname):
+        batch.append(seq)
+        if len(batch) == BATCH_SIZE:
+            writer.add(batch)
+            batch = []
+    writer.add(batch)
+    writer.close()
+    return ofname
+
+
+@TaskGenerator
+def make_aminoacid_store(ifname, index_dir):
+    from aminoacidstore import AminoAcidStoreWriter
+    BATCH_SIZE = 1_000_000
+
+    # GMSC10.90AA.fna.xz -> GMSC10.90AA.aminoacid
+    ofname = f'{index_dir}/{index_basename(ifname).replace(".fna", ".aminoacid")}'
+    writer = AminoAcidStoreWriter(ofname)
+    batch = []
+    for seq in iter_fasta_seqs(ifname):
+        batch.append(seq)
+        if len(batch) == BATCH_SIZE:
+            writer.add(batch)
+            batch = []
+    writer.add(batch)
+    writer.close()
     return ofname
 
 
+@TaskGenerator
+def make_aminoacid_hash_index(aminoacid_store):
+    '''Builds the exact-match index of the amino acid sequences'''
+    from seqhash import HashIndexWriter
+    from aminoacidstore import AminoAcidStore
+    BATCH_SIZE = 1_000_000
+
+    store = AminoAcidStore(aminoacid_store)
+    data = store.data
+    all_starts = store.starts
+    writer = HashIndexWriter(aminoacid_store)
+    for b in range(0, len(all_starts) - 1, BATCH_SIZE):
+        # Only the offsets of the current batch are converted to a list
+        starts = all_starts[b:b + BATCH_SIZE + 1].tolist()
+        chunk = data[starts[0]:starts[-1]].tobytes()
+        base = starts[0]
+        writer.add([chunk[s - base:e - base] for s, e in zip(starts[:-1], starts[1:])])
+    writer.close()
+    return aminoacid_store + '.hash.npy'
+
+
+@TaskGenerator
+def make_nucleotide_hash_index(ifname, index_dir):
+    '''Builds the exact-match index of the nucleotide sequences'''
+    from seqhash import HashIndexWriter
+    BATCH_SIZE = 1_000_000
+
+    oname = f'{index_dir}/{index_basename(ifname)}'
+    writer = HashIndexWriter(oname)
+    batch = []
+    for seq in iter_fasta_seqs(ifname):
+        batch.append(seq)
+        if len(batch) == BATCH_SIZE:
+            writer.add(batch)
+            batch = []
+    writer.add(batch)
+    writer.close()
+    return oname + '.hash.npy'
+
+
+@TaskGenerator
+def make_kmer_index(aminoacid_store):
+    '''Builds the k-mer index used for near-exact search (see kmerindex.py)'''
+    from kmerindex import build_kmer_index
+    from aminoacidstore import AminoAcidStore
+    store = AminoAcidStore(aminoacid_store)
+    build_kmer_index(store.data, store.starts, aminoacid_store)
+    return aminoacid_store + '.kmers.postings.npy'
+
+
+@TaskGenerator
+def hash_source(ifname):
+    from indexmanifest import hash_file
+    size, sha256 = hash_file(ifname)
+    return ifname, size, sha256
+
+
+@TaskGenerator
+def make_manifest(index_dir, sources, indices):
+    '''Records the files in the index directory (see indexmanifest.py)
+
+    `indices` is not used, but makes this run after all other tasks
+    '''
+    from indexmanifest import write_manifest, MANIFEST_NAME
+    write_manifest(index_dir, sources)
+    return f'{index_dir}/{MANIFEST_NAME}'
+
+
 def get_ix(n):
     _,_,n = n.split('.')
     return int(n)
@@ -81,48 +214,111 @@ def make_cluster_index(sizes, index_dir):
                 prev = ix90
             data[cur100] = ix100
     ix[-1] = len(data)
-    np.save(f'{index_dir}/GMSC10.cluster.index.npy', ix)
-    np.save(f'{index_dir}/GMSC10.cluster.data.npy', data)
+    ix_dtype = (np.uint32 if max(len(data), int(data.max())) < 2**32 else np.uint64)
+    np.save(f'{index_dir}/GMSC10.cluster.index.npy', ix.astype(ix_dtype))
+    np.save(f'{index_dir}/GMSC10.cluster.data.npy', data.astype(ix_dtype))
+
+    # Reverse index: 100AA -> 90AA (-1 for 100AA sequences not in any cluster)
+    reverse = np.full(int(data.max()) + 1, -1,
+                      dtype=(np.int32 if len(ix) < 2**31 else np.int64))
+    reverse[data] = np.repeat(np.arange(len(ix) - 1), np.diff(ix).astype(np.int64))
+    np.save(f'{index_dir}/GMSC10.cluster.reverse.npy', reverse)
+    return f'{index_dir}/GMSC10.cluster.index.npy'
 
 
 @TaskGenerator
-def create_index(infile, index_dir, tag, col_ix):
-    import lzma
+def create_annotation_indices(infile, index_dir):
+    '''Encodes the habitat and taxonomy columns of an annotation table
+
+    Returns the `.npy` files (habitat, then taxonomy)
+    '''
+    from annotationindex import build_annotation_indices
+
+    assert infile.endswith('.tsv.xz')
+    outputs = []
+    for col_ix, tag in enumerate(['general_habitat', 'taxonomy']):
+        basename = path.basename(infile)[:-len('.tsv.xz')].replace('annotation', tag)
+        outputs.append((col_ix, tag, f'{index_dir}/{basename}'))
+    build_annotation_indices(infile, outputs)
+    return [f'{basename}.npy' for _, _, basename in outputs]
+
+@TaskGenerator
+def make_habitat_bitmaps(habitat_index, index_dir):
+    '''Builds one bitmap (packed with np.packbits) per individual habitat term
+
+    Row `t` of the output has bit `i` set if sequence `i` has habitat term `t`
+    (habitat labels are comma-separated lists of terms).
+    '''
     import numpy as np
     import pandas as pd
-    from os import path
+    CHUNK_SIZE = 8 * 1_000_000
 
-    tax_set = set()
+    assert habitat_index.endswith('.npy')
+    basename = habitat_index[:-len('.npy')]
+    labels = pd.read_table(f'{basename}.index.tsv',
+                            index_col=0,
+                            header=None,
+                            keep_default_na=False,
+                            names=['seq_ix', 'habitat']
+                            ).squeeze()
+    terms = sorted(set(t for label in labels.values for t in label.split(',')))
+    label_has_term = np.zeros((len(labels), len(terms)), dtype=bool)
+    for i, label in enumerate(labels.values):
+        for t in label.split(','):
+            label_has_term[i, terms.index(t)] = True
 
-    nr_lines = 0
-    for ch in pd.read_table(infile, header=None, chunksize=1_000_000, usecols=[col_ix]):
-        ch = ch[col_ix]
-        tax_set.update(ch.fillna('Unknown'))
-        nr_lines += len(ch)
-        print(f'Processed {nr_lines//1_000_000}m')
-    print(f'Finished reading in taxa set ({len(tax_set)} elements)')
-    tax_order = sorted(list(tax_set))
-    tax_dict = {}
+    habitat_ix = np.load(habitat_index, mmap_mode='r')
+    n = len(habitat_ix)
+    ofname = f'{basename}.bitmaps.npy'
+    bitmaps = np.lib.format.open_memmap(ofname,
+                                        mode='w+',
+                                        dtype=np.uint8,
+                                        shape=(len(terms), (n + 7) // 8))
+    for start in range(0, n, CHUNK_SIZE):
+        has_term = label_has_term[habitat_ix[start:start+CHUNK_SIZE]]
+        packed = np.packbits(has_term, axis=0)
+        bitmaps[:, start//8:start//8 + len(packed)] = packed.T
+    bitmaps.flush()
+    with open(f'{basename}.bitmaps.terms.tsv', 'wt') as out:
+        for i, t in enumerate(terms):
+            out.write(f'{i}\t{t}\n')
+    return ofname
+
+@TaskGenerator
+def make_taxonomy_clades(taxonomy_index, index_dir):
+    '''Lists the range of taxonomy IDs in each clade
+
+    Taxonomy IDs are assigned in rank order (see `sort_labels` in
+    annotationindex.py), so every clade (any prefix of a lineage) covers a
+    contiguous range of IDs.
+    '''
+    import pandas as pd
+    assert taxonomy_index.endswith('.npy')
+    basename = taxonomy_index[:-len('.npy')]
+    labels = pd.read_table(f'{basename}.index.tsv',
+                            index_col=0,
+                            header=None,
+                            keep_default_na=False,
+                            names=['seq_ix', 'taxonomy']
+                            ).squeeze()
+    clades = {}
+    for i, label in enumerate(labels.values):
+        ranks = label.split(';')
+        for r in range(1, len(ranks) + 1):
+            clade = ';'.join(ranks[:r])
+            if clade in clades:
+                start, end = clades[clade]
+                if end != i:
+                    raise ValueError(f'Clade {clade} is not contiguous (was the taxonomy index sorted by rank?)')
+                clades[clade] = (start, i + 1)
+            else:
+                clades[clade] = (i, i + 1)
+    ofname = f'{basename}.clades.tsv'
+    with open(ofname, 'wt') as out:
+        for clade, (start, end) in clades.items():
+            out.write(f'{start}\t{end}\t{clade}\n')
+    return ofname
 
-    assert infile.endswith('.tsv.xz')
-    basename = path.basename(infile)[:-len('.tsv.xz')].replace('annotation', tag)
-    outfile1 = f'{index_dir}/{basename}.index.tsv'
-    outfile2 = f'{index_dir}/{basename}.npy'
-
-    with open(outfile1,'wt') as out:
-        for n,item in enumerate(tax_order):
-            tax_dict[item] = n
-            out.write(f'{n}\t{item}\n')
-
-    odata = np.zeros(nr_lines, int)
-    with lzma.open(infile,'rt') as f:
-        for ix,line in enumerate(f):
-            tokens = line.strip().split('\t')
-            cur = tokens[col_ix]
-            if cur:
-                odata[ix] = tax_dict[cur]
-    np.save(outfile2, odata)
-    return outfile2
 
 @TaskGenerator
 def create_hq_list(ifile, index_dir):
@@ -144,12 +340,29 @@ def create_hq_list(ifile, index_dir):
     return oname
 
 
+@TaskGenerator
+def make_hq_bitset(hq_list, habitat_index, index_dir):
+    '''Packs the high-quality flags of all sequences into a bitset
+
+    Bit `i` (in np.packbits order) is set if sequence `i` is high-quality, so
+    that the server can memory-map it instead of building a boolean array
+    '''
+    import numpy as np
+    n = len(np.load(habitat_index, mmap_mode='r'))
+    is_hq = np.zeros(n, dtype=bool)
+    is_hq[np.load(hq_list)] = True
+    oname = hq_list.replace('.high_quality_ix.npy', '.high_quality.bitset.npy')
+    np.save(oname, np.packbits(is_hq))
+    return oname
+
+
 @TaskGenerator
 def quality_tests_as_parquet(ifile, index_dir):
     import lzma
     import polars as pl
     import tempfile
     import pathlib
+    from qualitystore import write_quality_store
     assert ifile.endswith('.tsv.xz')
     ifile = pathlib.PurePath(ifile)
     oname = f'{index_dir}/{ifile.stem.replace("tsv", "parquet")}'
@@ -181,25 +394,65 @@ def quality_tests_as_parquet(ifile, index_dir):
           ])
         s.write_parquet(oname,
                         compression='lz4')
+        write_quality_store(s, oname.removesuffix('.parquet'))
         return oname
 
 INDEX_DIRECTORY = 'gmsc-db-index'
 
-make_start_index('gmsc-db/GMSC10.100AA.fna.xz', INDEX_DIRECTORY)
-make_start_index('gmsc-db/GMSC10.90AA.fna.xz', INDEX_DIRECTORY)
+SOURCES = [
+    'gmsc-db/GMSC10.100AA.fna.xz',
+    'gmsc-db/GMSC10.90AA.fna.xz',
+    'gmsc-db/GMSC10.cluster.sorted2.tsv.xz',
+    'gmsc-db/GMSC10.100AA.annotation.tsv.xz',
+    'gmsc-db/GMSC10.90AA.annotation.tsv.xz',
+    'gmsc-db/GMSC10.90AA.quality_test.tsv.xz',
+]
+
+indices = [
+    make_start_index('gmsc-db/GMSC10.100AA.fna.xz', INDEX_DIRECTORY),
+    make_start_index('gmsc-db/GMSC10.90AA.fna.xz', INDEX_DIRECTORY),
+
+    make_xz_block_index('gmsc-db/GMSC10.100AA.fna.xz', INDEX_DIRECTORY),
+    make_xz_block_index('gmsc-db/GMSC10.90AA.fna.xz', INDEX_DIRECTORY),
+
+    make_2bit_store('gmsc-db/GMSC10.100AA.fna.xz', INDEX_DIRECTORY),
+    make_2bit_store('gmsc-db/GMSC10.90AA.fna.xz', INDEX_DIRECTORY),
+]
+
+aa100 = make_aminoacid_store('gmsc-db/GMSC10.100AA.fna.xz', INDEX_DIRECTORY)
+aa90 = make_aminoacid_store('gmsc-db/GMSC10.90AA.fna.xz', INDEX_DIRECTORY)
+
+indices.extend([
+    make_aminoacid_hash_index(aa100),
+    make_aminoacid_hash_index(aa90),
+    make_nucleotide_hash_index('gmsc-db/GMSC10.100AA.fna.xz', INDEX_DIRECTORY),
+    make_nucleotide_hash_index('gmsc-db/GMSC10.90AA.fna.xz', INDEX_DIRECTORY),
+
+    make_kmer_index(aa90),
+])
 
 
 sizes = get_cluster_sizes()
-make_cluster_index(sizes, INDEX_DIRECTORY)
+indices.append(make_cluster_index(sizes, INDEX_DIRECTORY))
+
 
+annotation100 = create_annotation_indices('gmsc-db/GMSC10.100AA.annotation.tsv.xz', INDEX_DIRECTORY)
+annotation90 = create_annotation_indices( 'gmsc-db/GMSC10.90AA.annotation.tsv.xz', INDEX_DIRECTORY)
+habitat90 = annotation90[0]
+taxonomy90 = annotation90[1]
 
-create_index('gmsc-db/GMSC10.100AA.annotation.tsv.xz', INDEX_DIRECTORY, 'general_habitat', 0)
-create_index( 'gmsc-db/GMSC10.90AA.annotation.tsv.xz', INDEX_DIRECTORY, 'general_habitat', 0)
+indices.extend([
+    annotation100,
+    make_habitat_bitmaps(habitat90, INDEX_DIRECTORY),
+    make_taxonomy_clades(taxonomy90, INDEX_DIRECTORY),
+])
 
-create_index('gmsc-db/GMSC10.100AA.annotation.tsv.xz', INDEX_DIRECTORY, 'taxonomy', 1)
-create_index( 'gmsc-db/GMSC10.90AA.annotation.tsv.xz', INDEX_DIRECTORY, 'taxonomy', 1)
+hq90 = create_hq_list('gmsc-db/GMSC10.90AA.quality_test.tsv.xz', INDEX_DIRECTORY)
+indices.append(make_hq_bitset(hq90, habitat90, INDEX_DIRECTORY))
 
-create_hq_list('gmsc-db/GMSC10.90AA.quality_test.tsv.xz', INDEX_DIRECTORY)
+indices.append(quality_tests_as_parquet('gmsc-db/GMSC10.90AA.quality_test.tsv.xz',
+                         INDEX_DIRECTORY))
 
-quality_tests_as_parquet('gmsc-db/GMSC10.90AA.quality_test.tsv.xz',
-                         INDEX_DIRECTORY)
+make_manifest(INDEX_DIRECTORY,
+              [hash_source(s) for s in SOURCES],
+              indices)
@@ -0,0 +1,118 @@
+'''2-bit packed nucleotide store
+
+Sequences are stored back-to-back, 4 bases per byte (first base in the
+highest bits), in a single raw file that is memory-mapped for reading:
+
+- `<name>.2bit`: packed bases
+- `<name>.2bit.offsets.npy` & `<name>.2bit.lengths.npy`: position (in bases)
+  of each sequence, as a compact table of lengths (see recordoffsets.py;
+  older stores have `<name>.2bit.starts.npy` instead)
+- `<name>.2bit.exc_pos.npy` & `<name>.2bit.exc_base.npy`: positions (sorted)
+  and original values of every base that is not one of ACGT (these are stored
+  as `A` in the packed array)
+'''
+import mmap
+from os import path
+
+import numpy as np
+
+from recordoffsets import RecordOffsets, write_record_lengths
+from indexmanifest import load_index, check_index_file
+
+BASES = b'ACGT'
+
+_ENCODE = np.full(256, 255, np.uint8)
+for _i, _b in enumerate(BASES):
+    _ENCODE[_b] = _i
+
+# Maps a packed byte to its 4 bases
+_DECODE = np.array([
+        [BASES[(v >> shift) & 3] for shift in (6, 4, 2, 0)]
+        for v in range(256)], dtype=np.uint8)
+
+# The same, as bytes objects (decoding a few bytes with b''.join is much
+# faster than with numpy)
+_DECODE_BYTES = [row.tobytes() for row in _DECODE]
+
+
+class PackedSeqWriter:
+    def __init__(self, oname):
+        self.oname = oname
+        self.out = open(oname, 'wb')
+        self.lengths = []
+        self.exc_pos = []
+        self.exc_base = []
+        self.pos = 0
+        self.leftover = np.zeros(0, np.uint8)
+
+    def add(self, seqs):
+        '''Adds a batch of sequences (list of bytes)'''
+        if not seqs:
+            return
+        lens = np.array([len(s) for s in seqs], np.uint64)
+        # Kept with the narrowest type for the batch, as there is one per sequence
+        self.lengths.append(lens.astype(np.min_scalar_type(int(lens.max()))))
+        bases = np.frombuffer(b''.join(seqs), np.uint8)
+        codes = _ENCODE[bases]
+        [exc] = np.where(codes == 255)
+        if len(exc):
+            self.exc_pos.append(exc.astype(np.uint64) + np.uint64(self.pos))
+            self.exc_base.append(bases[exc])
+            codes[exc] = 0
+        self.pos += len(bases)
+        codes = np.concatenate([self.leftover, codes])
+        n = len(codes) - len(codes) % 4
+        self.leftover = codes[n:]
+        self._write(codes[:n])
+
+    def _write(self, codes):
+        q = codes.reshape((-1, 4))
+        packed = (q[:, 0] << 6) | (q[:, 1] << 4) | (q[:, 2] << 2) | q[:, 3]
+        self.out.write(packed.tobytes())
+
+    def close(self):
+        if len(self.leftover):
+            codes = np.zeros(4, np.uint8)
+            codes[:len(self.leftover)] = self.leftover
+            self._write(codes)
+        self.out.close()
+        write_record_lengths(np.concatenate(self.lengths) if self.lengths else np.zeros(0, np.uint8),
+                             self.oname)
+        np.save(self.oname + '.exc_pos.npy',
+                np.concatenate(self.exc_pos) if self.exc_pos else np.zeros(0, np.uint64))
+        np.save(self.oname + '.exc_base.npy',
+                np.concatenate(self.exc_base) if self.exc_base else np.zeros(0, np.uint8))
+
+
+class PackedNucleotideReader:
+    def __init__(self, fname):
+        check_index_file(fname)
+        with open(fname, 'rb') as f:
+            # Slicing an mmap returns bytes directly (np.memmap slices are
+            # much slower to create)
+            self.packed = (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                            if path.getsize(fname) else b'')
+        self.offsets = RecordOffsets(fname)
+        self.exc_pos = np.asarray(load_index(fname + '.exc_pos.npy'))
+        self.exc_base = np.asarray(load_index(fname + '.exc_base.npy'))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def get(self, ix):
+        start, end = self.offsets.span(ix)
+        b0 = start // 4
+        seq = b''.join(map(_DECODE_BYTES.__getitem__, self.packed[b0:(end + 3) // 4]))
+        seq = seq[start - 4 * b0:end - 4 * b0]
+        if len(self.exc_pos):
+            # (the keys must have the same dtype, or the whole array is cast)
+            lo, hi = self.exc_pos.searchsorted(np.array([start, end], dtype=self.exc_pos.dtype))
+            if lo < hi:
+                seq = bytearray(seq)
+                for p, b in zip(self.exc_pos[lo:hi].tolist(), self.exc_base[lo:hi].tolist()):
+                    seq[p - start] = b
+                seq = bytes(seq)
+        return seq
+
+    def get_many(self, ixs):
+        return [self.get(ix) for ix in ixs]
@@ -0,0 +1,87 @@
+'''Memory-mapped columnar store of the quality tests
+
+Each column is saved as a fixed-width array in `<prefix>.<column>.npy`, so
+that a row is just a few scalar loads and filters are vectorized comparisons
+over (memory-mapped) slices. Missing values are encoded as:
+
+- boolean columns (antifam, terminal): int8 with 1/0 and BOOL_NULL
+- integer columns (metat, riboseq): int32 with INT_NULL
+- float columns (rnacode, metap): float32 with NaN
+'''
+import operator
+from os import path
+
+import numpy as np
+
+from indexmanifest import load_index
+
+BOOL_COLUMNS = ['antifam', 'terminal']
+INT_COLUMNS = ['metat', 'riboseq']
+COLUMNS = ['antifam', 'terminal', 'rnacode', 'metat', 'riboseq', 'metap']
+
+BOOL_NULL = -1
+INT_NULL = np.iinfo(np.int32).min
+
+# Comparisons usable in conditions, which are `(column, op, value)` tuples.
+# These work on numpy arrays as well as on polars expressions.
+OPERATORS = {
+    '==': operator.eq,
+    '<=': operator.le,
+    '>=': operator.ge,
+}
+
+
+def write_quality_store(df, prefix):
+    '''Writes the columns of a polars DataFrame (see COLUMNS)'''
+    import polars as pl
+    for c in COLUMNS:
+        col = df[c]
+        if c in BOOL_COLUMNS:
+            arr = col.cast(pl.Int8).fill_null(BOOL_NULL).to_numpy()
+        elif c in INT_COLUMNS:
+            arr = col.cast(pl.Int32).fill_null(INT_NULL).to_numpy()
+        else:
+            arr = col.cast(pl.Float32).fill_null(float('nan')).to_numpy()
+        np.save(f'{prefix}.{c}.npy', arr)
+
+
+def has_quality_store(prefix):
+    return all(path.exists(f'{prefix}.{c}.npy') for c in COLUMNS)
+
+
+class QualityStore:
+    def __init__(self, prefix):
+        self.data = {c: load_index(f'{prefix}.{c}.npy')
+                        for c in COLUMNS}
+
+    def __len__(self):
+        return len(self.data[COLUMNS[0]])
+
+    def rows(self, ixs):
+        '''Returns the rows (as dicts, with None for missing values)'''
+        columns = []
+        for c in COLUMNS:
+            vs = self.data[c][ixs]
+            if c in BOOL_COLUMNS:
+                columns.append([(None if v == BOOL_NULL else bool(v)) for v in vs.tolist()])
+            elif c in INT_COLUMNS:
+                columns.append([(None if v == INT_NULL else v) for v in vs.tolist()])
+            else:
+                columns.append([(None if v != v else v) for v in vs.tolist()])
+        return [dict(zip(COLUMNS, row)) for row in zip(*columns)]
+
+    def matches(self, conditions, start, end):
+        '''Boolean array of rows `start` to `end` matching all conditions
+
+        Missing values never match
+        '''
+        matched = np.ones(end - start, bool)
+        for c, op, value in conditions:
+            vs = self.data[c][start:end]
+            if c in BOOL_COLUMNS:
+                matched &= (vs == int(value))
+                continue
+            matched &= OPERATORS[op](vs, value)
+            if c in INT_COLUMNS:
+                matched &= (vs != INT_NULL)
+        return matched
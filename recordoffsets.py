@@ -0,0 +1,122 @@
+'''Compact table of the position of each record in a FASTA file
+
+Records (header and sequence) are short, so rather than one 64-bit offset
+per record, the table stores:
+
+- `<name>.offsets.npy`: offset of every OFFSET_STRIDE-th record (uint64)
+- `<name>.lengths.npy`: length of every record, with the narrowest type that
+  fits (uint16 for FASTA records, uint8 for short sequences)
+
+Older indices have `<name>.starts.npy` (offset of every record, plus a final
+entry with the file size), which is still read if the compact table is
+missing.
+'''
+from os import path
+
+import numpy as np
+
+from indexmanifest import load_index
+
+OFFSET_STRIDE = 64
+
+
+def write_record_offsets(starts, name):
+    '''Writes the table from the offset of each record (plus a final entry
+    with the total size)'''
+    starts = np.asarray(starts, dtype=np.uint64)
+    write_record_lengths(np.diff(starts), name, int(starts[0]))
+
+
+def write_record_lengths(lengths, name, start=0):
+    '''Writes the table from the length of each record (the first one
+    starting at `start`)'''
+    lengths = np.asarray(lengths)
+    max_length = int(lengths.max()) if len(lengths) else 0
+    # Total length of each group of OFFSET_STRIDE records (without computing
+    # the cumulative sum of all lengths at once)
+    group_lengths = np.add.reduceat(lengths, np.arange(0, len(lengths), OFFSET_STRIDE), dtype=np.uint64) \
+            if len(lengths) else np.zeros(0, np.uint64)
+    offsets = np.empty(len(group_lengths), np.uint64)
+    if len(offsets):
+        offsets[0] = start
+        np.cumsum(group_lengths[:-1], out=offsets[1:])
+        offsets[1:] += np.uint64(start)
+    np.save(name + '.offsets.npy', offsets)
+    np.save(name + '.lengths.npy', lengths.astype(np.min_scalar_type(max_length)))
+
+
+class RecordOffsets:
+    def __init__(self, name):
+        if path.exists(name + '.offsets.npy'):
+            # Plain arrays (rather than np.memmap) are much faster to slice
+            self.offsets = np.asarray(load_index(name + '.offsets.npy'))
+            self.lengths = np.asarray(load_index(name + '.lengths.npy'))
+            self.starts = None
+        else:
+            self.starts = load_index(name + '.starts.npy')
+
+    def __len__(self):
+        if self.starts is not None:
+            return len(self.starts) - 1
+        return len(self.lengths)
+
+    def spans(self, ixs):
+        '''Returns the start and end offsets of records `ixs` (as two arrays)'''
+        ixs = np.asarray(ixs, dtype=np.int64)
+        if self.starts is not None:
+            return (self.starts[ixs].astype(np.int64),
+                    self.starts[ixs + 1].astype(np.int64))
+        blocks = ixs // OFFSET_STRIDE
+        first = blocks * OFFSET_STRIDE
+        # Lengths of the records preceding each one within its block
+        within = first[:, None] + np.arange(OFFSET_STRIDE - 1)
+        before = within < ixs[:, None]
+        preceding = self.lengths[np.where(before, within, 0)].astype(np.int64)
+        starts = self.offsets[blocks].astype(np.int64) \
+                + (preceding * before).sum(axis=1)
+        return starts, starts + self.lengths[ixs].astype(np.int64)
+
+    def starts_range(self, b, e):
+        '''Returns `starts[b:e]`, where `starts` would be the offset of every
+        record followed by the end of the last one (0 <= b <= e <= len + 1)'''
+        if self.starts is not None:
+            return self.starts[b:e].astype(np.int64)
+        if e <= b:
+            return np.zeros(0, np.int64)
+        first = b - b % OFFSET_STRIDE
+        starts = np.zeros(e - first, np.int64)
+        np.cumsum(self.lengths[first:e - 1], dtype=np.int64, out=starts[1:])
+        starts += int(self.offsets[first // OFFSET_STRIDE])
+        return starts[b - first:]
+
+    def span(self, ix):
+        ix = int(ix)
+        if self.starts is not None:
+            return int(self.starts[ix]), int(self.starts[ix + 1])
+        first = ix - ix % OFFSET_STRIDE
+        # For a few values, summing a list is faster than a numpy reduction
+        start = int(self.offsets[ix // OFFSET_STRIDE]) \
+                + sum(self.lengths[first:ix].tolist())
+        return start, start + int(self.lengths[ix])
+
+
+class RecordStarts:
+    '''Array-like view of `starts` (see `RecordOffsets.starts_range`), for
+    code that expects the offset of every record plus the final end
+
+    Supports `len` and indexing (integers and slices with step 1)
+    '''
+    def __init__(self, offsets):
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) + 1
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            b, e, step = ix.indices(len(self))
+            if step != 1:
+                raise IndexError('Only slices with step 1 are supported')
+            return self.offsets.starts_range(b, max(b, e))
+        ix = range(len(self))[ix]
+        return int(self.offsets.starts_range(ix, ix + 1)[0])
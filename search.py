@@ -3,48 +3,96 @@ from time import sleep
 
 DB_DIR = 'gmsc-db'
 
+ALIGNMENT_COLUMNS = 'qseqid,sseqid,full_qseq,full_sseq,qlen,slen,length,qstart,qend,sstart,send,bitscore,pident,evalue,qcovhsp,scovhsp'.split(',')
+
 def parse_gmsc_mapper_results(basedir):
+    '''Parses the output of gmsc-mapper into a dictionary (one entry per query)
+
+    Alignments are grouped by query in a single pass over the table
+    '''
     import pandas as pd
     try:
-        alignment = pd.read_table(f'{basedir}/alignment.out.smorfs.tsv', header=None)
+        alignment = pd.read_table(f'{basedir}/alignment.out.smorfs.tsv',
+                                    header=None,
+                                    names=ALIGNMENT_COLUMNS,
+                                    usecols=['qseqid', 'sseqid', 'full_qseq', 'evalue', 'pident'])
         habitat = pd.read_table(f'{basedir}/habitat.out.smorfs.tsv', index_col=0)
         quality = pd.read_table(f'{basedir}/quality.out.smorfs.tsv', index_col=0)
         taxonomy = pd.read_table(f'{basedir}/taxonomy.out.smorfs.tsv', index_col=0)
     except pd.errors.EmptyDataError:
         return {}
     meta = pd.concat([habitat, quality, taxonomy], axis=1)
-    alignment.columns = 'qseqid,sseqid,full_qseq,full_sseq,qlen,slen,length,qstart,qend,sstart,send,bitscore,pident,evalue,qcovhsp,scovhsp'.split(',')
 
-    result = meta.to_dict('index')
+    aminoacid = {}
+    hits = {}
+    for q, qseq, s, evalue, identity in zip(
+                alignment['qseqid'].tolist(),
+                alignment['full_qseq'].tolist(),
+                alignment['sseqid'].tolist(),
+                alignment['evalue'].tolist(),
+                alignment['pident'].tolist()):
+        qhits = hits.get(q)
+        if qhits is None:
+            aminoacid[q] = qseq
+            qhits = hits[q] = []
+        qhits.append({'id': s, 'evalue': evalue, 'identity': identity})
 
-    for k in result.keys():
-        loc = alignment.query('qseqid == @k')
-        result[k]['aminoacid'] = loc.head(1).full_qseq.values[0]
-        result[k]['hits'] = \
-                loc[['sseqid', 'evalue', 'pident']].rename(columns=
-                    {'sseqid': 'id',
-                    'pident': 'identity'},).to_dict('records')
+    columns = meta.columns.tolist()
+    result = {}
+    for k, row in zip(meta.index.tolist(), zip(*[meta[c].tolist() for c in columns])):
+        r = result[k] = dict(zip(columns, row))
+        r['aminoacid'] = aminoacid.get(k)
+        r['hits'] = hits.get(k, [])
     return result
 
 
 def save_search_result(r, sid):
+    '''Saves the results of a search as gzip-compressed JSON
+
+    The JSON is written as Flask would (compact and with sorted keys), so
+    that it can be sent to clients as is
+    '''
+    import os
+    import gzip
     import json
-    with open(f'search-results/{sid}.json', 'wt') as out:
-        json.dump(r, out)
+    oname = f'search-results/{sid}.json.gz'
+    # Written to a temporary file first, so that a partial file is never seen
+    with gzip.open(oname + '.tmp', 'wt') as out:
+        json.dump(r, out, sort_keys=True, separators=(',', ':'))
+    os.rename(oname + '.tmp', oname)
+
+def search_result_path(sid):
+    '''Path of the saved results (older results are stored uncompressed)'''
+    fname = f'search-results/{sid}.json.gz'
+    if path.exists(fname):
+        return fname
+    return f'search-results/{sid}.json'
 
-def load_search_results():
+def open_search_result(sid):
+    '''Opens the saved results for reading (as uncompressed JSON bytes)'''
+    import gzip
+    fname = search_result_path(sid)
+    if fname.endswith('.gz'):
+        return gzip.open(fname, 'rb')
+    return open(fname, 'rb')
+
+def delete_search_result(sid):
+    import os
+    for fname in [f'search-results/{sid}.json.gz', f'search-results/{sid}.json']:
+        try:
+            os.unlink(fname)
+        except FileNotFoundError:
+            pass
+
+def list_saved_searches():
+    '''Returns the IDs of all searches with saved results'''
     from glob import glob
-    import json
-    rs = glob('search-results/*.json')
+    rs = glob('search-results/*.json') + glob('search-results/*.json.gz')
     rs.sort(key = lambda k: int(k.split('/')[1].split('-')[0]))
-    res = {}
-    for r in rs:
-        k = r.split('/')[1].split('.')[0]
-        res[k] = json.load(open(r))
-    return res
+    return [r.split('/')[1].split('.')[0] for r in rs]
 
 
-def do_search(seqdata, sid, is_contigs, nr_threads):
+def do_search(seqdata, is_contigs, nr_threads):
     import tempfile
     import subprocess
     from time import time
@@ -69,7 +117,53 @@ def do_search(seqdata, sid, is_contigs, nr_threads):
                  '--taxonomy-index', f'{DB_DIR}/GMSC10.90AA.taxonomy.index.tsv',
                  ],
                 )
-        r = parse_gmsc_mapper_results(path.join(tdir, "output"))
-        save_search_result(r, sid)
-        return r
+        return parse_gmsc_mapper_results(path.join(tdir, "output"))
+
+
+def parse_fasta(seqdata):
+    '''Parses a FASTA string into a list of `(query_id, sequence)` pairs
+
+    The query ID is the first word of the header (as used by gmsc-mapper)
+    '''
+    if not seqdata.lstrip().startswith('>'):
+        raise ValueError('Input is not in FASTA format')
+    rs = []
+    for record in seqdata.lstrip()[1:].split('\n>'):
+        header, _, seq = record.partition('\n')
+        rs.append((header.split()[0] if header.split() else '',
+                   ''.join(seq.split())))
+    return rs
+
+
+# Separates the search ID from the original query ID in combined searches
+BATCH_ID_SEPARATOR = '__'
+
+def prefix_query_ids(seqdata, sid):
+    '''Prefixes the ID of every sequence in a FASTA string with `sid`'''
+    if not seqdata.lstrip().startswith('>'):
+        raise ValueError('Input is not in FASTA format')
+    lines = [(f'>{sid}{BATCH_ID_SEPARATOR}{line[1:]}' if line.startswith('>') else line)
+                for line in seqdata.lstrip().splitlines()]
+    return '\n'.join(lines) + '\n'
+
+def split_search_results(r, sids):
+    '''Splits the results of a combined search by search ID (undoing
+    `prefix_query_ids`)'''
+    rs = {sid: {} for sid in sids}
+    for k, v in r.items():
+        sid, query = k.split(BATCH_ID_SEPARATOR, 1)
+        rs[sid][query] = v
+    return rs
+
+def do_search_batch(jobs, nr_threads):
+    '''Runs several amino acid searches (`(search_id, seqdata)` pairs) in a
+    single gmsc-mapper run, so that the database is loaded only once
 
+    Returns a dictionary mapping search IDs to their results
+    '''
+    if not path.exists(DB_DIR):
+        r = do_search(None, False, nr_threads)
+        return {sid: r for sid, _ in jobs}
+    seqdata = ''.join(prefix_query_ids(seqdata, sid) for sid, seqdata in jobs)
+    r = do_search(seqdata, False, nr_threads)
+    return split_search_results(r, [sid for sid, _ in jobs])
@@ -0,0 +1,302 @@
+'''Persistent queue of sequence searches, shared by all worker processes
+
+The state of each search (and, while it is waiting, its input) is kept in a
+SQLite database, so that a search submitted to one worker process can be
+polled from any other, and queued searches survive restarts. Results
+themselves are saved as files in `search-results/` (see search.py).
+
+Searches go through the states
+
+    Queued -> Running -> Done/Failed -> Expired
+
+Worker threads (in any process) claim queued searches from the database, in
+batches that are run together (see MAX_BATCH_SEARCHES).
+Results are kept for SEARCH_RESULT_TTL seconds after the search finishes.
+
+A new connection is opened for every operation, so the registry can be used
+from any thread and is not affected by forking.
+'''
+import os
+import sqlite3
+import random
+from time import time
+from contextlib import closing
+from string import ascii_lowercase
+
+QUEUED = 'Queued'
+RUNNING = 'Running'
+DONE = 'Done'
+FAILED = 'Failed'
+EXPIRED = 'Expired'
+
+# Seconds to wait for a lock held by another process
+SQLITE_TIMEOUT = 30
+
+# Submissions are rejected when this many searches are waiting
+MAX_QUEUED_SEARCHES = 100
+
+# Maximum number of searches running at the same time (over all processes)
+MAX_RUNNING_SEARCHES = 2
+
+# Time (in seconds) for which results are kept after a search finishes
+SEARCH_RESULT_TTL = 7 * 24 * 3600
+
+# Queued amino acid searches are combined into batches of up to
+# MAX_BATCH_SEARCHES, run together. A search only starts once it has waited
+# SEARCH_BATCH_WINDOW seconds, so that searches submitted together end up in
+# the same batch
+MAX_BATCH_SEARCHES = 50
+SEARCH_BATCH_WINDOW = 2.0
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _process_token(pid):
+    '''Identifies a process beyond its PID (which can be reused)
+
+    Returns its start time and the ID of the current boot (None if this is
+    not available, i.e., without /proc)
+    '''
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            boot_id = f.read().strip()
+    except OSError:
+        return None
+    # Fields after the command name (in parentheses, which may contain
+    # spaces): the start time is the 22nd field overall
+    start_time = stat[stat.rindex(')') + 2:].split()[19]
+    return f'{boot_id}:{start_time}'
+
+
+def _worker_alive(pid, token):
+    '''Whether the process that claimed a search is still running'''
+    if pid is None or not _pid_alive(pid):
+        return False
+    if token is None:
+        return True
+    current = _process_token(pid)
+    return current is None or current == token
+
+
+class SearchRegistry:
+    def __init__(self, dbname,
+                 max_queued=MAX_QUEUED_SEARCHES,
+                 max_running=MAX_RUNNING_SEARCHES,
+                 ttl=SEARCH_RESULT_TTL,
+                 max_batch=MAX_BATCH_SEARCHES,
+                 batch_window=SEARCH_BATCH_WINDOW):
+        self.dbname = dbname
+        self.max_queued = max_queued
+        self.max_running = max_running
+        self.ttl = ttl
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        with closing(self.connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS searches (
+                    ix INTEGER PRIMARY KEY AUTOINCREMENT,
+                    search_id TEXT UNIQUE NOT NULL,
+                    status TEXT NOT NULL,
+                    submitted REAL
+                )''')
+            # Columns added after the first version of the table
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(searches)')}
+            for c, ctype in [
+                        ('seqdata', 'TEXT'),
+                        ('is_contigs', 'INTEGER'),
+                        ('worker_pid', 'INTEGER'),
+                        ('worker_token', 'TEXT'),
+                        ('started', 'REAL'),
+                        ('finished', 'REAL'),
+                        ('batch', 'INTEGER'),
+                        ]:
+                if c not in columns:
+                    conn.execute(f'ALTER TABLE searches ADD COLUMN {c} {ctype}')
+            conn.execute('CREATE INDEX IF NOT EXISTS searches_status ON searches (status, ix)')
+
+    def connect(self):
+        return sqlite3.connect(self.dbname, timeout=SQLITE_TIMEOUT, isolation_level=None)
+
+    def import_saved(self, saved):
+        '''Registers searches whose results were saved before the registry
+        existed
+
+        `saved` is a list of `(search_id, finished_time)` (search IDs are of
+        the form `#-xxxx`)
+        '''
+        with closing(self.connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                    'INSERT OR IGNORE INTO searches (ix, search_id, status, finished) VALUES (?, ?, ?, ?)',
+                    [(int(sid.split('-')[0]), sid, DONE, finished) for sid, finished in saved])
+            conn.execute('COMMIT')
+
+    def submit(self, seqdata : str, is_contigs : bool, *, running : bool = False) -> str:
+        '''Queues a new search and returns its ID
+
+        With `running=True`, the search is instead marked as running in this
+        process (for searches that the caller answers directly).
+
+        Raises QueueFullError if there are too many searches waiting
+        '''
+        randstr = ''.join(random.choice(ascii_lowercase) for i in range(4))
+        now = time()
+        with closing(self.connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                [nr_queued] = conn.execute(
+                        'SELECT COUNT(*) FROM searches WHERE status = ?', (QUEUED,)).fetchone()
+                if nr_queued >= self.max_queued and not running:
+                    raise QueueFullError(f'Too many searches queued ({nr_queued})')
+                if running:
+                    cur = conn.execute(
+                            'INSERT INTO searches (search_id, status, submitted, is_contigs, worker_pid, worker_token, started) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            ('', RUNNING, now, int(is_contigs), os.getpid(), _process_token(os.getpid()), now))
+                else:
+                    cur = conn.execute(
+                            'INSERT INTO searches (search_id, status, submitted, seqdata, is_contigs) VALUES (?, ?, ?, ?, ?)',
+                            ('', QUEUED, now, seqdata, int(is_contigs)))
+                sid = f'{cur.lastrowid}-{randstr}'
+                conn.execute('UPDATE searches SET search_id = ? WHERE ix = ?',
+                        (sid, cur.lastrowid))
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        return sid
+
+    def claim(self):
+        '''Marks the next batch of queued searches as running (in this process)
+
+        The batch is the oldest queued search together with (if it is an
+        amino acid search) the following queued amino acid searches.
+        Searches left running by processes that no longer exist are queued
+        again first (processes are identified by their PID and start time, so
+        that a reused PID does not keep them running forever). Those that were
+        never queued (see `submit(running=True)`) have no input to run again,
+        so they are marked as failed instead.
+
+        Returns a list of `(search_id, seqdata, is_contigs)`, which is empty
+        if there is nothing to run (or too many searches are running already)
+        '''
+        now = time()
+        with closing(self.connect()) as conn:
+            if not self._may_claim(conn, now):
+                return []
+            conn.execute('BEGIN IMMEDIATE')
+            running = conn.execute(
+                    'SELECT ix, worker_pid, worker_token, COALESCE(batch, ix), seqdata IS NOT NULL FROM searches WHERE status = ?',
+                    (RUNNING,)).fetchall()
+            dead = [(ix, has_input) for ix, pid, token, _, has_input in running
+                        if not _worker_alive(pid, token)]
+            conn.executemany(
+                    'UPDATE searches SET status = ?, worker_pid = NULL, worker_token = NULL, started = NULL, batch = NULL WHERE ix = ?',
+                    [(QUEUED, ix) for ix, has_input in dead if has_input])
+            conn.executemany(
+                    'UPDATE searches SET status = ?, finished = ?, worker_pid = NULL, worker_token = NULL WHERE ix = ?',
+                    [(FAILED, now, ix) for ix, has_input in dead if not has_input])
+            dead = set(ix for ix, _ in dead)
+            nr_running = len(set(b for ix, _, _, b, _ in running if ix not in dead))
+            jobs = []
+            if nr_running < self.max_running:
+                first = conn.execute(
+                        'SELECT ix, search_id, seqdata, is_contigs, submitted FROM searches WHERE status = ? ORDER BY ix LIMIT 1',
+                        (QUEUED,)).fetchone()
+                if first is not None:
+                    ix, sid, seqdata, is_contigs, submitted = first
+                    # Contig searches are never batched, so need not wait
+                    if is_contigs or submitted <= now - self.batch_window:
+                        jobs = [(ix, sid, seqdata, is_contigs)]
+                    if jobs and not is_contigs:
+                        jobs.extend(conn.execute(
+                            'SELECT ix, search_id, seqdata, is_contigs FROM searches WHERE status = ? AND NOT is_contigs AND ix > ? ORDER BY ix LIMIT ?',
+                            (QUEUED, ix, self.max_batch - 1)).fetchall())
+            token = _process_token(os.getpid())
+            conn.executemany(
+                    'UPDATE searches SET status = ?, worker_pid = ?, worker_token = ?, started = ?, batch = ? WHERE ix = ?',
+                    [(RUNNING, os.getpid(), token, now, jobs[0][0], ix) for ix, _, _, _ in jobs])
+            conn.execute('COMMIT')
+        return [(sid, seqdata, bool(is_contigs)) for _, sid, seqdata, is_contigs in jobs]
+
+    def _may_claim(self, conn, now):
+        '''Checks (without taking the write lock) whether `claim` may have
+        anything to do
+
+        Every search thread polls `claim`, so the write lock is only taken
+        if there are searches to requeue or to start
+        '''
+        running = conn.execute(
+                'SELECT worker_pid, worker_token, COALESCE(batch, ix) FROM searches WHERE status = ?',
+                (RUNNING,)).fetchall()
+        # Each worker process is only checked once
+        workers = set((pid, token) for pid, token, _ in running)
+        if not all(_worker_alive(pid, token) for pid, token in workers):
+            return True
+        if len(set(b for _, _, b in running)) >= self.max_running:
+            return False
+        first = conn.execute(
+                'SELECT is_contigs, submitted FROM searches WHERE status = ? ORDER BY ix LIMIT 1',
+                (QUEUED,)).fetchone()
+        if first is None:
+            return False
+        is_contigs, submitted = first
+        return bool(is_contigs) or submitted <= now - self.batch_window
+
+    def finish(self, sid : str, status : str):
+        '''Records the outcome of a search (`Done` or `Failed`)'''
+        with closing(self.connect()) as conn:
+            conn.execute(
+                    'UPDATE searches SET status = ?, finished = ?, seqdata = NULL, worker_pid = NULL, worker_token = NULL WHERE search_id = ?',
+                    (status, time(), sid))
+
+    def expire(self):
+        '''Marks finished searches older than the TTL as expired
+
+        Returns their IDs (so that their results can be deleted)
+        '''
+        cutoff = time() - self.ttl
+        with closing(self.connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            expired = [sid for sid, in conn.execute(
+                    'SELECT search_id FROM searches WHERE status IN (?, ?) AND finished < ?',
+                    (DONE, FAILED, cutoff))]
+            conn.execute(
+                    'UPDATE searches SET status = ? WHERE status IN (?, ?) AND finished < ?',
+                    (EXPIRED, DONE, FAILED, cutoff))
+            conn.execute('COMMIT')
+        return expired
+
+    def get_status(self, sid : str):
+        '''Returns the status of a search (None if the ID is unknown)'''
+        with closing(self.connect()) as conn:
+            row = conn.execute('SELECT status, finished FROM searches WHERE search_id = ?',
+                    (sid,)).fetchone()
+        if row is None:
+            return None
+        status, finished = row
+        # Expiration happens periodically, but results past their TTL are
+        # never returned
+        if status in (DONE, FAILED) and finished is not None and finished < time() - self.ttl:
+            return EXPIRED
+        return status
+
+    def list(self):
+        '''Returns all searches as `(search_id, status)` pairs'''
+        with closing(self.connect()) as conn:
+            return conn.execute(
+                    'SELECT search_id, status FROM searches ORDER BY ix').fetchall()
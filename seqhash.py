@@ -0,0 +1,148 @@
+'''Exact-sequence lookup through a sorted table of hashes
+
+- `<name>.hash.npy`: 64-bit hashes of all sequences, sorted
+- `<name>.hash.ix.npy`: index of the sequence with each hash
+
+Different sequences can (rarely) share a hash, so lookups return all the
+candidates, which must be checked against the actual sequences.
+
+The writer sorts the hashes in chunks of SORT_CHUNK_SIZE, which are saved to
+temporary files and then merged, so that memory use does not depend on the
+number of sequences.
+'''
+import os
+import hashlib
+
+import numpy as np
+
+from indexmanifest import load_index
+
+# Number of hashes sorted in memory at a time
+SORT_CHUNK_SIZE = 1 << 24
+
+# Number of hashes read from each sorted chunk at a time while merging
+MERGE_BLOCK_SIZE = 1 << 18
+
+
+def hash_sequences(seqs):
+    '''Hashes a list of sequences (as bytes) into an array of uint64'''
+    return np.frombuffer(
+            b''.join(hashlib.blake2b(s, digest_size=8).digest() for s in seqs),
+            dtype='<u8')
+
+
+class HashIndexWriter:
+    def __init__(self, oname, chunk_size=SORT_CHUNK_SIZE, block_size=MERGE_BLOCK_SIZE):
+        self.oname = oname
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.hashes = []
+        self.ixs = []
+        self.nr_buffered = 0
+        self.runs = []
+        self.n = 0
+
+    def add(self, seqs):
+        '''Adds a batch of sequences (the next ones, in order)
+
+        Empty sequences are skipped (but still take up an index)
+        '''
+        hashes = hash_sequences(seqs)
+        [nonempty] = np.where([len(s) > 0 for s in seqs])
+        self.hashes.append(hashes[nonempty])
+        self.ixs.append(nonempty + self.n)
+        self.n += len(seqs)
+        self.nr_buffered += len(nonempty)
+        if self.nr_buffered >= self.chunk_size:
+            self._sort_buffered(spill=True)
+
+    def _sort_buffered(self, spill):
+        '''Sorts the buffered hashes, saving them as a run if `spill`'''
+        hashes = np.concatenate(self.hashes) if self.hashes else np.zeros(0, np.uint64)
+        ixs = np.concatenate(self.ixs) if self.ixs else np.zeros(0, np.int64)
+        self.hashes = []
+        self.ixs = []
+        self.nr_buffered = 0
+        order = np.argsort(hashes, kind='stable')
+        hashes = hashes[order]
+        ixs = ixs[order]
+        if not spill:
+            return hashes, ixs
+        run = f'{self.oname}.hash.run{len(self.runs)}.tmp'
+        np.save(run + '.hash.npy', hashes)
+        np.save(run + '.ix.npy', ixs)
+        self.runs.append(run)
+
+    def close(self):
+        ix_dtype = (np.uint32 if self.n < 2**32 else np.uint64)
+        if not self.runs:
+            hashes, ixs = self._sort_buffered(spill=False)
+            np.save(self.oname + '.hash.npy', hashes)
+            np.save(self.oname + '.hash.ix.npy', ixs.astype(ix_dtype))
+            return
+        if self.nr_buffered:
+            self._sort_buffered(spill=True)
+        try:
+            runs = [(np.load(run + '.hash.npy', mmap_mode='r'), np.load(run + '.ix.npy', mmap_mode='r'))
+                        for run in self.runs]
+            total = sum(len(h) for h, _ in runs)
+            out_hashes = np.lib.format.open_memmap(self.oname + '.hash.npy',
+                                                   mode='w+', dtype=np.uint64, shape=(total,))
+            out_ixs = np.lib.format.open_memmap(self.oname + '.hash.ix.npy',
+                                                mode='w+', dtype=ix_dtype, shape=(total,))
+            _merge_runs(runs, out_hashes, out_ixs, self.block_size)
+            out_hashes.flush()
+            out_ixs.flush()
+            del runs, out_hashes, out_ixs
+        finally:
+            for run in self.runs:
+                for fname in (run + '.hash.npy', run + '.ix.npy'):
+                    if os.path.exists(fname):
+                        os.unlink(fname)
+            self.runs = []
+
+
+def _merge_runs(runs, out_hashes, out_ixs, block_size):
+    '''Merges sorted runs (pairs of hash & index arrays) into the outputs
+
+    Runs are merged a block at a time: all the values up to the smallest last
+    value of the current blocks (the bound) can be output. Equal hashes are kept in run
+    order (i.e., by index, as the runs were written in order).
+    '''
+    pos = [0] * len(runs)
+    out = 0
+    while True:
+        live = [i for i, (h, _) in enumerate(runs) if pos[i] < len(h)]
+        if not live:
+            break
+        bound = min(runs[i][0][min(pos[i] + block_size, len(runs[i][0])) - 1] for i in live)
+        hashes = []
+        ixs = []
+        for i in live:
+            h, x = runs[i]
+            # Searching beyond the block, as the values equal to the bound
+            # (repeated hashes) must all be output together
+            end = pos[i] + int(np.searchsorted(h[pos[i]:], bound, side='right'))
+            hashes.append(h[pos[i]:end])
+            ixs.append(x[pos[i]:end])
+            pos[i] = end
+        hashes = np.concatenate(hashes)
+        ixs = np.concatenate(ixs)
+        order = np.argsort(hashes, kind='stable')
+        out_hashes[out:out + len(hashes)] = hashes[order]
+        out_ixs[out:out + len(hashes)] = ixs[order]
+        out += len(hashes)
+
+
+class HashIndex:
+    def __init__(self, name):
+        self.hashes = load_index(name + '.hash.npy')
+        self.ixs = load_index(name + '.hash.ix.npy')
+
+    def lookup(self, seqs):
+        '''Returns, for each sequence, an array with the indices of the
+        sequences with the same hash'''
+        hashes = hash_sequences(seqs)
+        starts = np.searchsorted(self.hashes, hashes, side='left')
+        ends = np.searchsorted(self.hashes, hashes, side='right')
+        return [self.ixs[s:e] for s, e in zip(starts, ends)]
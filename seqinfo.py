@@ -1,12 +1,24 @@
 import xz
-import polars as pl
-import pandas as pd
 
+import os
+import re
 import gzip
+import weakref
 import threading
 import numpy as np
 from os import path
+from time import perf_counter
 from fna2faa_gmsc import translate
+from xzblocks import XZBlockReader
+from packedseq import PackedNucleotideReader
+from aminoacidstore import AminoAcidStore
+from lrucache import LRUCache
+import afterfork
+from qualitystore import QualityStore, has_quality_store, OPERATORS
+from seqhash import HashIndex
+from kmerindex import KmerIndex, semiglobal_distances
+from recordoffsets import RecordOffsets
+from indexmanifest import load_index
 from typing import List, Optional
 
 
@@ -15,6 +27,43 @@ INDEX_DIR = 'gmsc-db-index/'
 MAX_THICK_RESULTS = 20
 MAX_TOTAL_RESULTS = 1000
 
+# seq_filter evaluates predicates in chunks (from the end), starting with
+# FILTER_CHUNK_SIZE sequences and doubling up to MAX_FILTER_CHUNK_SIZE
+FILTER_CHUNK_SIZE = 1 << 16
+MAX_FILTER_CHUNK_SIZE = 1 << 24
+
+# Taxonomy queries resolving to more ranges of IDs than this are evaluated
+# with a lookup table instead of range checks
+MAX_TAXONOMY_RANGES = 16
+
+# Queries without any of these characters are plain substrings (which can be
+# matched against the habitat bitmaps and the taxonomy clade table)
+REGEX_METACHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+# Number of sequences formatted at a time when exporting seq_filter results
+EXPORT_BATCH_SIZE = 10_000
+
+# When reading many sequences at once, records separated by at most
+# MAX_READ_GAP bytes are read together (up to MAX_MERGED_READ bytes per read)
+MAX_READ_GAP = 64 * 1024
+MAX_MERGED_READ = 4 * 1024 * 1024
+
+# Number of server processes (set by gunicorn.conf.py). Caches are per
+# process, so the memory budgets below are split among them
+NR_PROCESSES = max(1, int(os.environ.get('GMSC_API_NR_PROCESSES', 1)))
+
+# Maximum memory (in bytes) used to cache seq_filter results
+SEQ_FILTER_CACHE_SIZE = 256 * 1024 * 1024 // NR_PROCESSES
+
+# Maximum size of decompressed blocks to keep in memory (per xz file)
+XZ_BLOCK_CACHE_SIZE = 1024 * 1024 * 1024 // NR_PROCESSES
+
+# Near-exact search with the k-mer index: the MAX_KMER_CANDIDATES sequences
+# sharing the most k-mers with the query are aligned to it (k-mers present in
+# more than MAX_KMER_POSTINGS sequences are ignored)
+MAX_KMER_CANDIDATES = 1000
+MAX_KMER_POSTINGS = 1_000_000
+
 def with_digits(prefix, n):
     n = f'{n:09}'
     return f'{prefix}.{n[:3]}_{n[3:6]}_{n[6:9]}'
@@ -46,81 +95,426 @@ def get_hits(matches, max_results):
     return ixs
 
 
+def iter_matches(predicates, end):
+    '''Evaluates predicates chunk by chunk, from index `end - 1` down to 0
+
+    Yields arrays of matching indices (in decreasing order). Chunks start
+    small and grow, so that callers which only need the first few hits (the
+    highest indices) stop early without evaluating the whole table.
+    '''
+    ch_size = FILTER_CHUNK_SIZE
+    while end > 0:
+        start = max(0, end - ch_size)
+        matches = None
+        for pred in predicates:
+            cur = pred(start, end)
+            matches = (cur if matches is None else matches & cur)
+            if not matches.any():
+                break
+        if matches is None:
+            ixs = np.arange(end - 1, start - 1, -1)
+        else:
+            [ixs] = np.where(matches[::-1])
+            ixs *= -1
+            ixs += end - 1
+        if len(ixs):
+            yield ixs
+        end = start
+        ch_size = min(2 * ch_size, MAX_FILTER_CHUNK_SIZE)
+
+
+def find_hits(predicates, n, max_results):
+    '''Returns (at most) the `max_results` highest indices below `n` matching all predicates'''
+    hits = []
+    nr_hits = 0
+    for ixs in iter_matches(predicates, n):
+        hits.append(ixs[:max_results - nr_hits])
+        nr_hits += len(hits[-1])
+        if nr_hits >= max_results:
+            break
+    if not hits:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(hits)
+
+
+def normalize_filter_query(hq_only, habitat_q, taxonomy_q, **quality_q):
+    '''Normalizes seq_filter arguments into a hashable key
+
+    Habitat queries are combined with AND, so their order does not matter
+    '''
+    return (
+        bool(hq_only),
+        tuple(sorted(set(habitat_q))),
+        taxonomy_q or '',
+        tuple(sorted(
+            (k, (v if isinstance(v, bool) else float(v)))
+            for k, v in quality_q.items()
+            if v is not None)),
+        )
+
+
 class IndexedFastaReader:
     def __init__(self, ifile):
+        self.ifile = ifile
+        self.fd = None
+        self.seqfile = None
+        self.blockreader = None
         if ifile.endswith('.xz'):
-            self.seqfile = xz.open(ifile, 'rb')
+            blocks_file = ifile.replace(BASE_DIR, INDEX_DIR) + '.blocks.npy'
+            if path.exists(blocks_file):
+                self.blockreader = XZBlockReader(
+                        ifile,
+                        np.load(blocks_file),
+                        XZ_BLOCK_CACHE_SIZE)
+            else:
+                self.seqfile = xz.open(ifile, 'rb')
             ifile = ifile[:-len('.xz')]
         else:
-            self.seqfile = open(ifile, 'rb')
-        self.sindex = np.load(ifile.replace(BASE_DIR, INDEX_DIR) + '.starts.npy', mmap_mode='r')
+            # Uncompressed files are read with positional reads (pread), so
+            # there is no shared file position and no need for locking
+            self.fd = os.open(ifile, os.O_RDONLY)
+        self.offsets = RecordOffsets(ifile.replace(BASE_DIR, INDEX_DIR))
         self._lock = threading.Lock()
+        afterfork.register(self)
 
-    def get(self, ix):
+    def after_fork(self):
+        self._lock = threading.Lock()
+        if self.seqfile is not None:
+            # The file position is shared with the parent process (closing
+            # the inherited handle does not affect the parent's)
+            self.seqfile.close()
+            self.seqfile = xz.open(self.ifile, 'rb')
+
+    def read(self, start, end):
+        if self.fd is not None:
+            return os.pread(self.fd, end - start, start)
+        if self.blockreader is not None:
+            return self.blockreader.read(start, end)
         with self._lock:
-            self.seqfile.seek(int(self.sindex[ix]))
-            data = self.seqfile.read(int(self.sindex[ix+1] - self.sindex[ix]))
+            self.seqfile.seek(start)
+            return self.seqfile.read(end - start)
+
+    def get(self, ix):
+        data = self.read(*self.offsets.span(ix))
         _h, seq, _empty = data.split(b'\n')
         return seq
 
+    def get_many(self, ixs):
+        '''Reads several sequences (`ixs` must be sorted)
+
+        Records that are close together in the file are read in a single call
+        '''
+        starts, ends = self.offsets.spans(ixs)
+        starts = starts.tolist()
+        ends = ends.tolist()
+        seqs = []
+        i = 0
+        while i < len(starts):
+            j = i + 1
+            while j < len(starts) \
+                    and starts[j] - ends[j-1] <= MAX_READ_GAP \
+                    and ends[j] - starts[i] <= MAX_MERGED_READ:
+                j += 1
+            data = self.read(starts[i], ends[j-1])
+            for k in range(i, j):
+                _h, seq, _empty = data[starts[k]-starts[i]:ends[k]-starts[i]].split(b'\n')
+                seqs.append(seq)
+            i = j
+        return seqs
+
+class lazy_resource:
+    '''Like functools.cached_property, but thread-safe and timed
+
+    The resource is loaded on first access and stored on the instance; the
+    time it took is recorded in the instance's `load_times` dictionary.
+    Each instance has its own lock, so that loading a resource of one
+    instance does not block the same resource of another.
+    '''
+    def __init__(self, load):
+        self.load = load
+        self.name = load.__name__
+        self.__doc__ = load.__doc__
+        self.lock = threading.Lock()
+        self.instance_locks = weakref.WeakKeyDictionary()
+        afterfork.register(self)
+
+    def after_fork(self):
+        self.lock = threading.Lock()
+        self.instance_locks = weakref.WeakKeyDictionary()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        # Once loaded, the value in obj.__dict__ takes precedence over this
+        # (non-data) descriptor, so this is only reached while loading
+        with self.lock:
+            lock = self.instance_locks.setdefault(obj, threading.Lock())
+        with lock:
+            if self.name not in obj.__dict__:
+                start = perf_counter()
+                obj.__dict__[self.name] = self.load(obj)
+                obj.load_times[self.name] = perf_counter() - start
+        return obj.__dict__[self.name]
+
+def preload_resources(obj):
+    '''Loads all the lazy resources of an object'''
+    for name, attr in vars(type(obj)).items():
+        if isinstance(attr, lazy_resource):
+            getattr(obj, name)
+
 class SeqInfo:
+    '''Sequence information for one database
+
+    Indices are only loaded when first needed, so that creating a SeqInfo
+    object is (almost) free
+    '''
     def __init__(self, database):
         if database not in ('90AA', '100AA'):
             raise NotImplementedError(f'Database was {database}! Only "90AA" and "100AA" are supported')
-        self.seqix = IndexedFastaReader(
-                f'{BASE_DIR}/GMSC10.{database}.fna'
-                if path.exists(f'{BASE_DIR}/GMSC10.{database}.fna')
-                else f'{BASE_DIR}/GMSC10.{database}.fna.xz'
-                )
         self.database = database
-        self.habitat = pd.read_table(f'{INDEX_DIR}/GMSC10.{database}.general_habitat.index.tsv',
+        self.prefix = f'{INDEX_DIR}/GMSC10.{database}'
+        self.load_times = {}
+        self.filter_cache = LRUCache(SEQ_FILTER_CACHE_SIZE, sizeof=lambda ixs: ixs.nbytes)
+
+    @lazy_resource
+    def seqix(self):
+        if path.exists(f'{self.prefix}.fna.2bit'):
+            return PackedNucleotideReader(f'{self.prefix}.fna.2bit')
+        return IndexedFastaReader(
+                f'{BASE_DIR}/GMSC10.{self.database}.fna'
+                if path.exists(f'{BASE_DIR}/GMSC10.{self.database}.fna')
+                else f'{BASE_DIR}/GMSC10.{self.database}.fna.xz'
+                )
+
+    @lazy_resource
+    def aastore(self):
+        if path.exists(f'{self.prefix}.aminoacid.bin'):
+            return AminoAcidStore(f'{self.prefix}.aminoacid')
+        return None
+
+    @lazy_resource
+    def aa_hash_index(self):
+        if path.exists(f'{self.prefix}.aminoacid.hash.npy'):
+            return HashIndex(f'{self.prefix}.aminoacid')
+        return None
+
+    @lazy_resource
+    def nt_hash_index(self):
+        if path.exists(f'{self.prefix}.fna.hash.npy'):
+            return HashIndex(f'{self.prefix}.fna')
+        return None
+
+    @lazy_resource
+    def kmer_index(self):
+        if path.exists(f'{self.prefix}.aminoacid.kmers.offsets.npy'):
+            return KmerIndex(f'{self.prefix}.aminoacid')
+        return None
+
+    @lazy_resource
+    def habitat(self):
+        import pandas as pd
+        return pd.read_table(f'{self.prefix}.general_habitat.index.tsv',
                                     index_col=0,
                                     header=None,
                                     names=['seq_ix', 'habitat']
                                     ).squeeze()
-        self.habitat_ix = np.load(f'{INDEX_DIR}/GMSC10.{database}.general_habitat.npy', mmap_mode='r')
 
-        self.taxonomy = pd.read_table(f'{INDEX_DIR}/GMSC10.{database}.taxonomy.index.tsv',
+    @lazy_resource
+    def habitat_ix(self):
+        return load_index(f'{self.prefix}.general_habitat.npy')
+
+    @lazy_resource
+    def habitat_bitmaps(self):
+        if path.exists(f'{self.prefix}.general_habitat.bitmaps.npy'):
+            return load_index(f'{self.prefix}.general_habitat.bitmaps.npy')
+        return None
+
+    @lazy_resource
+    def habitat_terms(self):
+        import pandas as pd
+        if not path.exists(f'{self.prefix}.general_habitat.bitmaps.terms.tsv'):
+            return None
+        return pd.read_table(f'{self.prefix}.general_habitat.bitmaps.terms.tsv',
+                                    index_col=0,
+                                    header=None,
+                                    names=['term_ix', 'term']
+                                    ).squeeze()
+
+    @lazy_resource
+    def taxonomy(self):
+        import pandas as pd
+        return pd.read_table(f'{self.prefix}.taxonomy.index.tsv',
                                     index_col=0,
                                     header=None,
                                     names=['seq_ix', 'taxonomy']
                                     ).squeeze()
-        self.taxonomy_ix = np.load(f'{INDEX_DIR}/GMSC10.{database}.taxonomy.npy', mmap_mode='r')
 
-        self.quality_metrics = None
-        if path.exists(f'{INDEX_DIR}/GMSC10.{database}.quality_test.parquet'):
-            self.quality_metrics = pl.read_parquet(f'{INDEX_DIR}/GMSC10.{database}.quality_test.parquet')
+    @lazy_resource
+    def taxonomy_ix(self):
+        return load_index(f'{self.prefix}.taxonomy.npy')
 
-        self.is_hq = None
-        if path.exists(f'{INDEX_DIR}/GMSC10.{database}.high_quality_ix.npy'):
-            hq_ixs = np.load(f'{INDEX_DIR}/GMSC10.{database}.high_quality_ix.npy', mmap_mode='r')
-            self.is_hq = np.zeros(len(self.habitat_ix), dtype=bool)
-            self.is_hq[hq_ixs] = True
+    @lazy_resource
+    def taxonomy_clades(self):
+        import pandas as pd
+        if not path.exists(f'{self.prefix}.taxonomy.clades.tsv'):
+            return None
+        clades = pd.read_table(f'{self.prefix}.taxonomy.clades.tsv',
+                                    header=None,
+                                    keep_default_na=False,
+                                    names=['start', 'end', 'clade'])
+        clades['name'] = clades['clade'].str.split(';').str[-1]
+        return clades
+
+    @lazy_resource
+    def quality_store(self):
+        if has_quality_store(f'{self.prefix}.quality_test'):
+            return QualityStore(f'{self.prefix}.quality_test')
+        return None
+
+    @lazy_resource
+    def quality_metrics(self):
+        '''Quality tests loaded fully into memory (only for older indices,
+        without the memory-mapped quality store)'''
+        if self.quality_store is not None \
+                or not path.exists(f'{self.prefix}.quality_test.parquet'):
+            return None
+        import polars as pl
+        return pl.read_parquet(f'{self.prefix}.quality_test.parquet')
+
+    @lazy_resource
+    def hq_bitset(self):
+        if path.exists(f'{self.prefix}.high_quality.bitset.npy'):
+            return load_index(f'{self.prefix}.high_quality.bitset.npy')
+        return None
 
+    @lazy_resource
+    def is_hq(self):
+        '''High-quality flags as a boolean array (only for older indices,
+        without the packed bitset)'''
+        if self.hq_bitset is not None \
+                or not path.exists(f'{self.prefix}.high_quality_ix.npy'):
+            return None
+        hq_ixs = load_index(f'{self.prefix}.high_quality_ix.npy')
+        is_hq = np.zeros(len(self.habitat_ix), dtype=bool)
+        is_hq[hq_ixs] = True
+        return is_hq
 
     def get_seqinfo(self, seq_id):
-        _,db,ix = seq_id.split('.')
-        ix = int(ix)
-        if db != self.database:
-            raise IndexError(f'Only IDs for database "{self.database}" are accepted (got "{seq_id}"')
-
-        nuc = self.seqix.get(ix).decode('ascii')
-        quality = None
-        if self.quality_metrics is not None:
-            quality = dict(zip(
-                self.quality_metrics.columns,
-                self.quality_metrics.row(ix)
-                ))
-        return {
-                "seq_id": seq_id,
+        [r] = self.get_seqinfo_multi([seq_id])
+        return r
+
+    def get_seqinfo_multi(self, seq_ids : List[str]):
+        '''Returns information on many sequences (in the same order as `seq_ids`)
+
+        Sequences are fetched sorted by their position on disk and annotations
+        are looked up for all of them at once
+        '''
+        ixs = []
+        for seq_id in seq_ids:
+            _,db,ix = seq_id.split('.')
+            if db != self.database:
+                raise IndexError(f'Only IDs for database "{self.database}" are accepted (got "{seq_id}"')
+            ixs.append(int(ix))
+        ixs = np.array(ixs, dtype=np.int64)
+        order = np.argsort(ixs, kind='stable')
+        ixs = ixs[order]
+
+        nucs = self.seqix.get_many(ixs)
+        aas = [None] * len(ixs)
+        if self.aastore is not None:
+            aas = self.aastore.get_many(ixs)
+        habitats = self.habitat.values[self.habitat_ix[ixs]]
+        taxonomies = self.taxonomy.values[self.taxonomy_ix[ixs]]
+        qualities = [None] * len(ixs)
+        if self.quality_store is not None:
+            qualities = self.quality_store.rows(ixs)
+        elif self.quality_metrics is not None:
+            columns = self.quality_metrics.columns
+            qualities = [dict(zip(columns, row))
+                            for row in self.quality_metrics[ixs].rows()]
+
+        rs = [None] * len(ixs)
+        for i, nuc, aa, habitat, taxonomy, quality in zip(
+                    order.tolist(), nucs, aas, habitats, taxonomies, qualities):
+            nuc = nuc.decode('ascii')
+            aa = (aa.decode('ascii') if aa else translate(nuc))
+            rs[i] = {
+                "seq_id": seq_ids[i],
                 "nucleotide": nuc,
-                "aminoacid": translate(nuc),
-                'habitat': self.habitat.values[self.habitat_ix[ix]],
-                'taxonomy': self.taxonomy.values[self.taxonomy_ix[ix]],
+                "aminoacid": aa,
+                'habitat': habitat,
+                'taxonomy': taxonomy,
                 'quality': quality,
                 }
+        return rs
 
-    def seq_filter(self,
+    def habitat_predicate(self, habitat_q : List[str]):
+        '''Predicate for sequences matching all habitat queries'''
+        use_bitmaps = self.habitat_bitmaps is not None and \
+                all(not REGEX_METACHARACTERS.search(q) and ',' not in q for q in habitat_q)
+        if not use_bitmaps:
+            habitat_r = self.habitat.str.contains(habitat_q[0]).values
+            for q in habitat_q[1:]:
+                habitat_r = habitat_r & self.habitat.str.contains(q).values
+            return lambda start, end: habitat_r[self.habitat_ix[start:end]]
+
+        # Plain substrings (without commas) match a habitat label if and only
+        # if they match one of its individual terms, so the bitmaps of all
+        # matching terms can be combined instead
+        term_ixs = [np.where(self.habitat_terms.str.contains(q, regex=False).values)[0]
+                        for q in habitat_q]
+        if any(len(ts) == 0 for ts in term_ixs):
+            return lambda start, end: np.zeros(end - start, bool)
+        def habitat_pred(start, end):
+            b0 = start // 8
+            b1 = (end + 7) // 8
+            packed = None
+            for ts in term_ixs:
+                cur = np.bitwise_or.reduce(self.habitat_bitmaps[ts, b0:b1], axis=0)
+                packed = (cur if packed is None else packed & cur)
+            return np.unpackbits(packed).view(bool)[start - 8*b0:end - 8*b0]
+        return habitat_pred
+
+    def taxonomy_ranges(self, taxonomy_q : str):
+        '''Ranges of taxonomy IDs matching the query
+
+        Returns None if the query cannot be resolved using the clade table
+        '''
+        if self.taxonomy_clades is None \
+                or REGEX_METACHARACTERS.search(taxonomy_q) \
+                or ';' in taxonomy_q:
+            return None
+        # A plain substring (without ';') matches a lineage if and only if it
+        # matches one of its ranks, i.e., if the lineage belongs to a clade
+        # whose name matches
+        clades = self.taxonomy_clades[
+                    self.taxonomy_clades['name'].str.contains(taxonomy_q, regex=False)]
+        ranges = []
+        for start, end in sorted(zip(clades['start'], clades['end'])):
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(end, ranges[-1][1])
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def taxonomy_predicate(self, taxonomy_q : str):
+        '''Predicate for sequences matching the taxonomy query'''
+        ranges = self.taxonomy_ranges(taxonomy_q)
+        if ranges is None or len(ranges) > MAX_TAXONOMY_RANGES:
+            taxonomy_r = self.taxonomy.str.contains(taxonomy_q).values
+            return lambda start, end: taxonomy_r[self.taxonomy_ix[start:end]]
+        def taxonomy_pred(start, end):
+            tax = self.taxonomy_ix[start:end]
+            matches = np.zeros(end - start, bool)
+            for r_start, r_end in ranges:
+                matches |= (tax >= r_start) & (tax < r_end)
+            return matches
+        return taxonomy_pred
+
+    def filter_predicates(self,
                    hq_only : bool,
                    habitat_q : List[str],
                    taxonomy_q : str,
@@ -132,75 +526,205 @@ class SeqInfo:
                    quality_metat : Optional[int] = None,
                    quality_riboseq : Optional[float] = None,
                    ):
-        matches = None
+        '''Builds the list of predicates for seq_filter
+
+        Each predicate is a function `(start, end) -> matches` returning a
+        boolean array for sequences `start` to `end` (exclusive)
+        '''
+        predicates = []
         if habitat_q:
-            habitat_r = self.habitat.str.contains(habitat_q[0]).values
-            for q in habitat_q[1:]:
-                habitat_r &= self.habitat.str.contains(q).values
-            matches = habitat_r[self.habitat_ix]
+            predicates.append(self.habitat_predicate(habitat_q))
         if hq_only:
-            if self.is_hq is None:
-                raise ValueError('High quality information not loaded')
-            if matches is None:
-                matches = self.is_hq.copy()
+            if self.hq_bitset is not None:
+                predicates.append(lambda start, end:
+                        np.unpackbits(self.hq_bitset[start//8:(end+7)//8])
+                            .view(bool)[start - 8*(start//8):end - 8*(start//8)])
+            elif self.is_hq is not None:
+                predicates.append(lambda start, end: self.is_hq[start:end])
             else:
-                matches &= self.is_hq
+                raise ValueError('High quality information not loaded')
         if taxonomy_q:
-            match_taxonomy = self.taxonomy.str.contains(taxonomy_q).values[self.taxonomy_ix]
-            if matches is None:
-                matches = match_taxonomy
-            else:
-                matches &= match_taxonomy
+            predicates.append(self.taxonomy_predicate(taxonomy_q))
         advanced_conditions = []
         if quality_antifam is not None:
-            if quality_antifam:
-                advanced_conditions.append(pl.col('antifam'))
-            else:
-                advanced_conditions.append(pl.col('antifam').not_())
+            advanced_conditions.append(('antifam', '==', quality_antifam))
         if quality_terminal is not None:
-            if quality_terminal:
-                advanced_conditions.append(pl.col('terminal'))
-            else:
-                advanced_conditions.append(pl.col('terminal').not_())
+            advanced_conditions.append(('terminal', '==', quality_terminal))
         if quality_rnacode is not None:
-            advanced_conditions.append(pl.col('rnacode') <= quality_rnacode)
+            advanced_conditions.append(('rnacode', '<=', quality_rnacode))
         if quality_metap is not None:
-            advanced_conditions.append(pl.col('metap') >= quality_metap)
+            advanced_conditions.append(('metap', '>=', quality_metap))
         if quality_metat is not None:
-            advanced_conditions.append(pl.col('metat') >= quality_metat)
+            advanced_conditions.append(('metat', '>=', quality_metat))
         if quality_riboseq is not None:
-            advanced_conditions.append(pl.col('riboseq') >= quality_riboseq)
+            advanced_conditions.append(('riboseq', '>=', quality_riboseq))
         if advanced_conditions:
-            if self.quality_metrics is None:
-                raise ValueError('Quality metrics not loaded')
-            if len(advanced_conditions) == 1:
-                [advanced_conditions] = advanced_conditions
+            if self.quality_store is not None:
+                def quality_pred(start, end):
+                    return self.quality_store.matches(advanced_conditions, start, end)
+            elif self.quality_metrics is not None:
+                import polars as pl
+                conditions = [OPERATORS[op](pl.col(c), v) for c, op, v in advanced_conditions]
+                conditions = conditions[0].and_(*conditions[1:]) \
+                                .fill_null(False) \
+                                .alias('matched')
+                def quality_pred(start, end):
+                    sel = self.quality_metrics \
+                            .slice(start, end - start) \
+                            .select(conditions)
+                    return sel['matched'].to_numpy()
             else:
-                advanced_conditions = advanced_conditions[0].and_(*advanced_conditions[1:])
-            sel = self.quality_metrics.select(advanced_conditions.alias('matched'))
-            if matches is None:
-                matches = sel['matched'].to_numpy()
-            else:
-                matches &= sel['matched'].to_numpy()
+                raise ValueError('Quality metrics not loaded')
+            predicates.append(quality_pred)
+        return predicates
 
-        if matches is not None:
-            ixs = get_hits(matches, MAX_TOTAL_RESULTS)
-        else:
-            ixs = np.arange(len(self.habitat_ix)-1, len(self.habitat_ix)-MAX_TOTAL_RESULTS-1, -1)
+    def filter_hits(self,
+                   hq_only : bool,
+                   habitat_q : List[str],
+                   taxonomy_q : str,
+                   *,
+                   before_ix : Optional[int] = None,
+                   **quality_q,
+                   ):
+        '''Indices of the sequences matching the filter (cached)
+
+        Only sequences with an index below `before_ix` are considered (this
+        is used to continue from the last result of a previous call).
+        '''
+        if before_ix is None:
+            before_ix = len(self.habitat_ix)
+        before_ix = min(before_ix, len(self.habitat_ix))
+        def compute():
+            predicates = self.filter_predicates(hq_only, habitat_q, taxonomy_q, **quality_q)
+            ixs = find_hits(predicates, before_ix, MAX_TOTAL_RESULTS)
+            ixs.flags.writeable = False
+            return ixs
+        key = (normalize_filter_query(hq_only, habitat_q, taxonomy_q, **quality_q), before_ix)
+        return self.filter_cache.get(key, compute)
+
+    def iter_filter_hits(self,
+                   hq_only : bool,
+                   habitat_q : List[str],
+                   taxonomy_q : str,
+                   **quality_q,
+                   ):
+        '''Yields the indices of all the sequences matching the filter
 
+        Indices are yielded in decreasing order, in arrays of at most
+        EXPORT_BATCH_SIZE elements
+        '''
+        # Predicates are built before returning, so that errors are raised
+        # immediately and not when iteration starts
+        predicates = self.filter_predicates(hq_only, habitat_q, taxonomy_q, **quality_q)
+        def generate():
+            for ixs in iter_matches(predicates, len(self.habitat_ix)):
+                for i in range(0, len(ixs), EXPORT_BATCH_SIZE):
+                    yield ixs[i:i+EXPORT_BATCH_SIZE]
+        return generate()
+
+    def find_exact(self, seqs : List[str], seqtype : str = 'aminoacid') -> List[Optional[int]]:
+        '''Finds sequences that are exactly in the database
+
+        Returns the index of each sequence (None if it is not present)
+        '''
+        if seqtype not in ('aminoacid', 'nucleotide'):
+            raise ValueError(f'Sequence type must be "aminoacid" or "nucleotide" (got "{seqtype}")')
+        index = (self.aa_hash_index if seqtype == 'aminoacid' else self.nt_hash_index)
+        if index is None:
+            raise ValueError('Exact-match index not loaded')
+        store = (self.aastore if seqtype == 'aminoacid' else self.seqix)
+        seqs = [s.strip().upper().rstrip('*').encode('ascii', errors='replace') for s in seqs]
         rs = []
-        for i,ix in enumerate(ixs):
-            seq_id = with_digits(f'GMSC10.{self.database}', ix)
-            if i < MAX_THICK_RESULTS:
-                rs.append(self.get_seqinfo(seq_id))
-            else:
-                rs.append({'seq_id': seq_id})
+        for seq, candidates in zip(seqs, index.lookup(seqs)):
+            # Candidates only share the hash, so they must be checked
+            match = None
+            for ix in candidates.tolist():
+                if store.get(ix) == seq:
+                    match = ix
+                    break
+            rs.append(match)
+        return rs
+
+    def kmer_search(self, seq : str, min_identity : float):
+        '''Finds sequences similar to `seq` using the k-mer index
+
+        Candidates are aligned to the query (which must be aligned in full,
+        see `semiglobal_distances`) and identity is the percentage of the
+        query length that is not edited.
+
+        Returns a list of `(index, identity)` (best first) with the
+        sequences with at least `min_identity` identity
+        '''
+        if self.kmer_index is None or self.aastore is None:
+            raise ValueError('K-mer index not loaded')
+        query = seq.strip().upper().rstrip('*').encode('ascii', errors='replace')
+        ixs = self.kmer_index.candidates(query, MAX_KMER_CANDIDATES, MAX_KMER_POSTINGS)
+        if len(ixs) == 0:
+            return []
+        ixs = np.sort(ixs)
+        max_distance = max(0, int(len(query) * (100 - min_identity) / 100))
+        distances = semiglobal_distances(query, self.aastore.get_many(ixs), max_distance)
+        identity = 100 * (len(query) - distances) / len(query)
+        keep = identity >= min_identity
+        ixs = ixs[keep]
+        identity = identity[keep]
+        order = np.lexsort((ixs, -identity))
+        return list(zip(ixs[order].tolist(), identity[order].tolist()))
+
+    def is_high_quality(self, ixs):
+        '''Returns a boolean array with the high-quality flags of the given sequences'''
+        ixs = np.asarray(ixs)
+        if self.hq_bitset is not None:
+            return (self.hq_bitset[ixs // 8] & (0x80 >> (ixs % 8)).astype(np.uint8)) != 0
+        if self.is_hq is not None:
+            return self.is_hq[ixs]
+        raise ValueError('High quality information not loaded')
+
+    def get_annotations(self, ixs):
+        '''Returns the habitat and taxonomy labels of the given sequences'''
+        return (self.habitat.values[self.habitat_ix[ixs]],
+                self.taxonomy.values[self.taxonomy_ix[ixs]])
+
+    def seq_filter(self,
+                   hq_only : bool,
+                   habitat_q : List[str],
+                   taxonomy_q : str,
+                   *,
+                   before_ix : Optional[int] = None,
+                   **quality_q,
+                   ):
+        ixs = self.filter_hits(hq_only, habitat_q, taxonomy_q, before_ix=before_ix, **quality_q)
+
+        seq_ids = [with_digits(f'GMSC10.{self.database}', ix) for ix in ixs]
+        rs = self.get_seqinfo_multi(seq_ids[:MAX_THICK_RESULTS])
+        rs.extend({'seq_id': seq_id} for seq_id in seq_ids[MAX_THICK_RESULTS:])
         return rs
 
 class ClusterIx:
     def __init__(self):
-        self.ix = np.load(f'{INDEX_DIR}/GMSC10.cluster.index.npy', mmap_mode='r')
-        self.data = np.load(f'{INDEX_DIR}/GMSC10.cluster.data.npy', mmap_mode='r')
+        self.load_times = {}
+
+    @lazy_resource
+    def ix(self):
+        return load_index(f'{INDEX_DIR}/GMSC10.cluster.index.npy')
+
+    @lazy_resource
+    def data(self):
+        return load_index(f'{INDEX_DIR}/GMSC10.cluster.data.npy')
+
+    @lazy_resource
+    def reverse(self):
+        if path.exists(f'{INDEX_DIR}/GMSC10.cluster.reverse.npy'):
+            return load_index(f'{INDEX_DIR}/GMSC10.cluster.reverse.npy')
+        return None
 
     def get_cluster_members(self, n : int):
         return self.data[self.ix[n]:self.ix[n+1]]
+
+    def get_cluster(self, n100 : int) -> Optional[int]:
+        '''Returns the 90AA cluster of a 100AA sequence (None if not found)'''
+        if self.reverse is None:
+            raise ValueError('Reverse cluster index not loaded')
+        if not 0 <= n100 < len(self.reverse) or self.reverse[n100] < 0:
+            return None
+        return int(self.reverse[n100])
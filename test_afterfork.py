@@ -0,0 +1,31 @@
+import os
+import afterfork
+from lrucache import LRUCache
+
+
+class Counter:
+    def __init__(self):
+        self.nr_forks = 0
+        afterfork.register(self)
+
+    def after_fork(self):
+        self.nr_forks += 1
+
+
+def test_after_fork():
+    counter = Counter()
+    cache = LRUCache(1000)
+    # Held (as if by another thread) when the process forks
+    cache._lock.acquire()
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            cache.put('a', b'x')
+            ok = cache.lookup('a') == b'x' and counter.nr_forks == 1
+        finally:
+            os._exit(0 if ok else 1)
+    cache._lock.release()
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert counter.nr_forks == 0
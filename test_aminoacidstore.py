@@ -0,0 +1,47 @@
+import numpy as np
+from fna2faa_gmsc import translate
+from aminoacidstore import AminoAcidStoreWriter, AminoAcidStore
+
+
+def expected_translation(seq):
+    try:
+        return translate(seq.decode('ascii')).encode('ascii')
+    except Exception:
+        return b''
+
+
+def test_roundtrip(tmp_path):
+    rng = np.random.default_rng(3)
+    seqs = []
+    for _ in range(500):
+        n = 3 * rng.integers(2, 30)
+        if rng.random() < .1:
+            # Not a multiple of 3: cannot be translated
+            n += 1
+        seqs.append(bytes(rng.choice(np.frombuffer(b'ACGT', np.uint8), size=n)))
+    fname = str(tmp_path / 'seqs.aminoacid')
+    writer = AminoAcidStoreWriter(fname)
+    for i in range(0, len(seqs), 77):
+        writer.add(seqs[i:i+77])
+    writer.add([])
+    writer.close()
+
+    store = AminoAcidStore(fname)
+    assert len(store) == len(seqs)
+    expected = [expected_translation(s) for s in seqs]
+    assert b'' in expected
+    for ix, aa in enumerate(expected):
+        assert store.get(ix) == aa
+    ixs = [5, 17, 18, 300, 499]
+    assert store.get_many(ixs) == [expected[ix] for ix in ixs]
+    assert store.offsets.lengths.dtype == np.uint8
+    assert store.starts[-1] == sum(len(aa) for aa in expected)
+
+    # Older stores, with the offset of every sequence
+    starts = np.concatenate([[0], np.cumsum([len(aa) for aa in expected])])
+    np.save(fname + '.starts.npy', starts.astype(np.uint64))
+    for ext in ['offsets', 'lengths']:
+        (tmp_path / f'seqs.aminoacid.{ext}.npy').unlink()
+    legacy = AminoAcidStore(fname)
+    assert len(legacy) == len(seqs)
+    assert legacy.get_many(ixs) == [expected[ix] for ix in ixs]
@@ -0,0 +1,57 @@
+import lzma
+import numpy as np
+import pandas as pd
+import annotationindex
+from annotationindex import build_annotation_indices
+from test_xzblocks import make_multiblock_xz
+
+
+def create_index_reference(infile, tag, col_ix):
+    '''Two-pass implementation (one column at a time)'''
+    tax_set = set()
+    nr_lines = 0
+    for ch in pd.read_table(infile, header=None, chunksize=1_000_000, usecols=[col_ix]):
+        ch = ch[col_ix]
+        tax_set.update(ch.fillna('Unknown'))
+        nr_lines += len(ch)
+    tax_order = annotationindex.sort_labels(tax_set, tag)
+    tax_dict = {item: n for n, item in enumerate(tax_order)}
+    index = ''.join(f'{n}\t{item}\n' for n, item in enumerate(tax_order))
+    odata = np.zeros(nr_lines, int)
+    with lzma.open(infile, 'rt') as f:
+        for ix, line in enumerate(f):
+            cur = line.strip().split('\t')[col_ix]
+            if cur:
+                odata[ix] = tax_dict[cur]
+    return index, odata
+
+
+def make_annotations(nr_lines):
+    rng = np.random.default_rng(1)
+    habitats = ['marine', 'soil', 'human gut', 'soil,marine']
+    # Missing values (encoded as 0), which the reference only handles if
+    # they are not in the first or last column
+    taxa = ['d__Bacteria', 'd__Bacteria;p__Proteobacteria', 'd__Bacteria;p__Proteobacteria2',
+            'd__Archaea', 'd__Bacteria;p__Proteobacteria;c__Alphaproteobacteria', '']
+    return ''.join(f'{rng.choice(habitats)}\t{rng.choice(taxa)}\t{i}\n' for i in range(nr_lines)).encode()
+
+
+def test_build_annotation_indices(tmp_path, monkeypatch):
+    data = make_annotations(5_000)
+    multiblock = str(tmp_path / 'multi.annotation.tsv.xz')
+    make_multiblock_xz(multiblock, data, 997)
+    single = str(tmp_path / 'single.annotation.tsv.xz')
+    with lzma.open(single, 'wb') as out:
+        out.write(data)
+    # Groups (and chunks) much smaller than the file
+    monkeypatch.setattr(annotationindex, 'GROUP_SIZE', 3_000)
+    for infile in [multiblock, single]:
+        outputs = [(0, 'general_habitat', f'{tmp_path}/habitat'),
+                   (1, 'taxonomy', f'{tmp_path}/taxonomy')]
+        build_annotation_indices(infile, outputs, nr_workers=2)
+        for col_ix, tag, basename in outputs:
+            index, odata = create_index_reference(infile, tag, col_ix)
+            assert open(f'{basename}.index.tsv').read() == index
+            codes = np.load(f'{basename}.npy')
+            assert codes.dtype == np.uint16
+            assert np.all(codes == odata)
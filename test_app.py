@@ -0,0 +1,197 @@
+import json
+import gzip
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def small_pages(app_client, monkeypatch):
+    '''Makes seq-filter return (and compute) results in small pieces'''
+    import app
+    import seqinfo
+    from lrucache import LRUCache
+    monkeypatch.setattr(seqinfo, 'MAX_TOTAL_RESULTS', 10)
+    monkeypatch.setattr(app, 'MAX_TOTAL_RESULTS', 10)
+    monkeypatch.setattr(seqinfo, 'FILTER_CHUNK_SIZE', 7)
+    monkeypatch.setattr(seqinfo, 'MAX_FILTER_CHUNK_SIZE', 50)
+    monkeypatch.setattr(seqinfo, 'EXPORT_BATCH_SIZE', 4)
+    # Results cached with another MAX_TOTAL_RESULTS are not valid
+    monkeypatch.setattr(app.seqinfo90, 'filter_cache', LRUCache(1 << 20, sizeof=lambda ixs: ixs.nbytes))
+    return app_client
+
+
+FILTER_QUERIES = [
+    {'habitat': 'soil'},
+    {'habitat': 'gut,marine', 'taxonomy': 'Proteobacteria'},
+    {'taxonomy': 'd__Archaea'},
+    {'hq_only': 'true'},
+    {'habitat': 'nothing'},
+    ]
+
+
+def expected_filter_rows(query):
+    '''All (seq_id, habitat, taxonomy) matching the query, computed directly'''
+    import app
+    from seqinfo import with_digits
+    si = app.seqinfo90
+    habitats, taxonomies = si.get_annotations(np.arange(len(si.habitat_ix)))
+    matches = np.ones(len(habitats), bool)
+    for h in query.get('habitat', '').split(','):
+        if h:
+            matches &= np.array([h in x for x in habitats])
+    if query.get('taxonomy'):
+        matches &= np.array([query['taxonomy'] in x for x in taxonomies])
+    if query.get('hq_only'):
+        matches &= si.is_high_quality(np.arange(len(matches)))
+    [ixs] = np.where(matches)
+    return [(with_digits('GMSC10.90AA', ix), habitats[ix], taxonomies[ix])
+                for ix in ixs[::-1].tolist()]
+
+
+def test_seq_filter_paging(small_pages):
+    for query in FILTER_QUERIES:
+        expected = [seq_id for seq_id, _, _ in expected_filter_rows(query)]
+        seq_ids = []
+        cursor = None
+        nr_pages = 0
+        while True:
+            r = small_pages.post('/v1/seq-filter/', data=dict(query, **({'cursor': cursor} if cursor else {})))
+            assert r.status_code == 200
+            r = r.get_json()
+            assert len(r['results']) <= 10
+            seq_ids.extend(hit['seq_id'] for hit in r['results'])
+            nr_pages += 1
+            cursor = r['next_cursor']
+            if cursor is None:
+                break
+        assert seq_ids == expected
+        assert nr_pages == len(expected) // 10 + 1
+    assert small_pages.post('/v1/seq-filter/', data={'cursor': 'GMSC10.100AA.000_000_001'}).status_code == 400
+
+
+def test_seq_filter_export(small_pages):
+    for query in FILTER_QUERIES:
+        expected = expected_filter_rows(query)
+        r = small_pages.post('/v1/seq-filter-export/', data=query)
+        assert r.status_code == 200
+        lines = r.get_data(as_text=True).splitlines()
+        assert lines[0] == 'seq_id\thabitat\ttaxonomy'
+        assert [tuple(line.split('\t')) for line in lines[1:]] == expected
+
+        r = small_pages.post('/v1/seq-filter-export/', data=dict(query, format='ndjson', gzip='true'))
+        assert r.status_code == 200
+        assert r.mimetype == 'application/gzip'
+        rows = [json.loads(line) for line in gzip.decompress(r.get_data()).splitlines()]
+        assert [(row['seq_id'], row['habitat'], row['taxonomy']) for row in rows] == expected
+    assert small_pages.post('/v1/seq-filter-export/', data={'format': 'csv'}).status_code == 400
+
+
+
+def test_seq_cluster(app_client):
+    from seqinfo import with_digits
+    from test_seqinfo import read_synthetic_clusters
+    clusters = read_synthetic_clusters()
+    singleton = next(ix for ix, members in enumerate(clusters) if len(members) == 1)
+    larger = next(ix for ix, members in enumerate(clusters) if len(members) > 1)
+    for ix90 in [singleton, larger]:
+        cluster_id = with_digits('GMSC10.90AA', ix90)
+        for ix100 in clusters[ix90]:
+            seq_id = with_digits('GMSC10.100AA', ix100)
+            r = app_client.get(f'/v1/seq-cluster/{seq_id}')
+            assert r.status_code == 200
+            assert r.get_json() == {'status': 'Ok', 'seq_id': seq_id, 'cluster': cluster_id}
+
+        r = app_client.get(f'/v1/cluster-info/{cluster_id}')
+        assert r.status_code == 200
+        members = r.get_json()['cluster']
+        assert [m['seq_id'] for m in members] == \
+                [with_digits('GMSC10.100AA', ix100) for ix100 in clusters[ix90]]
+        assert all('nucleotide' in m for m in members)
+
+    nr_seqs = sum(len(members) for members in clusters)
+    assert app_client.get(f'/v1/seq-cluster/{with_digits("GMSC10.100AA", nr_seqs)}').status_code == 404
+    assert app_client.get('/v1/seq-cluster/GMSC10.100AA.-1').status_code == 404
+    assert app_client.get(f'/v1/seq-cluster/{with_digits("GMSC10.90AA", 0)}').status_code == 400
+    assert app_client.get('/v1/seq-cluster/GMSC10.100AA').status_code == 400
+
+
+def test_search_results(app_client, monkeypatch):
+    import app
+    from search import save_search_result, delete_search_result
+    from searchregistry import DONE
+    r = {'q1': {'aminoacid': 'MKK', 'hits': [{'id': 'GMSC10.90AA.000_000_001', 'identity': 99.0}]}}
+    sid = app.registry.submit('>q1\nMKK\n', False, running=True)
+    assert app_client.get(f'/internal/seq-search/{sid}').get_json() == {'search_id': sid, 'status': 'Running'}
+    save_search_result(r, sid)
+    app.registry.finish(sid, DONE)
+    expected = {'results': r, 'search_id': sid, 'status': 'Done'}
+
+    # Streamed from disk in several chunks, then from the cache
+    monkeypatch.setattr(app, 'SEARCH_RESULT_CHUNK_SIZE', 7)
+    for _ in range(2):
+        resp = app_client.get(f'/internal/seq-search/{sid}')
+        assert resp.status_code == 200
+        assert resp.mimetype == 'application/json'
+        assert resp.get_json() == expected
+    assert app.search_result_cache.lookup(sid) is not None
+
+    # Results too large to be cached are always streamed
+    big = {f'q{i}': {'hits': []} for i in range(100)}
+    big_sid = app.registry.submit('>q1\nMKK\n', False, running=True)
+    save_search_result(big, big_sid)
+    app.registry.finish(big_sid, DONE)
+    monkeypatch.setattr(app, 'MAX_CACHED_SEARCH_RESULT', 100)
+    assert app_client.get(f'/internal/seq-search/{big_sid}').get_json()['results'] == big
+    assert app.search_result_cache.lookup(big_sid) is None
+
+    # Results deleted (by another process) are reported as expired
+    delete_search_result(big_sid)
+    resp = app_client.get(f'/internal/seq-search/{big_sid}')
+    assert resp.status_code == 200
+    assert resp.get_json() == {'search_id': big_sid, 'status': 'Expired'}
+
+    assert app_client.get('/internal/seq-search/0-none').status_code == 400
+
+
+def test_exact_search(app_client, monkeypatch):
+    import app
+    from seqinfo import with_digits
+    si = app.seqinfo90
+    ix = next(ix for ix in range(len(si.aastore)) if si.aastore.get(ix))
+    seqdata = f'>q1\n{si.aastore.get(ix).decode("ascii")}\n'
+    r = app_client.post('/internal/seq-search/', data={'sequence_faa': seqdata}).get_json()
+    sid = r['search_id']
+    r = app_client.get(f'/internal/seq-search/{sid}').get_json()
+    assert r['status'] == 'Done'
+    assert [hit['id'] for hit in r['results']['q1']['hits']] == [with_digits('GMSC10.90AA', ix)]
+
+    def fail(r, sid):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(app, 'save_search_result', fail)
+    r = app_client.post('/internal/seq-search/', data={'sequence_faa': seqdata}).get_json()
+    sid = r['search_id']
+    assert app_client.get(f'/internal/seq-search/{sid}').get_json() == {'search_id': sid, 'status': 'Failed'}
+
+
+def test_run_searches_save_failure(app_client, monkeypatch):
+    import app
+    from searchregistry import DONE
+    seqdata = '>q1\nMKK\n'
+    sids = [app.registry.submit(seqdata, False, running=True) for _ in range(2)]
+    monkeypatch.setattr(app, 'do_search_batch',
+                        lambda combined, _: {sid: {'q1': {'hits': []}} for sid, _ in combined})
+
+    def fail(r, sid):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(app, 'save_search_result', fail)
+    app.run_searches([(sid, seqdata, False) for sid in sids])
+    assert [app.registry.get_status(sid) for sid in sids] == ['Failed', 'Failed']
+
+    # Searches of a batch that was interrupted are not left running
+    sid = app.registry.submit(seqdata, False, running=True)
+    done = app.registry.submit(seqdata, False, running=True)
+    app.registry.finish(done, DONE)
+    app.fail_unfinished([(sid, seqdata, False), (done, seqdata, False)])
+    assert app.registry.get_status(sid) == 'Failed'
+    assert app.registry.get_status(done) == 'Done'
@@ -0,0 +1,132 @@
+import os
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import downloader
+from downloader import download
+
+DATA = os.urandom(1_000_003)
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    '''Serves DATA, with Range support (unless `server.ranges` is False)
+
+    Requests for ranges starting at an offset in `server.fail_at` fail, as
+    do the first `server.rate_limited` requests (with HTTP 429)
+    '''
+    def do_GET(self):
+        self.server.requests.append(self.headers.get('Range'))
+        r = self.headers.get('Range')
+        if self.server.rate_limited > 0:
+            self.server.rate_limited -= 1
+            self.send_response(429)
+            self.send_header('Retry-After', '7')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if r is None or not self.server.ranges:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(DATA)))
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+        start, end = r.removeprefix('bytes=').split('-')
+        start, end = int(start), int(end)
+        if start in self.server.fail_at:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206)
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(DATA[start:end + 1])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    httpd.requests = []
+    httpd.ranges = True
+    httpd.fail_at = set()
+    httpd.rate_limited = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+
+
+def test_download(tmp_path, server):
+    url = f'http://127.0.0.1:{server.server_port}/data'
+    target = str(tmp_path / 'data')
+    download(url, target, MD5, nr_connections=4, segment_size=65_536)
+    assert open(target, 'rb').read() == DATA
+    assert sorted(os.listdir(tmp_path)) == ['data']
+    # 1 probe + 16 segments
+    assert len(server.requests) == 17
+
+    # Existing files are only checked
+    download(url, target, MD5)
+    assert len(server.requests) == 17
+    with pytest.raises(IOError):
+        download(url, target, 'wrong')
+
+
+def test_resume(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(downloader, 'MAX_RETRIES', 0)
+    url = f'http://127.0.0.1:{server.server_port}/data'
+    target = str(tmp_path / 'data')
+    server.fail_at = {5 * 65_536}
+    with pytest.raises(IOError):
+        download(url, target, MD5, nr_connections=2, segment_size=65_536)
+    assert os.path.exists(target + '.part.state')
+    nr_first = len(server.requests)
+
+    server.fail_at = set()
+    download(url, target, MD5, nr_connections=2, segment_size=65_536)
+    assert open(target, 'rb').read() == DATA
+    # Segments completed in the first attempt are not downloaded again
+    assert len(server.requests) - nr_first < 17
+    assert sorted(os.listdir(tmp_path)) == ['data']
+
+
+def test_bad_hash(tmp_path, server):
+    url = f'http://127.0.0.1:{server.server_port}/data'
+    target = str(tmp_path / 'data')
+    with pytest.raises(IOError):
+        download(url, target, 'wrong', segment_size=65_536)
+    assert os.listdir(tmp_path) == []
+
+
+def test_no_ranges(tmp_path, server):
+    server.ranges = False
+    url = f'http://127.0.0.1:{server.server_port}/data'
+    target = str(tmp_path / 'data')
+    download(url, target, MD5, segment_size=65_536)
+    assert open(target, 'rb').read() == DATA
+
+
+def test_rate_limited(tmp_path, server, monkeypatch):
+    delays = []
+    monkeypatch.setattr(downloader, 'sleep', delays.append)
+    url = f'http://127.0.0.1:{server.server_port}/data'
+    target = str(tmp_path / 'data')
+    # The probe and then the first segment are rate limited
+    server.rate_limited = 2
+    download(url, target, MD5, nr_connections=1, segment_size=65_536)
+    assert open(target, 'rb').read() == DATA
+    assert delays == [7.0, 7.0]
+
+    # Without Retry-After, the delay doubles
+    server.fail_at = {65_536}
+    delays.clear()
+    with pytest.raises(IOError):
+        download(url, str(tmp_path / 'other'), MD5, nr_connections=1, segment_size=65_536)
+    assert delays == [downloader.RETRY_DELAY * 2**i for i in range(downloader.MAX_RETRIES)]
@@ -0,0 +1,34 @@
+import lzma
+import numpy as np
+import extract90aa
+from extract90aa import extract_90aa, with_digits_90aa
+
+
+def with_digits_100aa(n):
+    n = f'{n:09}'
+    return f'GMSC10.100AA.{n[:3]}_{n[3:6]}_{n[6:9]}'
+
+
+def test_extract_90aa(tmp_path, monkeypatch):
+    monkeypatch.setattr(extract90aa, 'MAX_100AA', 10_000)
+    rng = np.random.default_rng(4)
+    nr_seqs = 2_000
+    seqs = [''.join(rng.choice(list('ACGT'), size=rng.integers(30, 300))) for _ in range(nr_seqs)]
+    fna_file = str(tmp_path / 'GMSC10.100AA.fna.xz')
+    with lzma.open(fna_file, 'wt') as out:
+        for i, s in enumerate(seqs):
+            out.write(f'>{with_digits_100aa(i)}\n{s}\n')
+    # Representatives, in an order that differs from the 100AA order
+    reps = rng.choice(nr_seqs, size=700, replace=False)
+    sel90 = str(tmp_path / 'GMSC10.90AA.txt.xz')
+    with lzma.open(sel90, 'wt') as out:
+        for r in reps:
+            out.write(f'{with_digits_100aa(r)}\n')
+
+    expected = ''.join(f'>{with_digits_90aa(p)}\n{seqs[r]}\n' for p, r in enumerate(reps))
+    # Small buffers, so that the input is read in many batches
+    oname = str(tmp_path / 'GMSC10.90AA.fna')
+    extract_90aa(fna_file, sel90, oname, max_memory=4096)
+    assert open(oname).read() == expected
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+            ['GMSC10.100AA.fna.xz', 'GMSC10.90AA.fna', 'GMSC10.90AA.txt.xz']
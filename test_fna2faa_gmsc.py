@@ -0,0 +1,54 @@
+import numpy as np
+import fna2faa_gmsc
+from fna2faa_gmsc import translate, translate_batch, rc, SPECIAL_CASE_NUCLEOTIDES
+
+
+def random_seqs(n, seed=0):
+    rng = np.random.default_rng(seed)
+    codons = [a+b+c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT']
+    seqs = []
+    for i in range(n):
+        seq = str(rng.choice(['ATG', 'GTG', 'TTG', 'CCC']))
+        seq += ''.join(rng.choice(codons, size=rng.integers(1, 30)))
+        seq += str(rng.choice(['TAA', 'TAG', 'TGA', 'TGG', 'CCC']))
+        if rng.random() < .2:
+            seq = rc(seq)
+        if rng.random() < .1:
+            p = rng.integers(len(seq))
+            seq = seq[:p] + str(rng.choice(list('NRYX'))) + seq[p+1:]
+        if rng.random() < .05:
+            # RNA codons (within a DNA sequence)
+            p = 3 * rng.integers(len(seq) // 3)
+            seq = seq[:p] + seq[p:].replace('T', 'U', 1)
+        if rng.random() < .05:
+            seq = seq[:-1]
+        seqs.append(seq)
+    seqs.append(SPECIAL_CASE_NUCLEOTIDES)
+    seqs.append('ATGAUGTAA')
+    return seqs
+
+
+def translate_or_empty(seq):
+    try:
+        return translate(seq)
+    except (ValueError, KeyError):
+        return ''
+
+
+def test_translate_batch():
+    seqs = random_seqs(2000)
+    expected = [translate_or_empty(s) for s in seqs]
+    assert translate_batch(seqs, skip_invalid=True) == expected
+
+    valid = [s for s, aa in zip(seqs, expected) if aa]
+    assert translate_batch(valid) == [translate(s) for s in valid]
+
+
+def test_translate_fasta_chunk():
+    seqs = random_seqs(100, seed=1)
+    seqs = [s for s in seqs if translate_or_empty(s)]
+    fasta = ''.join(f'>seq{i}\n{s}\n' for i, s in enumerate(seqs))
+    chunks = list(fna2faa_gmsc.iter_fasta_chunks(fasta.splitlines(True), 7))
+    assert sum(len(h) for h, _ in chunks) == len(seqs)
+    out = ''.join(fna2faa_gmsc.translate_fasta_chunk(ch) for ch in chunks)
+    assert out == ''.join(f'>seq{i}\n{translate(s)}\n' for i, s in enumerate(seqs))
@@ -0,0 +1,54 @@
+import json
+import numpy as np
+import pytest
+import indexmanifest
+from indexmanifest import write_manifest, load_index, check_index_file, hash_file, IndexFormatError, MANIFEST_NAME
+from seqhash import HashIndexWriter, HashIndex
+
+
+def test_manifest(tmp_path):
+    index_dir = tmp_path / 'index'
+    index_dir.mkdir()
+    source = tmp_path / 'source.tsv'
+    source.write_text('data\n')
+    np.save(index_dir / 'codes.npy', np.arange(10, dtype=np.uint16))
+    (index_dir / 'labels.tsv').write_text('0\tx\n')
+    write_manifest(str(index_dir), [(str(source), *hash_file(str(source)))])
+
+    manifest = json.load(open(index_dir / MANIFEST_NAME))
+    assert manifest['files']['codes.npy'] == {'dtype': '<u2', 'shape': [10]}
+    assert manifest['files']['labels.tsv'] == {'size': 4}
+    assert np.all(load_index(str(index_dir / 'codes.npy')) == np.arange(10))
+
+    # An index rebuilt with a different layout is rejected
+    np.save(index_dir / 'codes.npy', np.arange(10, dtype=np.int64))
+    with pytest.raises(IndexFormatError):
+        load_index(str(index_dir / 'codes.npy'))
+
+    indexmanifest._manifests.clear()
+    source.write_text('other data\n')
+    with pytest.raises(IndexFormatError):
+        load_index(str(index_dir / 'codes.npy'))
+
+
+def test_index_readers(tmp_path):
+    index_dir = tmp_path / 'index'
+    index_dir.mkdir()
+    name = str(index_dir / 'seqs')
+    writer = HashIndexWriter(name)
+    writer.add([b'MKV', b'MKL'])
+    writer.close()
+    (index_dir / 'seqs.bin').write_bytes(b'MKVMKL')
+    write_manifest(str(index_dir), [])
+    indexmanifest._manifests.clear()
+    check_index_file(name + '.bin')
+    assert list(HashIndex(name).lookup([b'MKL'])[0]) == [1]
+
+    (index_dir / 'seqs.bin').write_bytes(b'MKVMKLM')
+    with pytest.raises(IndexFormatError):
+        check_index_file(name + '.bin')
+
+    np.save(name + '.hash.ix.npy', np.arange(2, dtype=np.uint64))
+    with pytest.raises(IndexFormatError):
+        HashIndex(name)
+    indexmanifest._manifests.clear()
@@ -0,0 +1,42 @@
+import numpy as np
+from kmerindex import build_kmer_index, KmerIndex, semiglobal_distances, AMINO_ACIDS
+
+def semiglobal_distance_reference(q, s):
+    prev = [0] * (len(s) + 1)
+    for i in range(len(q)):
+        cur = [i + 1]
+        for j in range(len(s)):
+            cur.append(min(prev[j] + (q[i] != s[j]), prev[j+1] + 1, cur[j] + 1))
+        prev = cur
+    return min(prev)
+
+def test_semiglobal_distances():
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        q = bytes(rng.choice(np.frombuffer(b'ACDE', np.uint8), size=rng.integers(1, 12)))
+        subjects = [bytes(rng.choice(np.frombuffer(b'ACDE', np.uint8), size=rng.integers(1, 15)))
+                        for _ in range(5)]
+        expected = [semiglobal_distance_reference(q, s) for s in subjects]
+        assert semiglobal_distances(q, subjects).tolist() == expected
+        assert semiglobal_distances(q, subjects, 2).tolist() == [min(d, 3) for d in expected]
+    assert semiglobal_distances(b'KLM', [b'AAKLMAA', b'AAKAMAA', b'KM']).tolist() == [0, 1, 1]
+    assert semiglobal_distances(b'KLMNP', [b'KLMNP', b'KAMNP', b'AAAAA', b'KAMAP'], 1).tolist() == [0, 1, 2, 2]
+
+
+def test_kmer_index(tmp_path):
+    rng = np.random.default_rng(5)
+    aas = np.frombuffer(AMINO_ACIDS, np.uint8)
+    seqs = [bytes(rng.choice(aas, size=rng.integers(30, 80))) for _ in range(500)]
+    seqs[7] = b'MXXXX' + seqs[7][5:]
+    data = np.frombuffer(b''.join(seqs), np.uint8)
+    starts = np.concatenate([[0], np.cumsum([len(s) for s in seqs])])
+    build_kmer_index(data, starts, f'{tmp_path}/seqs', batch_size=64)
+    index = KmerIndex(f'{tmp_path}/seqs')
+    assert np.all(np.diff(index.offsets.astype(np.int64)) >= 0)
+    assert index.offsets[-1] == len(index.postings)
+    for ix in [0, 7, 123, 499]:
+        q = bytearray(seqs[ix][:30])
+        # 3 substitutions (90% identity)
+        for p in (4, 14, 24):
+            q[p] = ord('W') if q[p] != ord('W') else ord('Y')
+        assert ix in index.candidates(bytes(q), 10, 1000).tolist()
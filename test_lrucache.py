@@ -0,0 +1,28 @@
+import numpy as np
+from lrucache import LRUCache, ENTRY_OVERHEAD
+
+
+def test_lru_cache():
+    # Room for two entries
+    cache = LRUCache(2 * (ENTRY_OVERHEAD + 30))
+    cache.put('a', b'x' * 20)
+    cache.put('b', b'y' * 20)
+    assert cache.lookup('a') == b'x' * 20
+    # 'b' is now the least recently used
+    cache.put('c', b'z' * 20)
+    assert cache.lookup('b') is None
+    assert cache.lookup('a') is not None
+    assert cache.get('d', lambda: b'w') == b'w'
+    assert cache.stats()['size'] <= cache.max_size
+
+
+def test_empty_values_are_evicted():
+    cache = LRUCache(100 * ENTRY_OVERHEAD, sizeof=lambda a: a.nbytes)
+    empty = np.zeros(0, np.int64)
+    for i in range(100_000):
+        cache.put(('query', i), empty)
+    stats = cache.stats()
+    assert stats['entries'] < 100
+    assert 0 < stats['size'] <= 100 * ENTRY_OVERHEAD
+    assert cache.lookup(('query', 99_999)) is not None
+    assert cache.lookup(('query', 0)) is None
@@ -0,0 +1,33 @@
+import numpy as np
+from packedseq import PackedSeqWriter, PackedNucleotideReader
+
+
+def test_roundtrip(tmp_path):
+    rng = np.random.default_rng(2)
+    seqs = []
+    for _ in range(500):
+        seq = bytearray(rng.choice(np.frombuffer(b'ACGT', np.uint8), size=rng.integers(1, 50)))
+        if rng.random() < .1:
+            seq[rng.integers(len(seq))] = ord(rng.choice(list('NRYKM')))
+        seqs.append(bytes(seq))
+    fname = str(tmp_path / 'seqs.fna.2bit')
+    writer = PackedSeqWriter(fname)
+    # Batches of odd sizes so that sequences straddle the 4-bases/byte boundaries
+    for i in range(0, len(seqs), 77):
+        writer.add(seqs[i:i+77])
+    writer.close()
+
+    reader = PackedNucleotideReader(fname)
+    assert len(reader) == len(seqs)
+    assert reader.offsets.lengths.dtype == np.uint8
+    for ix, seq in enumerate(seqs):
+        assert reader.get(ix) == seq
+
+    # Older stores, with the offset (in bases) of every sequence
+    starts = np.concatenate([[0], np.cumsum([len(s) for s in seqs])])
+    np.save(fname + '.starts.npy', starts.astype(np.uint64))
+    for ext in ['offsets', 'lengths']:
+        (tmp_path / f'seqs.fna.2bit.{ext}.npy').unlink()
+    legacy = PackedNucleotideReader(fname)
+    for ix in [0, 76, 77, 499]:
+        assert legacy.get(ix) == seqs[ix]
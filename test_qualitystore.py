@@ -0,0 +1,33 @@
+import polars as pl
+import numpy as np
+from qualitystore import QualityStore, write_quality_store
+
+def test_roundtrip(tmp_path):
+    df = pl.DataFrame({
+        'antifam': [True, False, None, False],
+        'terminal': [False, None, True, True],
+        'rnacode': pl.Series([0.25, 2.0, 0.5, None], dtype=pl.Float32),
+        'metat': pl.Series([3, None, 0, 5], dtype=pl.Int32),
+        'riboseq': pl.Series([None, 1, 2, 0], dtype=pl.Int32),
+        'metap': pl.Series([0.5, None, 0.125, 1.0], dtype=pl.Float32),
+        })
+    write_quality_store(df, f'{tmp_path}/q')
+    store = QualityStore(f'{tmp_path}/q')
+    assert len(store) == 4
+    ixs = np.array([3, 0, 1, 2])
+    assert store.rows(ixs) == [dict(zip(df.columns, row)) for row in df[ixs].rows()]
+
+    def reference(conditions):
+        from qualitystore import OPERATORS
+        expr = [OPERATORS[op](pl.col(c), v) for c, op, v in conditions]
+        expr = expr[0].and_(*expr[1:]).fill_null(False)
+        return df.select(expr).to_series().to_numpy()
+
+    for conditions in [
+            [('antifam', '==', False)],
+            [('terminal', '==', True), ('rnacode', '<=', 0.5)],
+            [('metat', '>=', 0)],
+            [('riboseq', '>=', 1), ('metap', '>=', 0.1)],
+            ]:
+        assert np.array_equal(store.matches(conditions, 0, 4), reference(conditions))
+        assert np.array_equal(store.matches(conditions, 1, 3), reference(conditions)[1:3])
@@ -0,0 +1,51 @@
+import numpy as np
+from recordoffsets import RecordOffsets, RecordStarts, write_record_offsets, write_record_lengths, OFFSET_STRIDE
+
+
+def test_record_offsets(tmp_path):
+    rng = np.random.default_rng(2)
+    for nr_records in [1, OFFSET_STRIDE, 1000]:
+        starts = np.concatenate([[0], np.cumsum(rng.integers(20, 400, size=nr_records))])
+        name = f'{tmp_path}/records{nr_records}'
+        write_record_offsets(starts, name)
+        offsets = RecordOffsets(name)
+        assert offsets.lengths.dtype == np.uint16
+        assert len(offsets) == nr_records
+        ixs = np.arange(nr_records)
+        s, e = offsets.spans(ixs)
+        assert np.all(s == starts[:-1])
+        assert np.all(e == starts[1:])
+        for ix in [0, nr_records // 2, nr_records - 1]:
+            assert offsets.span(ix) == (starts[ix], starts[ix + 1])
+
+        # Older indices
+        np.save(f'{tmp_path}/legacy{nr_records}.starts.npy', starts.astype(np.uint64))
+        legacy = RecordOffsets(f'{tmp_path}/legacy{nr_records}')
+        assert len(legacy) == nr_records
+        assert np.all(legacy.spans(ixs)[0] == s)
+
+
+def test_long_records(tmp_path):
+    starts = [0, 10, 100_010, 100_020]
+    write_record_offsets(starts, f'{tmp_path}/long')
+    offsets = RecordOffsets(f'{tmp_path}/long')
+    assert offsets.lengths.dtype == np.uint32
+    assert offsets.span(2) == (100_010, 100_020)
+
+
+def test_record_starts(tmp_path):
+    rng = np.random.default_rng(4)
+    lengths = rng.integers(0, 60, size=3 * OFFSET_STRIDE + 5)
+    starts = np.concatenate([[0], np.cumsum(lengths)])
+    write_record_lengths(lengths, f'{tmp_path}/short')
+    np.save(f'{tmp_path}/legacy.starts.npy', starts.astype(np.uint64))
+    for name in ['short', 'legacy']:
+        offsets = RecordOffsets(f'{tmp_path}/{name}')
+        view = RecordStarts(offsets)
+        assert len(view) == len(starts)
+        for b, e in [(0, len(starts)), (1, OFFSET_STRIDE + 1), (OFFSET_STRIDE, 2 * OFFSET_STRIDE + 3), (7, 7)]:
+            assert np.all(offsets.starts_range(b, e) == starts[b:e])
+            assert np.all(view[b:e] == starts[b:e])
+        assert view[-1] == starts[-1]
+        assert view[OFFSET_STRIDE + 3] == starts[OFFSET_STRIDE + 3]
+    assert RecordOffsets(f'{tmp_path}/short').lengths.dtype == np.uint8
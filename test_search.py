@@ -0,0 +1,87 @@
+from search import prefix_query_ids, split_search_results
+
+
+def test_split_search_results():
+    seqdata = prefix_query_ids('>a__1 x\nMKK\n>b\nMLL', '1-abcd') \
+            + prefix_query_ids('\n>a__1\nMAA\n', '2-efgh')
+    assert seqdata == '>1-abcd__a__1 x\nMKK\n>1-abcd__b\nMLL\n>2-efgh__a__1\nMAA\n'
+    r = {'1-abcd__a__1': {'hits': []}, '2-efgh__a__1': {'hits': [1]}}
+    assert split_search_results(r, ['1-abcd', '2-efgh', '3-ijkl']) == {
+            '1-abcd': {'a__1': {'hits': []}},
+            '2-efgh': {'a__1': {'hits': [1]}},
+            '3-ijkl': {},
+            }
+
+
+def check_same_as_reference(basedir):
+    import json
+    from search import parse_gmsc_mapper_results
+    from benchmark import parse_gmsc_mapper_results_reference
+    assert json.dumps(parse_gmsc_mapper_results(basedir)) \
+            == json.dumps(parse_gmsc_mapper_results_reference(basedir))
+
+
+def test_parse_gmsc_mapper_results_demo():
+    check_same_as_reference('demo_gmsc_mapper_output')
+
+
+def test_parse_gmsc_mapper_results_synthetic(tmp_path):
+    from benchmark import write_synthetic_mapper_output
+    write_synthetic_mapper_output(tmp_path, 200)
+    check_same_as_reference(tmp_path)
+
+
+def test_parse_gmsc_mapper_results_missing(tmp_path):
+    from benchmark import write_synthetic_mapper_output
+    write_synthetic_mapper_output(tmp_path, 50)
+    # Queries can be missing from some of the tables
+    with open(f'{tmp_path}/quality.out.smorfs.tsv') as f:
+        lines = f.readlines()
+    with open(f'{tmp_path}/quality.out.smorfs.tsv', 'wt') as f:
+        f.writelines(lines[:20] + lines[30:])
+    check_same_as_reference(tmp_path)
+
+
+def test_parse_fasta():
+    from search import parse_fasta
+    assert parse_fasta('\n>q1 some description\nMKK\nLLA\n>q2\nMAA*\n') == [
+            ('q1', 'MKKLLA'),
+            ('q2', 'MAA*'),
+            ]
+
+
+def test_search_result_store(tmp_path, monkeypatch):
+    import os
+    import json
+    import gzip
+    from search import save_search_result, open_search_result, search_result_path, \
+            delete_search_result, list_saved_searches
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('search-results')
+    r = {'q1': {'hits': [{'id': 'GMSC10.90AA.000_000_001', 'evalue': 1e-10}], 'habitat': 'soil'}}
+    save_search_result(r, '10-abcd')
+    save_search_result({}, '9-efgh')
+    assert search_result_path('10-abcd') == 'search-results/10-abcd.json.gz'
+    assert sorted(os.listdir('search-results')) == ['10-abcd.json.gz', '9-efgh.json.gz']
+    with gzip.open('search-results/10-abcd.json.gz') as f:
+        assert json.load(f) == r
+    # Stored as Flask would send it (compact, with sorted keys)
+    with open_search_result('10-abcd') as f:
+        assert f.read() == json.dumps(r, sort_keys=True, separators=(',', ':')).encode('ascii')
+
+    # Older, uncompressed results
+    with open('search-results/2-ijkl.json', 'wt') as out:
+        json.dump(r, out)
+    with open_search_result('2-ijkl') as f:
+        assert json.load(f) == r
+    assert list_saved_searches() == ['2-ijkl', '9-efgh', '10-abcd']
+
+    for sid in ['2-ijkl', '10-abcd']:
+        delete_search_result(sid)
+    assert list_saved_searches() == ['9-efgh']
+    try:
+        open_search_result('10-abcd')
+    except FileNotFoundError:
+        pass
+    else:
+        assert False, 'Expected FileNotFoundError'
@@ -0,0 +1,127 @@
+import pytest
+import searchregistry
+from searchregistry import SearchRegistry, QueueFullError
+
+def test_queue(tmp_path):
+    reg = SearchRegistry(f'{tmp_path}/searches.sqlite3', max_queued=2, max_running=1, batch_window=0)
+    s1 = reg.submit('>q\nMKK\n', False)
+    s2 = reg.submit('>q\nMLL\n', True)
+    with pytest.raises(QueueFullError):
+        reg.submit('>q\nMAA\n', False)
+    assert reg.get_status(s1) == 'Queued'
+    assert reg.claim() == [(s1, '>q\nMKK\n', False)]
+    assert reg.get_status(s1) == 'Running'
+    # Only one search can run at a time
+    assert reg.claim() == []
+    reg.finish(s1, 'Done')
+    assert reg.claim() == [(s2, '>q\nMLL\n', True)]
+    reg.finish(s2, 'Failed')
+    assert reg.list() == [(s1, 'Done'), (s2, 'Failed')]
+    assert reg.get_status('1-xxxx') is None
+
+    # Reopening the same database keeps the state
+    reg = SearchRegistry(f'{tmp_path}/searches.sqlite3', ttl=-1)
+    assert reg.get_status(s1) == 'Expired'
+    assert sorted(reg.expire()) == sorted([s1, s2])
+    assert reg.list() == [(s1, 'Expired'), (s2, 'Expired')]
+
+
+def test_reclaim_dead(tmp_path, monkeypatch):
+    reg = SearchRegistry(f'{tmp_path}/searches.sqlite3', max_running=1, batch_window=0)
+    sid = reg.submit('>q\nMKK\n', False)
+    assert reg.claim()[0][0] == sid
+    assert reg.claim() == []
+    # Simulate the process running the search dying
+    monkeypatch.setattr(searchregistry, '_pid_alive', lambda pid: False)
+    assert reg.claim()[0][0] == sid
+
+
+def test_batches(tmp_path):
+    reg = SearchRegistry(f'{tmp_path}/searches.sqlite3', max_running=1, max_batch=3, batch_window=0)
+    sids = [reg.submit(f'>q\nM{i}\n', i == 2) for i in range(6)]
+    # Contig searches are not batched with amino acid ones
+    assert [sid for sid, _, _ in reg.claim()] == [sids[0], sids[1], sids[3]]
+    # A batch counts as a single running search
+    assert reg.claim() == []
+    for sid in sids[:2] + sids[3:4]:
+        reg.finish(sid, 'Done')
+    assert [sid for sid, _, _ in reg.claim()] == [sids[2]]
+    reg.finish(sids[2], 'Done')
+    assert [sid for sid, _, _ in reg.claim()] == sids[4:]
+
+    reg = SearchRegistry(f'{tmp_path}/window.sqlite3', batch_window=3600)
+    reg.submit('>q\nMKK\n', False)
+    assert reg.claim() == []
+
+
+def test_import_saved(tmp_path):
+    reg = SearchRegistry(f'{tmp_path}/searches.sqlite3')
+    reg.import_saved([('3-abcd', 0.0), ('7-efgh', 1e12)])
+    assert reg.get_status('3-abcd') == 'Expired'
+    assert reg.get_status('7-efgh') == 'Done'
+    assert reg.submit('>q\nM\n', False).startswith('8-')
+
+
+
+def test_reclaim_reused_pid(tmp_path):
+    import sqlite3
+    from contextlib import closing
+    reg = SearchRegistry(f'{tmp_path}/searches.sqlite3', max_running=1, batch_window=0)
+    sid = reg.submit('>q\nMKK\n', False)
+    assert reg.claim()[0][0] == sid
+    assert reg.claim() == []
+    # The PID of the process running the search now belongs to another
+    # process (here, the same one, recorded with a different start time)
+    with closing(sqlite3.connect(reg.dbname, isolation_level=None)) as conn:
+        conn.execute("UPDATE searches SET worker_token = 'another-process'")
+    assert reg.claim()[0][0] == sid
+
+
+def test_reclaim_direct_search(tmp_path):
+    import sqlite3
+    from contextlib import closing
+    reg = SearchRegistry(f'{tmp_path}/searches.sqlite3', batch_window=0)
+    # Answered directly (never queued), so its input is not stored
+    sid = reg.submit('>q\nMKK\n', False, running=True)
+    with closing(sqlite3.connect(reg.dbname, isolation_level=None)) as conn:
+        conn.execute("UPDATE searches SET worker_token = 'another-process'")
+    assert reg.claim() == []
+    assert reg.get_status(sid) == 'Failed'
+
+
+def test_idle_claim_is_read_only(tmp_path, monkeypatch):
+    import sqlite3
+    from contextlib import closing
+    monkeypatch.setattr(searchregistry, 'SQLITE_TIMEOUT', 0.1)
+    reg = SearchRegistry(f'{tmp_path}/searches.sqlite3', max_running=1, batch_window=0)
+    sid = reg.submit('>q\nMKK\n', False)
+    assert reg.claim()[0][0] == sid
+    reg.submit('>q\nMKK\n', False)
+    with closing(sqlite3.connect(reg.dbname, isolation_level=None)) as conn:
+        # Another process holds the write lock
+        conn.execute('BEGIN IMMEDIATE')
+        # Nothing to do (too many searches running), so the lock is not needed
+        assert reg.claim() == []
+        conn.execute('COMMIT')
+    reg.finish(sid, 'Done')
+    assert len(reg.claim()) == 1
+    assert reg.claim() == []
+
+
+def test_process_token():
+    import os
+    import subprocess
+    import sys
+    token = searchregistry._process_token(os.getpid())
+    if token is None:
+        pytest.skip('/proc is not available')
+    assert searchregistry._process_token(os.getpid()) == token
+    child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(5)'])
+    try:
+        assert searchregistry._process_token(child.pid) not in (None, token)
+        assert searchregistry._worker_alive(child.pid, searchregistry._process_token(child.pid))
+        assert not searchregistry._worker_alive(child.pid, token)
+    finally:
+        child.kill()
+        child.wait()
+    assert not searchregistry._worker_alive(child.pid, None)
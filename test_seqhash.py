@@ -0,0 +1,47 @@
+import numpy as np
+from seqhash import HashIndexWriter, HashIndex
+
+def test_roundtrip(tmp_path):
+    seqs = [b'MKKLLA', b'', b'MAAAT', b'MKKLLAW', b'MQ']
+    writer = HashIndexWriter(f'{tmp_path}/seqs')
+    writer.add(seqs[:2])
+    writer.add(seqs[2:])
+    writer.close()
+    index = HashIndex(f'{tmp_path}/seqs')
+    assert len(index.hashes) == 4
+    assert np.all(np.diff(index.hashes.astype(np.float64)) >= 0)
+    rs = index.lookup([b'MAAAT', b'MQ', b'MKKLLA', b'MKKLL', b''])
+    assert [r.tolist() for r in rs] == [[2], [4], [0], [], []]
+
+
+def test_chunked_sort(tmp_path):
+    import os
+    rng = np.random.default_rng(7)
+    alphabet = np.frombuffer(b'ACDEFGHIKLMNPQRSTVWY', np.uint8)
+    seqs = [bytes(rng.choice(alphabet, size=rng.integers(0, 6))) for _ in range(3000)]
+    batches = [seqs[i:i+101] for i in range(0, len(seqs), 101)]
+
+    writer = HashIndexWriter(f'{tmp_path}/single')
+    for batch in batches:
+        writer.add(batch)
+    writer.close()
+    # Chunks of different sizes, merged in blocks smaller than the chunks
+    for chunk_size, block_size in [(250, 17), (1000, 1), (40, 1000)]:
+        writer = HashIndexWriter(f'{tmp_path}/chunked', chunk_size=chunk_size, block_size=block_size)
+        for batch in batches:
+            writer.add(batch)
+        assert len(writer.runs) > 1
+        writer.close()
+        assert sorted(os.listdir(tmp_path)) == [
+                'chunked.hash.ix.npy', 'chunked.hash.npy', 'single.hash.ix.npy', 'single.hash.npy']
+        for suffix in ['.hash.npy', '.hash.ix.npy']:
+            expected = np.load(f'{tmp_path}/single{suffix}')
+            actual = np.load(f'{tmp_path}/chunked{suffix}')
+            assert actual.dtype == expected.dtype
+            assert np.array_equal(actual, expected)
+
+    index = HashIndex(f'{tmp_path}/chunked')
+    # Short random sequences repeat, and all their indices are returned
+    for q in [b'MK', b'A', seqs[5], seqs[2999]]:
+        [r] = index.lookup([q])
+        assert r.tolist() == [i for i, s in enumerate(seqs) if s == q and s]
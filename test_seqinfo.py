@@ -7,3 +7,293 @@ def test_get_hits():
         matches = arr < t
         for n in [10, 100, 1000, 10_000, 100_000]:
             assert matches[seqinfo.get_hits(matches, n)].all()
+
+
+def test_find_hits():
+    import numpy as np
+    arr = np.random.random(100_000)
+    arr2 = np.random.random(100_000)
+    preds = [
+        lambda start, end: arr[start:end] < .3,
+        lambda start, end: arr2[start:end] > .5,
+        ]
+    [expected] = np.where((arr < .3) & (arr2 > .5))
+    expected = expected[::-1]
+    for n in [1, 10, 1000, 100_000]:
+        hits = seqinfo.find_hits(preds, len(arr), n)
+        assert np.all(hits == expected[:n])
+    assert np.all(seqinfo.find_hits([], len(arr), 10) == np.arange(len(arr) - 1, len(arr) - 11, -1))
+    assert len(seqinfo.find_hits([lambda start, end: arr[start:end] > 2], len(arr), 10)) == 0
+
+
+def test_habitat_predicate_bitmaps(synthetic_index):
+    import numpy as np
+    from seqinfo import SeqInfo
+    si = SeqInfo('90AA')
+    no_bitmaps = SeqInfo('90AA')
+    no_bitmaps.__dict__['habitat_bitmaps'] = None
+    assert si.habitat_bitmaps is not None
+    # Terms with spaces are plain substrings too
+    assert si.habitat_predicate(['human gut']).__name__ == 'habitat_pred'
+    n = len(si.habitat_ix)
+    for habitat_q in [
+            ['marine'],
+            ['gut'],
+            ['human gut'],
+            ['plant associated', 'soil'],
+            ['pig gut', 'marine'],
+            ['an g'],
+            ['nothing'],
+            ]:
+        expected = np.ones(n, bool)
+        for q in habitat_q:
+            expected &= si.habitat.str.contains(q).values[si.habitat_ix]
+        for start, end in [(0, n), (3, n - 5), (17, 18)]:
+            assert np.array_equal(si.habitat_predicate(habitat_q)(start, end), expected[start:end])
+            assert np.array_equal(no_bitmaps.habitat_predicate(habitat_q)(start, end), expected[start:end])
+
+
+def test_taxonomy_clades(synthetic_index):
+    from seqinfo import SeqInfo
+    si = SeqInfo('90AA')
+    lineages = si.taxonomy.values
+    for clade in si.taxonomy_clades.itertuples():
+        members = [i for i, t in enumerate(lineages)
+                        if t == clade.clade or t.startswith(clade.clade + ';')]
+        assert members == list(range(clade.start, clade.end))
+
+
+def test_taxonomy_ranges(synthetic_index):
+    import numpy as np
+    from seqinfo import SeqInfo
+    si = SeqInfo('90AA')
+    n = len(si.taxonomy_ix)
+    for taxonomy_q in [
+            's__Escherichia coli',
+            'Proteobacteria',
+            'p__Proteobacteria',
+            'Bacteria',
+            'Lactobac',
+            'nothing',
+            ]:
+        ranges = si.taxonomy_ranges(taxonomy_q)
+        assert ranges is not None
+        # Sorted, disjoint, and not adjacent (i.e., merged)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            assert end < start
+        matches = si.taxonomy.str.contains(taxonomy_q).values
+        covered = np.zeros(len(matches), bool)
+        for start, end in ranges:
+            covered[start:end] = True
+        assert np.array_equal(covered, matches)
+
+        expected = matches[si.taxonomy_ix]
+        assert np.array_equal(si.taxonomy_predicate(taxonomy_q)(0, n), expected)
+        assert np.array_equal(si.taxonomy_predicate(taxonomy_q)(5, n - 3), expected[5:n-3])
+
+    assert si.taxonomy_ranges('p__Proteobacteria;') is None
+    assert si.taxonomy_ranges('Proteobacteria|Archaea') is None
+
+
+def test_normalize_filter_query():
+    from seqinfo import normalize_filter_query
+    key = normalize_filter_query(True, ['soil', 'marine'], 'Bacteria', quality_metat=2)
+    for equivalent in [
+            normalize_filter_query(1, ['marine', 'soil'], 'Bacteria', quality_metat=2),
+            normalize_filter_query(True, ['marine', 'soil', 'marine'], 'Bacteria', quality_metat=2.0),
+            normalize_filter_query(True, ['soil', 'marine'], 'Bacteria', quality_metat=2, quality_metap=None),
+            ]:
+        assert equivalent == key
+        assert hash(equivalent) == hash(key)
+    assert normalize_filter_query(False, [], None) == normalize_filter_query(False, [], '')
+    for different in [
+            normalize_filter_query(False, ['soil', 'marine'], 'Bacteria', quality_metat=2),
+            normalize_filter_query(True, ['soil'], 'Bacteria', quality_metat=2),
+            normalize_filter_query(True, ['soil', 'marine'], 'Archaea', quality_metat=2),
+            normalize_filter_query(True, ['soil', 'marine'], 'Bacteria', quality_metat=3),
+            normalize_filter_query(True, ['soil', 'marine'], 'Bacteria', quality_metap=2),
+            normalize_filter_query(True, ['soil', 'marine'], 'Bacteria', quality_antifam=True, quality_metat=2),
+            ]:
+        assert different != key
+
+
+def test_seq_filter_cache(synthetic_index):
+    from seqinfo import SeqInfo
+    si = SeqInfo('90AA')
+    query = dict(hq_only=False, habitat_q=['soil', 'gut'], taxonomy_q='Bacteria', quality_metat=1)
+    first = si.seq_filter(**query)
+    assert first
+    assert si.filter_cache.stats()['misses'] == 1
+    assert si.seq_filter(**query) == first
+    # The same query (with the habitats in another order)
+    assert si.seq_filter(**dict(query, habitat_q=['gut', 'soil'])) == first
+    assert si.filter_cache.stats()['hits'] == 2
+    assert si.filter_cache.stats()['misses'] == 1
+    assert SeqInfo('90AA').seq_filter(**query) == first
+
+    before_ix = int(first[len(first) // 2]['seq_id'].split('.')[2].replace('_', ''))
+    continued = si.seq_filter(**query, before_ix=before_ix)
+    assert si.filter_cache.stats()['misses'] == 2
+    assert continued == si.seq_filter(**query, before_ix=before_ix)
+    assert [r['seq_id'] for r in continued] == [r['seq_id'] for r in first[len(first) // 2 + 1:]]
+
+
+def check_get_many(reader, ixs, monkeypatch):
+    import seqinfo
+    expected = [reader.get(ix) for ix in ixs]
+    nr_reads = 0
+    read = reader.read
+    def counted_read(start, end):
+        nonlocal nr_reads
+        nr_reads += 1
+        return read(start, end)
+    monkeypatch.setattr(reader, 'read', counted_read)
+    for max_merged_read, max_read_gap in [(1, 0), (500, 200), (4000, 10_000), (1 << 30, 1 << 30)]:
+        monkeypatch.setattr(seqinfo, 'MAX_MERGED_READ', max_merged_read)
+        monkeypatch.setattr(seqinfo, 'MAX_READ_GAP', max_read_gap)
+        nr_reads = 0
+        assert reader.get_many(ixs) == expected
+        if max_merged_read == 1:
+            assert nr_reads == len(ixs)
+        elif max_merged_read == 1 << 30:
+            assert nr_reads == 1
+        else:
+            assert 1 < nr_reads < len(ixs)
+
+
+def test_indexed_fasta_reader_get_many(tmp_path, monkeypatch):
+    import numpy as np
+    from benchmark import write_synthetic_fasta
+    from seqinfo import IndexedFastaReader
+    fname = str(tmp_path / 'seqs.fna')
+    write_synthetic_fasta(fname, 300)
+    reader = IndexedFastaReader(fname)
+    ixs = np.unique(np.random.default_rng(4).integers(0, 300, size=120))
+    check_get_many(reader, ixs, monkeypatch)
+
+
+def test_indexed_fasta_reader_get_many_xz(synthetic_index, monkeypatch):
+    import numpy as np
+    from seqinfo import IndexedFastaReader, BASE_DIR
+    reader = IndexedFastaReader(f'{BASE_DIR}/GMSC10.100AA.fna.xz')
+    assert reader.blockreader is not None
+    ixs = np.unique(np.random.default_rng(5).integers(0, len(reader.offsets), size=200))
+    check_get_many(reader, ixs, monkeypatch)
+
+
+def test_get_seqinfo_multi(synthetic_index):
+    import numpy as np
+    from seqinfo import SeqInfo, with_digits
+    for database in ['90AA', '100AA']:
+        si = SeqInfo(database)
+        n = len(si.habitat_ix)
+        rng = np.random.default_rng(6)
+        # Unsorted, with repeats
+        seq_ids = [with_digits(f'GMSC10.{database}', ix)
+                        for ix in rng.integers(0, n, size=50).tolist() + [0, n - 1, 0]]
+        assert si.get_seqinfo_multi(seq_ids) == [si.get_seqinfo(seq_id) for seq_id in seq_ids]
+
+
+def read_synthetic_clusters():
+    '''Returns the list of members (100AA indices) of each 90AA cluster'''
+    import lzma
+    clusters = []
+    with lzma.open('gmsc-db/GMSC10.cluster.sorted2.tsv.xz', 'rt') as f:
+        for line in f:
+            ix100, ix90 = [int(tok.split('.')[2].replace('_', '')) for tok in line.split()]
+            if ix90 == len(clusters):
+                clusters.append([])
+            clusters[ix90].append(ix100)
+    return clusters
+
+
+def test_cluster_reverse_index(synthetic_index):
+    from seqinfo import ClusterIx
+    clusters = read_synthetic_clusters()
+    assert any(len(members) == 1 for members in clusters)
+    assert any(len(members) > 1 for members in clusters)
+    cix = ClusterIx()
+    nr_seqs = 0
+    for ix90, members in enumerate(clusters):
+        assert cix.get_cluster_members(ix90).tolist() == members
+        for ix100 in members:
+            assert cix.get_cluster(ix100) == ix90
+        nr_seqs += len(members)
+    assert cix.get_cluster(nr_seqs) is None
+    assert cix.get_cluster(10**8) is None
+    assert cix.get_cluster(-1) is None
+
+
+def test_lazy_resource_loads_once():
+    import threading
+    from time import sleep
+    from seqinfo import lazy_resource
+    class Resources:
+        def __init__(self):
+            self.load_times = {}
+            self.nr_loads = 0
+
+        @lazy_resource
+        def value(self):
+            self.nr_loads += 1
+            sleep(.05)
+            return object()
+    r = Resources()
+    start = threading.Barrier(8)
+    values = []
+    def access():
+        start.wait()
+        values.append(r.value)
+    threads = [threading.Thread(target=access) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert r.nr_loads == 1
+    assert all(v is values[0] for v in values)
+    assert 'value' in r.load_times
+
+
+def test_lazy_resource_instances_load_independently():
+    import threading
+    from seqinfo import lazy_resource
+    b_loading = threading.Event()
+    class Resources:
+        def __init__(self, name):
+            self.name = name
+            self.load_times = {}
+
+        @lazy_resource
+        def value(self):
+            if self.name == 'a':
+                # Only returns once b has started loading
+                return b_loading.wait(timeout=5)
+            b_loading.set()
+            return True
+    a = Resources('a')
+    b = Resources('b')
+    t = threading.Thread(target=lambda: a.value)
+    t.start()
+    b.value
+    t.join()
+    assert a.value
+
+
+def test_hq_bitset(synthetic_index):
+    import numpy as np
+    from seqinfo import SeqInfo
+    si = SeqInfo('90AA')
+    assert si.hq_bitset is not None
+    old = SeqInfo('90AA')
+    old.__dict__['hq_bitset'] = None
+    assert old.is_hq is not None
+    assert old.is_hq.any()
+    n = len(si.habitat_ix)
+    [pred] = si.filter_predicates(True, [], '')
+    [old_pred] = old.filter_predicates(True, [], '')
+    for start, end in [(0, n), (1, n - 1), (5, 13), (8, 16), (n - 3, n)]:
+        assert np.array_equal(pred(start, end), old.is_hq[start:end])
+        assert np.array_equal(old_pred(start, end), old.is_hq[start:end])
+    ixs = np.arange(n)
+    assert np.array_equal(si.is_high_quality(ixs), old.is_high_quality(ixs))
+    assert si.seq_filter(True, ['soil'], '') == old.seq_filter(True, ['soil'], '')
@@ -0,0 +1,37 @@
+import xz
+import numpy as np
+import xzblocks
+
+
+def make_multiblock_xz(fname, data, block_size):
+    with xz.open(fname, 'wb') as f:
+        for i in range(0, len(data), block_size):
+            f.write(data[i:i+block_size])
+            f.change_block()
+
+
+def test_read_block_layout(tmp_path):
+    data = bytes(np.random.default_rng(0).integers(0, 4, size=100_000).astype(np.uint8) + ord('A'))
+    fname = str(tmp_path / 'data.xz')
+    make_multiblock_xz(fname, data, 7_000)
+    blocks = xzblocks.read_block_layout(fname)
+    assert len(blocks) == (len(data) + 6_999) // 7_000
+    assert blocks[:, xzblocks.UNCOMPRESSED_SIZE].sum() == len(data)
+
+    reader = xzblocks.XZBlockReader(fname, blocks, cache_bytes=20_000)
+    for start, end in [(0, 10), (6_990, 7_010), (13_000, 30_000), (99_990, 100_000), (5, 100_000)]:
+        assert reader.read(start, end) == data[start:end]
+    assert reader.cache.cur_size <= 20_000 or len(reader.cache.values) == 1
+
+
+def test_read_block_layout_multistream(tmp_path):
+    import lzma
+    fname = str(tmp_path / 'data.xz')
+    with open(fname, 'wb') as out:
+        out.write(lzma.compress(b'first stream\n'))
+        out.write(b'\0' * 8) # stream padding
+        out.write(lzma.compress(b'second stream\n'))
+    blocks = xzblocks.read_block_layout(fname)
+    assert len(blocks) == 2
+    reader = xzblocks.XZBlockReader(fname, blocks, cache_bytes=1_000)
+    assert reader.read(0, 27) == b'first stream\nsecond stream\n'
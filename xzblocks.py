@@ -0,0 +1,111 @@
+'''Random access into .xz files, one block at a time
+
+Every xz stream ends with an index listing the compressed and uncompressed
+size of each of its blocks. From it, we build a table with the position of
+every block in the file, so that a single block can be decompressed without
+touching the rest of the file (files compressed with `xz --threads` have many
+independent blocks).
+'''
+import os
+import lzma
+
+import numpy as np
+from lrucache import LRUCache
+from xz.common import (
+        create_xz_header,
+        create_xz_index_footer,
+        parse_xz_footer,
+        parse_xz_index,
+        round_up,
+        )
+
+# Columns of the block table
+COMPRESSED_START = 0
+UNPADDED_SIZE = 1
+UNCOMPRESSED_START = 2
+UNCOMPRESSED_SIZE = 3
+CHECK = 4
+
+XZ_HEADER_SIZE = 12
+XZ_FOOTER_SIZE = 12
+
+def read_block_layout(fname):
+    '''Reads the block table of an xz file
+
+    Returns an array of shape (nr_blocks, 5), see the column constants above
+    '''
+    streams = []
+    with open(fname, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            f.seek(end - 4)
+            if f.read(4) == b'\0\0\0\0':
+                # stream padding
+                end -= 4
+                continue
+            f.seek(end - XZ_FOOTER_SIZE)
+            check, backward_size = parse_xz_footer(f.read(XZ_FOOTER_SIZE))
+            index_start = end - XZ_FOOTER_SIZE - backward_size
+            f.seek(index_start)
+            records = parse_xz_index(f.read(backward_size))
+            stream_start = index_start \
+                    - sum(round_up(unpadded) for unpadded, _ in records) \
+                    - XZ_HEADER_SIZE
+            streams.append((stream_start, check, records))
+            end = stream_start
+
+    blocks = []
+    ustart = 0
+    for stream_start, check, records in reversed(streams):
+        cstart = stream_start + XZ_HEADER_SIZE
+        for unpadded, usize in records:
+            blocks.append((cstart, unpadded, ustart, usize, check))
+            cstart += round_up(unpadded)
+            ustart += usize
+    return np.array(blocks, dtype=np.uint64).reshape((-1, 5))
+
+
+def decompress_block(fd, block):
+    '''Decompresses a single block (a row of the block table)'''
+    cstart, unpadded, _, usize, check = (int(v) for v in block)
+    data = os.pread(fd, round_up(unpadded), cstart)
+    # Wrap the block in a minimal stream so that lzma checks its integrity
+    return lzma.decompress(
+            create_xz_header(check)
+            + data
+            + create_xz_index_footer(check, [(unpadded, usize)]),
+            format=lzma.FORMAT_XZ)
+
+
+class XZBlockReader:
+    '''Reads arbitrary byte ranges of the uncompressed contents of an xz file
+
+    Only the blocks overlapping the requested range are decompressed
+    '''
+    def __init__(self, fname, blocks, cache_bytes):
+        self.fname = fname
+        self.fd = os.open(fname, os.O_RDONLY)
+        self.blocks = blocks
+        self.ustarts = np.asarray(blocks[:, UNCOMPRESSED_START])
+        # Blocks are read with pread, so the file descriptor can be shared
+        # (including with child processes after fork)
+        self.cache = LRUCache(cache_bytes)
+
+    def get_block(self, b):
+        return self.cache.get(b, lambda: decompress_block(self.fd, self.blocks[b]))
+
+    def read(self, start, end):
+        b = int(np.searchsorted(self.ustarts, start, side='right')) - 1
+        chunks = []
+        while start < end and b < len(self.blocks):
+            data = self.get_block(b)
+            offset = start - int(self.ustarts[b])
+            chunk = data[offset:offset + (end - start)]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            start += len(chunk)
+            b += 1
+        if len(chunks) == 1:
+            return chunks[0]
+        return b''.join(chunks)